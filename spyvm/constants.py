@@ -153,6 +153,7 @@ objects_in_special_object_table = {
     "interrupt_semaphore" : SO_USER_INTERRUPT_SEMAPHORE,
     "timerSemaphore" : SO_TIMER_SEMAPHORE,
     "runWithIn" : SO_RUN_WITH_IN,
+    "LargeNegativeInteger" : SO_LARGENEGATIVEINTEGER_CLASS, # nil in mini.image
 }
 
 LONG_BIT = 32
@@ -201,6 +202,11 @@ def decode_compiled_method_header(header):
 #
 
 INTERRUPT_COUNTER_SIZE = 10000
+# Target interval between two interrupt checks, the counter above is adapted
+# to it at runtime (VM parameter 26, interruptChecksEveryNms).
+INTERRUPT_CHECKS_EVERY_MS = 5
+MIN_INTERRUPT_COUNTER_SIZE = 100
+MAX_INTERRUPT_COUNTER_SIZE = 1 << 24
 CompileTime = time.time()
 
 SYSTEM_ATTRIBUTE_IMAGE_NAME_INDEX = 1
\ No newline at end of file
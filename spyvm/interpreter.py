@@ -6,6 +6,9 @@ sys.setrecursionlimit(1000000)
 from spyvm.storage_contexts import ContextPartShadow, ActiveContext, InactiveContext, DirtyContext
 from spyvm import model, constants, wrapper, objspace, interpreter_bytecodes, error
 from spyvm.error import MetaPrimFailed
+from spyvm.util import clock
+from spyvm.util.timer_heap import TimerHeap
+from spyvm.util.io_waiters import IOWaiters
 
 from rpython.rlib import jit, rstackovf, unroll, objectmodel, rsignal
 
@@ -16,14 +19,15 @@ class ReturnFromTopLevel(Exception):
     def __init__(self, object):
         self.object = object
 
+# Only raised for non-local returns and returns from dirty contexts. Local
+# returns are passed as return value from loop_bytecodes to stack_frame.
 class Return(Exception):
-    _attrs_ = ["value", "s_target_context", "is_local", "arrived_at_target"]
-    _immutable_fields_ = ["value", "s_target_context", "is_local"]
+    _attrs_ = ["value", "s_target_context", "arrived_at_target"]
+    _immutable_fields_ = ["value", "s_target_context"]
     def __init__(self, s_target_context, w_result):
         self.value = w_result
         self.s_target_context = s_target_context
         self.arrived_at_target = False
-        self.is_local = s_target_context is None
 
 class NonVirtualReturn(Exception):
     _attrs_ = ["s_target_context", "s_current_context", "value"]
@@ -57,7 +61,11 @@ class ProcessSwitch(ContextSwitchException):
     Triggered when switching the process."""
     type = "Process Switch"
 
-UNROLLING_BYTECODE_RANGES = unroll.unrolling_iterable(interpreter_bytecodes.BYTECODE_RANGES)
+# One entry per bytecode. Interpreter.step compares the bytecode for equality
+# only, so after translation the unrolled chain of comparisons is merged into
+# a single C switch (see rpython/translator/backendopt/merge_if_blocks.py).
+UNROLLING_BYTECODE_DISPATCH = unroll.unrolling_iterable(
+    enumerate(interpreter_bytecodes.BYTECODE_METHOD_NAMES))
 
 def get_printable_location(pc, self, method):
     bc = ord(method.bytes[pc])
@@ -73,7 +81,9 @@ class Interpreter(object):
                           "evented",
                           "interrupts",
                           "trace_important",
-                          "interrupt_counter_size",
+                          "quicken",
+                          "timers",
+                          "io_waiters",
                           "trace"]
 
     jit_driver = jit.JitDriver(
@@ -84,14 +94,14 @@ class Interpreter(object):
     )
 
     def __init__(self, space, image=None, trace_important=False,
-                trace=False, evented=True, interrupts=True):
+                trace=False, evented=True, interrupts=True, quicken=False):
         # === Initialize immutable variables
         self.space = space
         self.image = image
         if image:
             self.startup_time = image.startup_time
         else:
-            self.startup_time = constants.CompileTime
+            self.startup_time = clock.startup_milliseconds()
         self.evented = evented
         self.interrupts = interrupts
         self.trace_important = trace_important
@@ -100,10 +110,16 @@ class Interpreter(object):
         except KeyError:
             self.interrupt_counter_size = constants.INTERRUPT_COUNTER_SIZE
         self.trace = trace
+        self.quicken = quicken
+        self.timers = TimerHeap()
+        self.io_waiters = IOWaiters()
 
         # === Initialize mutable variables
         self.interrupt_check_counter = self.interrupt_counter_size
-        self.next_wakeup_tick = 0
+        self.interrupt_checks_every_ms = constants.INTERRUPT_CHECKS_EVERY_MS
+        self.last_interrupt_check = 0
+        self.current_tick = 0
+        self.timer_semaphore_id = 0 # the timer of SIGNAL_AT_MILLISECONDS
         self.trace_proxy = objspace.ConstantFlag()
         self.stack_depth = 0
 
@@ -116,10 +132,11 @@ class Interpreter(object):
             name = "w_" + name
             if name not in self.space.objtable or not self.space.objtable[name]:
                 if name == "w_runWithIn":
-                    w_string = self.space.wrap_string("run:with:in:")
-                    self.space.objtable[name] = self.perform(w_string, selector="asSymbol")
+                    self.space.objtable[name] = self.intern_symbol("run:with:in:")
                     assert self.space.objtable[name]
                     pass;
+                elif name == "w_LargeNegativeInteger":
+                    self.space.objtable[name] = self.space.w_nil
                 else:
                     raise Exception("don't know how to populate " + name + " which was not in special objects table")
 
@@ -129,8 +146,7 @@ class Interpreter(object):
         while True:
             s_sender = s_context.s_sender()
             try:
-                self.stack_frame(s_context, None)
-                raise Exception("loop_bytecodes left without raising...")
+                w_result = self.stack_frame(s_context, None)
             except ContextSwitchException, e:
                 if self.is_tracing() or self.trace_important:
                     e.print_trace()
@@ -144,9 +160,14 @@ class Interpreter(object):
                 s_context = self.unwind_context_chain(ret.s_current_context, ret.s_target_context, ret.value)
             except MetaPrimFailed, e:
                 s_context = self.unwind_primitive_simulation(e.s_frame, e.error_code)
+            else:
+                # The frame returned locally to its sender.
+                s_context = self.unwind_context_chain(s_sender, s_sender, w_result)
 
     # This is a wrapper around loop_bytecodes that cleanly enters/leaves the frame,
     # handles the stack overflow protection mechanism and handles/dispatches Returns.
+    # A local return pushes its value onto s_sender without raising. Without a
+    # s_sender (only in loop()), the value is returned instead.
     def stack_frame(self, s_frame, s_sender, may_context_switch=True):
         try:
             if self.is_tracing():
@@ -156,7 +177,7 @@ class Interpreter(object):
             # Now (continue to) execute the context bytecodes
             # assert s_frame.state is InactiveContext
             s_frame.state = ActiveContext
-            self.loop_bytecodes(s_frame, may_context_switch)
+            w_result = self.loop_bytecodes(s_frame, may_context_switch)
         except rstackovf.StackOverflow:
             rstackovf.check_stack_overflow()
             raise StackOverflow(s_frame)
@@ -164,17 +185,22 @@ class Interpreter(object):
             if s_frame.state is DirtyContext:
                 s_sender = s_frame.s_sender() # The sender has changed!
                 s_frame._activate_unwind_context(self)
-                target_context = s_sender if ret.is_local else ret.s_target_context
-                raise NonVirtualReturn(target_context, s_sender, ret.value)
+                raise NonVirtualReturn(ret.s_target_context, s_sender, ret.value)
             else:
                 s_frame._activate_unwind_context(self)
-                if ret.is_local or ret.s_target_context is s_sender:
+                if ret.s_target_context is s_sender:
                     ret.arrived_at_target = True
                 raise ret
+        else:
+            s_frame._activate_unwind_context(self)
         finally:
             if self.is_tracing():
                 self.stack_depth -= 1
             s_frame.state = InactiveContext
+        if s_sender is None:
+            return w_result
+        s_sender.push(w_result)
+        return None
 
     def loop_bytecodes(self, s_context, may_context_switch=True):
         old_pc = 0
@@ -195,12 +221,16 @@ class Interpreter(object):
                 pc=pc, self=self, method=method,
                 s_context=s_context)
             try:
-                self.step(s_context)
+                w_result = self.step(s_context)
             except Return, ret:
                 if ret.arrived_at_target:
                     s_context.push(ret.value)
                 else:
                     raise ret
+            else:
+                if w_result is not None:
+                    # A local return, see ContextPartShadow._return.
+                    return w_result
 
     def unwind_primitive_simulation(self, start_context, error_code):
         if start_context is None:
@@ -251,16 +281,19 @@ class Interpreter(object):
             if USE_SIGUSR1: self.check_sigusr(context)
 
 
+        if self.quicken and not jit.we_are_jitted():
+            # Traces see the plain bytecodes, so they do not need this.
+            superinstruction = context.w_method().superinstructions()[context.pc()]
+            if superinstruction != interpreter_bytecodes.NO_SUPERINSTRUCTION:
+                return context.run_superinstruction(self, superinstruction)
         bytecode = context.fetch_next_bytecode()
-        for entry in UNROLLING_BYTECODE_RANGES:
-            if len(entry) == 2:
-                bc, methname = entry
-                if bytecode == bc:
-                    return getattr(context, methname)(self, bytecode)
-            else:
-                start, stop, methname = entry
-                if start <= bytecode <= stop:
-                    return getattr(context, methname)(self, bytecode)
+        if not objectmodel.we_are_translated():
+            # Untranslated, the chain below would be a linear scan.
+            methname = interpreter_bytecodes.BYTECODE_METHOD_NAMES[bytecode]
+            return getattr(context, methname)(self, bytecode)
+        for bc, methname in UNROLLING_BYTECODE_DISPATCH:
+            if bytecode == bc:
+                return getattr(context, methname)(self, bytecode)
         assert 0, "unreachable"
 
     # ============== Methods for handling user interrupts ==============
@@ -270,50 +303,117 @@ class Interpreter(object):
             return
         # Normally, the tick counter is decremented by 1 for every message send.
         # Since we don't know how many messages are called during this trace, we
-        # just decrement by 1000th of the trace length (num of bytecodes).
+        # just decrement by 1000th of the trace length (num of bytecodes), but
+        # at least by 1 so short loops check, too. The counter size adapts to
+        # whatever unit this ends up being (see adapt_interrupt_counter_size).
         trace_length = jit.current_trace_length()
-        decr_by = int(trace_length // 1000)
-        if decr_by > 0:
-            self.quick_check_for_interrupt(s_frame, decr_by)
+        decr_by = int(trace_length // 1000) + 1
+        self.quick_check_for_interrupt(s_frame, decr_by)
 
     def quick_check_for_interrupt(self, s_frame, dec=1):
         if not self.interrupts:
             return
         self.interrupt_check_counter -= dec
         if self.interrupt_check_counter <= 0:
-            self.interrupt_check_counter = self.interrupt_counter_size
             self.check_for_interrupts(s_frame)
 
+    def force_check_for_interrupts(self, s_frame):
+        if not self.interrupts:
+            return
+        self.check_for_interrupts(s_frame, forced=True)
+
+    def adapt_interrupt_counter_size(self, now):
+        # Like interruptChecksEveryNms in the Squeak VM: grow the counter while
+        # checks come too often, shrink it while they come too late.
+        target = self.interrupt_checks_every_ms
+        elapsed = now - self.last_interrupt_check
+        if target <= 0 or elapsed < 0: # disabled, or the clock wrapped around
+            return
+        size = self.interrupt_counter_size
+        if elapsed < target:
+            size += size // 8 + 1
+        elif elapsed > target:
+            size -= size // 8
+        if size < constants.MIN_INTERRUPT_COUNTER_SIZE:
+            size = constants.MIN_INTERRUPT_COUNTER_SIZE
+        elif size > constants.MAX_INTERRUPT_COUNTER_SIZE:
+            size = constants.MAX_INTERRUPT_COUNTER_SIZE
+        self.interrupt_counter_size = size
+
     def check_sigusr(self, s_frame):
         poll = rsignal.pypysig_poll()
         if poll == rsignal.SIGUSR1:
             print s_frame.print_stack()
 
-    def check_for_interrupts(self, s_frame):
+    def check_for_interrupts(self, s_frame, forced=False):
         # parallel to Interpreter>>#checkForInterrupts
 
         # Profiling is skipped
-        # We don't adjust the check counter size
 
         # use the same time value as the primitive MILLISECOND_CLOCK
-        now = self.time_now()
+        now = self.current_tick = self.time_now()
+
+        # Forced checks don't tell anything about the speed of execution.
+        if not forced:
+            self.adapt_interrupt_counter_size(now)
+        self.last_interrupt_check = now
+        self.interrupt_check_counter = self.interrupt_counter_size
 
         # XXX the low space semaphore may be signaled here
         # Process inputs
         # Process User Interrupt?
-        if not self.next_wakeup_tick == 0 and now >= self.next_wakeup_tick:
-            self.next_wakeup_tick = 0
-            semaphore = self.space.objtable["w_timerSemaphore"]
-            if not semaphore.is_nil(self.space):
-                wrapper.SemaphoreWrapper(self.space, semaphore).signal(s_frame)
+        self.signal_expired_timers(s_frame, now)
+        if self.io_waiters.size() > 0:
+            self.signal_ready_io(s_frame, 0)
         # We have no finalization process, so far.
         # We do not support external semaphores.
         # In cog, the method to add such a semaphore is only called in GC.
 
+    def signal_at(self, w_semaphore, tick):
+        return self.timers.add(tick, w_semaphore)
+
+    def signal_expired_timers(self, s_frame, now):
+        while self.timers.has_expired(now):
+            w_semaphore = self.timers.pop()
+            if self.timers.has_expired(now):
+                # Signaling may switch processes and end this check, make the
+                # next one come right away to signal the remaining timers.
+                self.interrupt_check_counter = 0
+            wrapper.SemaphoreWrapper(self.space, w_semaphore).signal(s_frame)
+        self.interrupt_check_counter = self.interrupt_counter_size
+
+    def signal_ready_io(self, s_frame, timeout):
+        ready = self.io_waiters.poll(timeout)
+        for i in range(len(ready)):
+            w_semaphore = self.io_waiters.remove(ready[i])
+            if i < len(ready) - 1:
+                # see signal_expired_timers
+                self.interrupt_check_counter = 0
+            wrapper.SemaphoreWrapper(self.space, w_semaphore).signal(s_frame)
+        self.interrupt_check_counter = self.interrupt_counter_size
+
+    def idle(self, s_frame, microseconds):
+        # Block until a file descriptor is ready, the next timer is due or the
+        # given time has passed, whatever comes first.
+        timeout = (microseconds + 999) // 1000
+        if self.timers.size() > 0:
+            until_next_timer = self.timers.next_deadline() - self.time_now()
+            if until_next_timer < timeout:
+                timeout = until_next_timer
+        if timeout < 0:
+            timeout = 0
+        self.signal_ready_io(s_frame, timeout)
+
     def time_now(self):
-        import time
         from rpython.rlib.rarithmetic import intmask
-        return intmask(int((time.time() - self.startup_time) * 1000) & constants.TAGGED_MASK)
+        return intmask((clock.monotonic_milliseconds() - self.startup_time) & constants.TAGGED_MASK)
+
+    def cached_time_now(self):
+        # The tick of the last interrupt check. Cheaper than time_now, for
+        # callers that can live with being a few milliseconds late.
+        if self.current_tick == 0:
+            self.current_tick = self.time_now()
+        return self.current_tick
 
     # ============== Convenience methods for executing code ==============
 
@@ -331,10 +431,7 @@ class Interpreter(object):
     def create_toplevel_context(self, w_receiver, selector="", w_selector=None, w_arguments=[]):
         if w_selector is None:
             assert selector, "Need either string or W_Object selector"
-            if selector == "asSymbol":
-                w_selector = self.image.w_asSymbol
-            else:
-                w_selector = self.perform(self.space.wrap_string(selector), "asSymbol")
+            w_selector = self.intern_symbol(selector)
 
         w_method = model.W_CompiledMethod(self.space, header=512)
         w_method.literalatput0(self.space, 1, w_selector)
@@ -346,6 +443,19 @@ class Interpreter(object):
         s_frame.push_all(list(w_arguments))
         return s_frame
 
+    def intern_symbol(self, string):
+        """ The Symbol for string, from the symbol table of the space if it
+        is there. Otherwise the image finds or creates it with
+        String>>asSymbol, and the table remembers it. """
+        w_symbol = self.space.symbol_table.lookup(self.space, string)
+        if w_symbol is not None:
+            return w_symbol
+        if string == "asSymbol":
+            return self.image.w_asSymbol
+        w_symbol = self.perform(self.space.wrap_string(string), "asSymbol")
+        self.space.symbol_table.add(self.space, w_symbol)
+        return w_symbol
+
     # ============== Methods for tracing and printing ==============
 
     def is_tracing(self):
@@ -1,8 +1,10 @@
+import operator
 from spyvm.storage_contexts import ContextPartShadow, DirtyContext
 from spyvm.storage_classes import ClassShadow
 from spyvm import model, primitives, wrapper, error
 from spyvm.util.bitmanipulation import splitter
 from rpython.rlib import objectmodel, unroll, jit
+from rpython.rlib.rarithmetic import ovfcheck
 
 # unrolling_zero has been removed from rlib at some point.
 if hasattr(unroll, "unrolling_zero"):
@@ -56,6 +58,96 @@ def make_call_primitive_bytecode(primitive, selector, argcount, store_pc=False):
     callPrimitive.func_name = "callPrimitive_%s" % func.func_name
     return callPrimitive
 
+# Inlined fast paths for the arithmetic special selectors. They answer the
+# result, or None if the operation overflows or the primitive would fail.
+def int_add(space, a, b):
+    try:
+        return space.wrap_int(ovfcheck(a + b))
+    except OverflowError:
+        return None
+
+def int_sub(space, a, b):
+    try:
+        return space.wrap_int(ovfcheck(a - b))
+    except OverflowError:
+        return None
+
+def int_mul(space, a, b):
+    try:
+        return space.wrap_int(ovfcheck(a * b))
+    except OverflowError:
+        return None
+
+def int_divide(space, a, b):
+    if b == 0 or a % b != 0:
+        return None
+    return space.wrap_int(a // b)
+
+def int_mod(space, a, b):
+    if b == 0:
+        return None
+    return space.wrap_int(a % b)
+
+def int_div(space, a, b):
+    if b == 0:
+        return None
+    return space.wrap_int(a // b)
+
+def int_bit_and(space, a, b):
+    return space.wrap_int(a & b)
+
+def int_bit_or(space, a, b):
+    return space.wrap_int(a | b)
+
+def float_add(space, a, b):
+    return space.wrap_float(a + b)
+
+def float_sub(space, a, b):
+    return space.wrap_float(a - b)
+
+def float_mul(space, a, b):
+    return space.wrap_float(a * b)
+
+def float_divide(space, a, b):
+    if b == 0.0:
+        return None
+    return space.wrap_float(a / b)
+
+def make_compare(op):
+    @objectmodel.specialize.argtype(1)
+    def compare(space, a, b):
+        return space.wrap_bool(op(a, b))
+    compare.func_name = "compare_%s" % op.__name__
+    return compare
+
+compare_lt = make_compare(operator.lt)
+compare_gt = make_compare(operator.gt)
+compare_le = make_compare(operator.le)
+compare_ge = make_compare(operator.ge)
+compare_eq = make_compare(operator.eq)
+compare_ne = make_compare(operator.ne)
+
+def make_arithmetic_bytecode(selector, int_op, float_op=None):
+    # Like make_call_primitive_bytecode, but the SmallInteger and Float cases
+    # are computed inline. Everything else is a normal send, which still
+    # tries the primitive of the method found.
+    @bytecode_implementation()
+    def arithmeticBytecode(self, interp, current_bytecode):
+        w_arg = self.peek(0)
+        w_rcvr = self.peek(1)
+        w_result = None
+        if isinstance(w_rcvr, model.W_SmallInteger) and isinstance(w_arg, model.W_SmallInteger):
+            w_result = int_op(interp.space, w_rcvr.value, w_arg.value)
+        elif float_op is not None and isinstance(w_rcvr, model.W_Float) and isinstance(w_arg, model.W_Float):
+            w_result = float_op(interp.space, w_rcvr.value, w_arg.value)
+        if w_result is not None:
+            self.pop_n(2)
+            self.push(w_result)
+            return
+        return self._sendSelfSelectorSpecial(selector, 1, interp)
+    arithmeticBytecode.func_name = "arithmeticBytecode_%s" % int_op.func_name
+    return arithmeticBytecode
+
 def make_call_primitive_bytecode_classbased(a_class_name, a_primitive, alternative_class_name, alternative_primitive, selector, argcount):
     @bytecode_implementation()
     def callClassbasedPrimitive(self, interp, current_bytecode):
@@ -187,6 +279,9 @@ class __extend__(ContextPartShadow):
            newArray = interp.space.wrap_list(self.pop_and_return_n(arraySize))
         else:
            newArray = interp.space.w_Array.as_class_get_shadow(interp.space).new(arraySize)
+        profiler = interp.space.strategy_factory.profiler
+        if profiler.active:
+            profiler.record_allocation(newArray, self)
         self.push(newArray)
 
     # ====== Extended Push/Pop bytecodes ======
@@ -287,21 +382,33 @@ class __extend__(ContextPartShadow):
     def _sendSelfSelector(self, w_selector, argcount, interp):
         receiver = self.peek(argcount)
         return self._sendSelector(w_selector, argcount, interp,
-                                  receiver, receiver.class_shadow(self.space))
+                                  receiver, receiver.class_shadow(self.space),
+                                  send_site=True)
 
     def _sendSuperSelector(self, w_selector, argcount, interp):
         compiledin_class = self.w_method().compiled_in()
         assert isinstance(compiledin_class, model.W_PointersObject)
         s_compiledin = compiledin_class.as_class_get_shadow(self.space)
         return self._sendSelector(w_selector, argcount, interp, self.w_receiver(),
-                                  s_compiledin.s_superclass())
+                                  s_compiledin.s_superclass(), send_site=True)
+
+    def _lookup(self, w_selector, receiverclassshadow, send_site=False):
+        if jit.we_are_jitted():
+            # Inside traces, the lookup is constant-folded on the class version.
+            return receiverclassshadow.lookup(w_selector)
+        method_cache = self.space.method_cache
+        if send_site:
+            cache = self.w_method().inline_cache_at(self.pc(), w_selector)
+            return cache.lookup(w_selector, receiverclassshadow, method_cache)
+        return method_cache.lookup(receiverclassshadow, w_selector)
 
     @objectmodel.specialize.argtype(7)
     def _sendSelector(self, w_selector, argcount, interp,
-                      receiver, receiverclassshadow, w_arguments=None, s_fallback=None):
+                      receiver, receiverclassshadow, w_arguments=None, s_fallback=None,
+                      send_site=False):
         assert argcount >= 0
         try:
-            w_method = receiverclassshadow.lookup(w_selector)
+            w_method = self._lookup(w_selector, receiverclassshadow, send_site)
         except error.MethodNotFound:
             if w_arguments:
                 self.push_all(w_arguments)
@@ -355,6 +462,8 @@ class __extend__(ContextPartShadow):
         s_class = receiver.class_shadow(space)
 
         try:
+            # Not through the method cache: these sends are rare, and the
+            # selector can be missing (None) from the special objects.
             w_method = s_class.lookup(w_special_selector)
         except error.MethodNotFound:
             if w_args:
@@ -424,13 +533,14 @@ class __extend__(ContextPartShadow):
         # it will find the sender as a local, and we don't have to
         # force the reference
         # EXECPT someone fiddled with our context chain!
+        # Local returns do not raise, the value is handed back through
+        # Interpreter.step and loop_bytecodes to stack_frame.
         if (self.home_is_self() or local_return) \
             and not(self.state == DirtyContext):
-            s_return_to = None
-        else:
-            s_return_to = self.s_home().s_sender()
-            assert s_return_to, "No sender to return to!"
+            return return_value
 
+        s_return_to = self.s_home().s_sender()
+        assert s_return_to, "No sender to return to!"
         from spyvm.interpreter import Return
         raise Return(s_return_to, return_value)
 
@@ -530,8 +640,9 @@ class __extend__(ContextPartShadow):
             from spyvm.interpreter import Return
             try:
                 self.bytecodePrimValue(interp, 0)
-            except Return, ret:
                 # Local return value of ensure: block is ignored
+                self.pop()
+            except Return, ret:
                 if not ret.arrived_at_target:
                     raise ret
             finally:
@@ -595,22 +706,22 @@ class __extend__(ContextPartShadow):
 
     # ====== Bytecodes implemented with primitives and message sends ======
 
-    bytecodePrimAdd = make_call_primitive_bytecode(primitives.ADD, "+", 1)
-    bytecodePrimSubtract = make_call_primitive_bytecode(primitives.SUBTRACT, "-", 1)
-    bytecodePrimLessThan = make_call_primitive_bytecode (primitives.LESSTHAN, "<", 1)
-    bytecodePrimGreaterThan = make_call_primitive_bytecode(primitives.GREATERTHAN, ">", 1)
-    bytecodePrimLessOrEqual = make_call_primitive_bytecode(primitives.LESSOREQUAL,  "<=", 1)
-    bytecodePrimGreaterOrEqual = make_call_primitive_bytecode(primitives.GREATEROREQUAL,  ">=", 1)
-    bytecodePrimEqual = make_call_primitive_bytecode(primitives.EQUAL,   "=", 1)
-    bytecodePrimNotEqual = make_call_primitive_bytecode(primitives.NOTEQUAL,  "~=", 1)
-    bytecodePrimMultiply = make_call_primitive_bytecode(primitives.MULTIPLY,  "*", 1)
-    bytecodePrimDivide = make_call_primitive_bytecode(primitives.DIVIDE,  "/", 1)
-    bytecodePrimMod = make_call_primitive_bytecode(primitives.MOD, "\\\\", 1)
+    bytecodePrimAdd = make_arithmetic_bytecode("+", int_add, float_add)
+    bytecodePrimSubtract = make_arithmetic_bytecode("-", int_sub, float_sub)
+    bytecodePrimLessThan = make_arithmetic_bytecode("<", compare_lt, compare_lt)
+    bytecodePrimGreaterThan = make_arithmetic_bytecode(">", compare_gt, compare_gt)
+    bytecodePrimLessOrEqual = make_arithmetic_bytecode("<=", compare_le, compare_le)
+    bytecodePrimGreaterOrEqual = make_arithmetic_bytecode(">=", compare_ge, compare_ge)
+    bytecodePrimEqual = make_arithmetic_bytecode("=", compare_eq, compare_eq)
+    bytecodePrimNotEqual = make_arithmetic_bytecode("~=", compare_ne, compare_ne)
+    bytecodePrimMultiply = make_arithmetic_bytecode("*", int_mul, float_mul)
+    bytecodePrimDivide = make_arithmetic_bytecode("/", int_divide, float_divide)
+    bytecodePrimMod = make_arithmetic_bytecode("\\\\", int_mod)
     bytecodePrimMakePoint = make_call_primitive_bytecode(primitives.MAKE_POINT, "@", 1)
     bytecodePrimBitShift = make_call_primitive_bytecode(primitives.BIT_SHIFT, "bitShift:", 1)
-    bytecodePrimDiv = make_call_primitive_bytecode(primitives.DIV, "//", 1)
-    bytecodePrimBitAnd = make_call_primitive_bytecode(primitives.BIT_AND, "bitAnd:", 1)
-    bytecodePrimBitOr = make_call_primitive_bytecode(primitives.BIT_OR, "bitOr:", 1)
+    bytecodePrimDiv = make_arithmetic_bytecode("//", int_div)
+    bytecodePrimBitAnd = make_arithmetic_bytecode("bitAnd:", int_bit_and)
+    bytecodePrimBitOr = make_arithmetic_bytecode("bitOr:", int_bit_or)
 
     bytecodePrimAt = make_send_selector_bytecode("at:", 1)
     bytecodePrimAtPut = make_send_selector_bytecode("at:put:", 2)
@@ -632,6 +743,49 @@ class __extend__(ContextPartShadow):
     bytecodePrimPointX = make_send_selector_bytecode("x", 0)
     bytecodePrimPointY = make_send_selector_bytecode("y", 0)
 
+    # ====== Superinstructions ======
+
+    def _pushSimple(self, interp, bytecode):
+        # Only called for bytecodes accepted by is_simple_push().
+        if bytecode <= 15:
+            self.pushReceiverVariableBytecode(interp, bytecode)
+        elif bytecode <= 31:
+            self.pushTemporaryVariableBytecode(interp, bytecode)
+        elif bytecode <= 63:
+            self.pushLiteralConstantBytecode(interp, bytecode)
+        elif bytecode == 112:
+            self.pushReceiverBytecode(interp, bytecode)
+        elif bytecode == 113:
+            self.pushConstantTrueBytecode(interp, bytecode)
+        elif bytecode == 114:
+            self.pushConstantFalseBytecode(interp, bytecode)
+        elif bytecode == 115:
+            self.pushConstantNilBytecode(interp, bytecode)
+        elif bytecode == 116:
+            self.pushConstantMinusOneBytecode(interp, bytecode)
+        elif bytecode == 117:
+            self.pushConstantZeroBytecode(interp, bytecode)
+        elif bytecode == 118:
+            self.pushConstantOneBytecode(interp, bytecode)
+        elif bytecode == 119:
+            self.pushConstantTwoBytecode(interp, bytecode)
+        else:
+            assert 0, "not a simple push"
+
+    def run_superinstruction(self, interp, superinstruction):
+        # The fused bytecodes are fetched one by one, so the pc is always
+        # the same as when executing them separately.
+        self._pushSimple(interp, self.fetch_next_bytecode())
+        if superinstruction == PUSH_RETURN_TOP:
+            return self.returnTopFromMethodBytecode(interp, self.fetch_next_bytecode())
+        assert superinstruction == PUSH_PUSH_ARITHMETIC
+        self._pushSimple(interp, self.fetch_next_bytecode())
+        bytecode = self.fetch_next_bytecode()
+        for bc, methname in UNROLLING_ARITHMETIC_BYTECODES:
+            if bytecode == bc:
+                return getattr(self, methname)(interp, bytecode)
+        assert 0, "unreachable"
+
     def debug_bytecode(self, interp):
         # Hook used in interpreter_debugging
         pass
@@ -742,3 +896,50 @@ def initialize_bytecode_table():
 
 # this table is only used for creating named bytecodes in tests and printing
 BYTECODE_TABLE = initialize_bytecode_table()
+
+def initialize_bytecode_method_names():
+    result = [None] * 256
+    for entry in BYTECODE_RANGES:
+        if len(entry) == 2:
+            positions = [entry[0]]
+        else:
+            positions = range(entry[0], entry[1]+1)
+        for pos in positions:
+            result[pos] = entry[-1]
+    assert None not in result
+    return result
+
+# The name of the ContextPartShadow method implementing each bytecode.
+BYTECODE_METHOD_NAMES = initialize_bytecode_method_names()
+
+# ___________________________________________________________________________
+# Quickening: fused superinstructions for common bytecode sequences,
+# optionally executed by Interpreter.step outside of traces.
+
+NO_SUPERINSTRUCTION = 0
+PUSH_PUSH_ARITHMETIC = 1 # <push> <push> <arithmetic special selector>
+PUSH_RETURN_TOP = 2      # <push> returnTopFromMethod
+
+UNROLLING_ARITHMETIC_BYTECODES = unroll.unrolling_iterable(
+    [(bc, BYTECODE_METHOD_NAMES[bc]) for bc in range(176, 192)])
+
+def is_simple_push(bytecode):
+    # Push receiver variable, temporary, literal constant, receiver or constant.
+    return bytecode <= 63 or 112 <= bytecode <= 119
+
+def quicken(bytes):
+    """Return the superinstruction starting at each pc of the given bytecodes.
+    Every entry only depends on the bytes following it, so jumps into the
+    middle of a fused sequence still execute correctly."""
+    size = len(bytes)
+    result = [NO_SUPERINSTRUCTION] * size
+    for pc in range(size - 1):
+        if not is_simple_push(ord(bytes[pc])):
+            continue
+        second = ord(bytes[pc + 1])
+        if second == 124:
+            result[pc] = PUSH_RETURN_TOP
+        elif (pc + 2 < size and is_simple_push(second) and
+                176 <= ord(bytes[pc + 2]) <= 191):
+            result[pc] = PUSH_PUSH_ARITHMETIC
+    return result
@@ -55,10 +55,12 @@ def activate_debugging():
 
     @patch_context
     def _sendSelector(original):
-        def meth(self, w_selector, argcount, interp, receiver, receiverclassshadow, w_arguments=None):
+        def meth(self, w_selector, argcount, interp, receiver, receiverclassshadow, w_arguments=None,
+                 s_fallback=None, send_site=False):
             if interp.step_sends:
                 _break() # Continue stepping from here to get to the current message send
-            return original(self, w_selector, argcount, interp, receiver, receiverclassshadow, w_arguments=w_arguments)
+            return original(self, w_selector, argcount, interp, receiver, receiverclassshadow, w_arguments=w_arguments,
+                            s_fallback=s_fallback, send_site=send_site)
         return meth
 
     @patch_context
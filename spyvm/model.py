@@ -10,6 +10,7 @@ Squeak model.
             W_AbstractObjectWithClassReference
                 W_PointersObject
                 W_BytesObject
+                W_LargeInteger
                 W_WordsObject
             W_CompiledMethod
                 W_SpurCompiledMethod
@@ -18,9 +19,11 @@ Squeak model.
 import sys, math
 from spyvm import constants, error
 from spyvm.util.version import constant_for_version, constant_for_version_arg, VersionMixin, Version
+from spyvm.util.word_buffer import WordBuffer
 
-from rpython.rlib import rrandom, objectmodel, jit, signature, longlong2float
-from rpython.rlib.rarithmetic import intmask, r_uint, r_int, ovfcheck, r_longlong
+from rpython.rlib import rrandom, objectmodel, jit, signature, longlong2float, rgc
+from rpython.rlib.rarithmetic import intmask, r_uint, r_int, ovfcheck, r_longlong, r_ulonglong
+from rpython.rlib.rbigint import rbigint
 from rpython.rlib.debug import make_sure_not_resized
 from rpython.tool.pairtype import extendabletype
 from rpython.rlib.objectmodel import instantiate, compute_hash, import_from_mixin, we_are_translated
@@ -180,6 +183,9 @@ class W_Object(object):
     def unwrap_longlong(self, space):
         raise error.UnwrappingError("Got unexpected class unwrap_longlong")
 
+    def unwrap_rbigint(self, space):
+        raise error.UnwrappingError("Got unexpected class unwrap_rbigint")
+
     def unwrap_char(self, space):
         raise error.UnwrappingError
 
@@ -280,6 +286,9 @@ class W_SmallInteger(W_Object):
     def unwrap_longlong(self, space):
         return r_longlong(self.value)
 
+    def unwrap_rbigint(self, space):
+        return rbigint.fromint(self.value)
+
     def unwrap_float(self, space):
         return float(self.value)
 
@@ -326,7 +335,9 @@ class W_AbstractObjectWithIdentityHash(W_Object):
 
     def gethash(self):
         if self.hash == self.UNASSIGNED_HASH:
-            self.hash = hash = intmask(self.hash_generator.genrand32()) // 2
+            # Only 12 bits, like the hashes of the objects in the image. The
+            # object header has no room for more, so a snapshot keeps them.
+            self.hash = hash = intmask(self.hash_generator.genrand32()) & 0xfff
             return hash
         return self.hash
 
@@ -421,6 +432,9 @@ class W_LargePositiveInteger1Word(W_AbstractObjectWithIdentityHash):
     def unwrap_longlong(self, space):
         return r_longlong(r_uint(self.value))
 
+    def unwrap_rbigint(self, space):
+        return rbigint.fromrarith_int(r_uint(self.value))
+
     def unwrap_float(self, space):
         return float(self.value)
 
@@ -659,9 +673,7 @@ class W_PointersObject(W_AbstractObjectWithClassReference):
     def fillin(self, space, g_self):
         W_AbstractObjectWithClassReference.fillin(self, space, g_self)
         # Recursive fillin required to enable specialized storage strategies.
-        for g_obj in g_self.pointers:
-            g_obj.fillin(space)
-        pointers = g_self.get_pointers()
+        pointers = g_self.fillin_pointers(space)
         storage_type = space.strategy_factory.strategy_type_for(pointers, weak=False) # do not fill in weak lists, yet
         space.strategy_factory.set_initial_strategy(self, storage_type, len(pointers), pointers)
 
@@ -821,25 +833,49 @@ class W_PointersObject(W_AbstractObjectWithClassReference):
         self._storage, w_other._storage = w_other._storage, self._storage
         W_AbstractObjectWithClassReference._become(self, w_other)
 
-    @jit.unroll_safe
+    def copy_from(self, space, w_source, start, stop, src_start):
+        """Copy the fields from src_start on of w_source into start..stop
+        (exclusive). Overlapping ranges are fine. If both objects use the
+        same storage strategy, the storage is copied without boxing."""
+        assert isinstance(w_source, W_PointersObject)
+        if not (0 <= start <= stop <= self.size() and
+                0 <= src_start <= src_start + stop - start <= w_source.size()):
+            raise IndexError
+        self._get_strategy().copy_from(self, w_source, start, stop, src_start)
+
+    def fill(self, space, start, stop, w_value):
+        if not 0 <= start <= stop <= self.size():
+            raise IndexError
+        self._get_strategy().fill(self, start, stop, w_value)
+
+    def copy_slice(self, space, start, stop):
+        """A new object with the fields start..stop (exclusive), keeping the
+        storage strategy."""
+        if not 0 <= start <= stop <= self.size():
+            raise IndexError
+        return self._get_strategy().copy_slice(self, start, stop)
+
+    def concat(self, space, w_other):
+        assert isinstance(w_other, W_PointersObject)
+        return self._get_strategy().concat(self, w_other)
+
     def clone(self, space):
-        my_pointers = self.fetch_all(space)
-        w_result = W_PointersObject(space, self.getclass(space), len(my_pointers))
-        w_result.store_all(space, my_pointers)
-        return w_result
+        return self.copy_slice(space, 0, self.size())
 
 class W_BytesObject(W_AbstractObjectWithClassReference):
-    _attrs_ = ['version', 'bytes', '_size', 'c_bytes']
+    # The bytes are a list of chars, which is a flat char array after
+    # translation. It never moves once handed out to C code, see
+    # convert_to_c_layout.
+    _attrs_ = ['version', 'bytes']
     repr_classname = 'W_BytesObject'
     bytes_per_slot = 1
-    _immutable_fields_ = ['version?', 'bytes?', '_size?', 'c_bytes?']
+    _immutable_fields_ = ['version?', 'bytes?']
 
     def __init__(self, space, w_class, size):
         W_AbstractObjectWithClassReference.__init__(self, space, w_class)
         assert isinstance(size, int)
         self.mutate()
-        self.bytes = ['\x00'] * size
-        self._size = size
+        self.bytes = rgc.resizable_list_supporting_raw_ptr(['\x00'] * size)
 
     def mutate(self):
         self.version = Version()
@@ -847,8 +883,7 @@ class W_BytesObject(W_AbstractObjectWithClassReference):
     def fillin(self, space, g_self):
         W_AbstractObjectWithClassReference.fillin(self, space, g_self)
         self.mutate()
-        self.bytes = g_self.get_bytes()
-        self._size = len(self.bytes)
+        self.bytes = rgc.resizable_list_supporting_raw_ptr(g_self.get_bytes())
 
     def at0(self, space, index0):
         return space.wrap_int(ord(self.getchar(index0)))
@@ -857,19 +892,35 @@ class W_BytesObject(W_AbstractObjectWithClassReference):
         self.setchar(index0, chr(space.unwrap_int(w_value)))
 
     def getchar(self, n0):
-        if self.bytes is None:
-            if n0 >= self._size:
-                raise IndexError
-            return self.c_bytes[n0]
-        else:
-            return self.bytes[n0]
+        return self.bytes[n0]
 
     def setchar(self, n0, character):
         assert len(character) == 1
-        if self.bytes is None:
-            self.c_bytes[n0] = character
-        else:
-            self.bytes[n0] = character
+        self.bytes[n0] = character
+        self.mutate()
+
+    def getslice(self, start, stop):
+        assert 0 <= start <= stop <= self.size()
+        return "".join(self.bytes[start:stop])
+
+    def setslice(self, start, string):
+        """Overwrite the bytes from start on with the given string."""
+        stop = start + len(string)
+        if not 0 <= start <= stop <= self.size():
+            raise IndexError
+        self.bytes[start:stop] = list(string)
+        self.mutate()
+
+    def copy_bytes_from(self, w_source, start, stop, src_start):
+        """Copy the bytes from src_start on of w_source into start..stop
+        (exclusive) of the receiver. Overlapping ranges are fine."""
+        assert isinstance(w_source, W_BytesObject)
+        src_stop = src_start + stop - start
+        if not (0 <= start <= stop <= self.size() and
+                0 <= src_start <= src_stop <= w_source.size()):
+            raise IndexError
+        # slice assignment of equally long slices is an array copy
+        self.bytes[start:stop] = w_source.bytes[src_start:src_stop]
         self.mutate()
 
     def short_at0(self, space, index0):
@@ -892,7 +943,7 @@ class W_BytesObject(W_AbstractObjectWithClassReference):
         self.setchar(byte_index0 + 1, chr(byte1))
 
     def size(self):
-        return self._size
+        return len(self.bytes)
 
     def str_content(self):
         if self.has_class() and self.w_class.has_space():
@@ -905,10 +956,7 @@ class W_BytesObject(W_AbstractObjectWithClassReference):
 
     @jit.elidable
     def _pure_as_string(self, version):
-        if self.bytes is None:
-            return "".join([self.c_bytes[i] for i in range(self.size())])
-        else:
-            return "".join(self.bytes)
+        return "".join(self.bytes)
 
     def selector_string(self):
         return "#" + self.unwrap_string(None)
@@ -930,7 +978,7 @@ class W_BytesObject(W_AbstractObjectWithClassReference):
         size = self.size()
         if size != other.size():
             return False
-        elif size > 256 and self.bytes is not None and other.bytes is not None:
+        elif size > 256:
             return self.bytes == other.bytes
         else:
             return self.has_same_chars(other, size)
@@ -944,11 +992,8 @@ class W_BytesObject(W_AbstractObjectWithClassReference):
 
     def clone(self, space):
         size = self.size()
-        w_result = W_BytesObject(space, self.getclass(space), size)
-        if self.bytes is None:
-            w_result.bytes = [self.c_bytes[i] for i in range(size)]
-        else:
-            w_result.bytes = list(self.bytes)
+        w_result = W_BytesObject(space, self.getclass(space), 0)
+        w_result.bytes = rgc.resizable_list_supporting_raw_ptr(self.bytes[:])
         return w_result
 
     @jit.unroll_safe
@@ -977,46 +1022,169 @@ class W_BytesObject(W_AbstractObjectWithClassReference):
             word += r_longlong(ord(self.getchar(i))) << 8*i
         return word
 
+    def unwrap_rbigint(self, space):
+        # LargeIntegers created by the image (or loaded from it) are bytes
+        # objects holding the magnitude in little-endian order.
+        w_class = self.getclass(space)
+        if w_class.is_same_object(space.w_LargePositiveInteger):
+            negative = False
+        elif w_class.is_same_object(space.large_negative_integer_class()):
+            negative = True
+        else:
+            raise error.UnwrappingError("Failed to convert bytes to integer")
+        value = rbigint.frombytes(self.unwrap_string(space), 'little', False)
+        if negative:
+            return value.neg()
+        return value
+
     def is_array_object(self):
         return True
 
     def _become(self, w_other):
         assert isinstance(w_other, W_BytesObject)
         self.bytes, w_other.bytes = w_other.bytes, self.bytes
-        self.c_bytes, w_other.c_bytes = w_other.c_bytes, self.c_bytes
-        self._size, w_other._size = w_other._size, self._size
         self.mutate()
+        w_other.mutate()
         W_AbstractObjectWithClassReference._become(self, w_other)
 
     def convert_to_c_layout(self):
-        if self.bytes is None:
-            return self.c_bytes
-        else:
-            size = self.size()
-            c_bytes = self.c_bytes = rffi.str2charp(self.unwrap_string(None))
-            self.bytes = None
-            self.mutate()
-            return c_bytes
+        # No copy: C code writes straight into the bytes, so whoever hands
+        # out the pointer has to call mutate() once C is done writing (see
+        # squeak_plugin_proxy). The pointer stays valid as long as self
+        # keeps these bytes, the list is never resized.
+        return rgc.nonmoving_raw_ptr_for_resizable_list(self.bytes)
+
+
+class W_LargeInteger(W_AbstractObjectWithClassReference):
+    """Integer of arbitrary size. To the image, it is a LargePositiveInteger
+    or LargeNegativeInteger with the magnitude as little-endian bytes.
+    Byte writes (e.g. while the image fills in a new LargeInteger) go to a
+    list of these bytes, the value is only computed again when it is used."""
+    _attrs_ = ['_value', '_bytes', '_exposed_size']
+    repr_classname = "W_LargeInteger"
+    bytes_per_slot = 1
+
+    def __init__(self, space, w_class, value, size=-1):
+        W_AbstractObjectWithClassReference.__init__(self, space, w_class)
+        self._value = value # None while only _bytes is up to date
+        self._bytes = None
+        if size < 0:
+            size = (value.abs().bit_length() + 7) // 8
+        self._exposed_size = size
 
-    def __del__(self):
-        if self.bytes is None:
-            rffi.free_charp(self.c_bytes)
+    def negative(self, space):
+        return not self.getclass(space).is_same_object(space.w_LargePositiveInteger)
 
+    def get_value(self, space):
+        if self._value is None:
+            value = rbigint.frombytes("".join(self._bytes), 'little', False)
+            if self.negative(space):
+                value = value.neg()
+            self._value = value
+        return self._value
+
+    def writable_bytes(self):
+        if self._bytes is None:
+            self._bytes = list(self.unwrap_string(None))
+        self._value = None
+        return self._bytes
+
+    def str_content(self):
+        if self._value is None:
+            return "<LargeInteger bytes %s>" % self.unwrap_string(None)
+        return self._value.str()
+
+    def at0(self, space, index0):
+        if self._bytes is not None:
+            return space.wrap_int(ord(self._bytes[index0]))
+        byte = self._value.abs_rshift_and_mask(r_ulonglong(index0 * 8), 0xff)
+        return space.wrap_int(intmask(byte))
+
+    def atput0(self, space, index0, w_byte):
+        if index0 >= self.size():
+            raise IndexError()
+        byte = space.unwrap_int(w_byte)
+        if not 0 <= byte <= 0xff:
+            raise error.PrimitiveFailedError()
+        self.writable_bytes()[index0] = chr(byte)
+
+    def getslice(self, start, stop):
+        assert 0 <= start <= stop <= self.size()
+        if self._bytes is not None:
+            return "".join(self._bytes[start:stop])
+        return self.unwrap_string(None)[start:stop]
+
+    def setslice(self, start, string):
+        """Overwrite the bytes from start on with the given string."""
+        stop = start + len(string)
+        if not 0 <= start <= stop <= self.size():
+            raise IndexError
+        self.writable_bytes()[start:stop] = list(string)
+
+    def size(self):
+        return self._exposed_size
+
+    def is_array_object(self):
+        return True
+
+    def unwrap_string(self, space):
+        # the magnitude, padded to the exposed size
+        if self._bytes is not None:
+            return "".join(self._bytes)
+        return self._value.abs().tobytes(self.size(), 'little', False)
+
+    def unwrap_int(self, space):
+        try:
+            return self.get_value(space).toint()
+        except OverflowError:
+            raise error.UnwrappingError("Too large for an int")
+
+    def unwrap_uint(self, space):
+        return self.unwrap_positive_32bit_int(space)
+
+    def unwrap_positive_32bit_int(self, space):
+        value = self.get_value(space)
+        if value.sign < 0 or value.bit_length() > 32:
+            raise error.UnwrappingError("Not a positive 32bit value")
+        return r_uint(value.touint())
+
+    def unwrap_longlong(self, space):
+        try:
+            return self.get_value(space).tolonglong()
+        except OverflowError:
+            raise error.UnwrappingError("Too large for a longlong")
+
+    def unwrap_rbigint(self, space):
+        return self.get_value(space)
+
+    def unwrap_float(self, space):
+        try:
+            return self.get_value(space).tofloat()
+        except OverflowError:
+            raise error.UnwrappingError("Too large for a float")
+
+    def clone(self, space):
+        return W_LargeInteger(space, self.getclass(space), self.get_value(space), self.size())
+
+    def _become(self, w_other):
+        assert isinstance(w_other, W_LargeInteger)
+        self._value, w_other._value = w_other._value, self._value
+        self._bytes, w_other._bytes = w_other._bytes, self._bytes
+        self._exposed_size, w_other._exposed_size = w_other._exposed_size, self._exposed_size
+        W_AbstractObjectWithClassReference._become(self, w_other)
 
 class W_WordsObject(W_AbstractObjectWithClassReference):
-    _attrs_ = ['words', '_size', 'c_words']
+    _attrs_ = ['words']
     repr_classname = "W_WordsObject"
-    _immutable_fields_ = ['words?', 'size?', 'c_words?']
+    _immutable_fields_ = ['words?']
 
     def __init__(self, space, w_class, size):
         W_AbstractObjectWithClassReference.__init__(self, space, w_class)
-        self.words = [r_uint(0)] * size
-        self._size = size
+        self.words = WordBuffer(size)
 
     def fillin(self, space, g_self):
         W_AbstractObjectWithClassReference.fillin(self, space, g_self)
-        self.words = g_self.get_ruints()
-        self._size = len(self.words)
+        self.words = WordBuffer.from_list(g_self.get_ruints())
 
     def at0(self, space, index0):
         val = self.getword(index0)
@@ -1028,16 +1196,29 @@ class W_WordsObject(W_AbstractObjectWithClassReference):
 
     def getword(self, n):
         assert self.size() > n >= 0
-        if self.words is None:
-            return r_uint(self.c_words[n])
-        else:
-            return self.words[n]
+        return self.words.get(n)
 
     def setword(self, n, word):
-        if self.words is None:
-            self.c_words[n] = intmask(word)
-        else:
-            self.words[n] = r_uint(word)
+        self.words.set(n, word)
+
+    def getwords(self):
+        return self.words.to_list()
+
+    def fill(self, word):
+        self.words.fill(0, self.size(), word)
+
+    def copy_words_from(self, w_source, start, stop, src_start):
+        """Copy the words from src_start on of w_source into start..stop
+        (exclusive) of the receiver. w_source is a words object or a
+        display bitmap."""
+        words = w_source.get_word_buffer()
+        if not (0 <= start <= stop <= self.size() and
+                0 <= src_start <= src_start + stop - start <= words.size):
+            raise IndexError
+        self.words.copy_from(words, start, stop, src_start)
+
+    def get_word_buffer(self):
+        return self.words
 
     def short_at0(self, space, index0):
         word = intmask(self.getword(index0 / 2))
@@ -1064,27 +1245,18 @@ class W_WordsObject(W_AbstractObjectWithClassReference):
         self.setword(word_index0, value)
 
     def size(self):
-        return self._size
+        return self.words.size
 
-    @jit.look_inside_iff(lambda self, space: jit.isconstant(self.size()))
     def unwrap_string(self, space):
-        # OH GOD! TODO: Make this sane!
-        res = []
-        for word in self.words:
-            res += [chr(word & r_uint(0x000000ff)), chr((word & r_uint(0x0000ff00)) >> 8), chr((word & r_uint(0x00ff0000)) >> 16), chr((word & r_uint(0xff000000)) >> 24)]
-        return "".join(res)
+        return self.words.as_string()
 
     def invariant(self):
         return (W_AbstractObjectWithClassReference.invariant(self) and
-                isinstance(self.words, list))
+                isinstance(self.words, WordBuffer))
 
     def clone(self, space):
-        size = self.size()
-        w_result = W_WordsObject(space, self.getclass(space), size)
-        if self.words is None:
-            w_result.words = [r_uint(self.c_words[i]) for i in range(size)]
-        else:
-            w_result.words = list(self.words)
+        w_result = W_WordsObject(space, self.getclass(space), 0)
+        w_result.words = self.words.copy()
         return w_result
 
     def is_array_object(self):
@@ -1093,26 +1265,11 @@ class W_WordsObject(W_AbstractObjectWithClassReference):
     def _become(self, w_other):
         assert isinstance(w_other, W_WordsObject)
         self.words, w_other.words = w_other.words, self.words
-        self.c_words, w_other.c_words = w_other.c_words, self.c_words
-        self._size, w_other._size = w_other._size, self._size
         W_AbstractObjectWithClassReference._become(self, w_other)
 
     def convert_to_c_layout(self):
-        if self.words is None:
-            return self.c_words
-        else:
-            size = self.size()
-            old_words = self.words
-            from spyvm.plugins.squeak_plugin_proxy import sqIntArrayPtr
-            c_words = self.c_words = lltype.malloc(sqIntArrayPtr.TO, size, flavor='raw')
-            for i in range(size):
-                c_words[i] = intmask(old_words[i])
-            self.words = None
-            return c_words
-
-    def __del__(self):
-        if self.words is None:
-            lltype.free(self.c_words, flavor='raw')
+        from spyvm.plugins.squeak_plugin_proxy import sqIntArrayPtr
+        return rffi.cast(sqIntArrayPtr, self.words.ptr)
 
 
 class W_CompiledMethod(W_AbstractObjectWithIdentityHash):
@@ -1135,10 +1292,15 @@ class W_CompiledMethod(W_AbstractObjectWithIdentityHash):
                 # Main method content
                 "bytes", "literals",
                 # Additional info about the method
-                "lookup_selector", "compiledin_class", "lookup_class" ]
+                "lookup_selector", "compiledin_class", "lookup_class",
+                # Interpreter caches
+                "_inline_caches", "_superinstructions", "_superinstructions_version" ]
     _immutable_fields_ = ["version?"]
     lookup_selector = "<unknown>"
     lookup_class = None
+    _inline_caches = None
+    _superinstructions = None
+    _superinstructions_version = None
     import_from_mixin(VersionMixin)
 
     def __init__(self, space, bytecount=0, header=0):
@@ -1240,6 +1402,27 @@ class W_CompiledMethod(W_AbstractObjectWithIdentityHash):
         assert pc >= 0 and pc < len(self.bytes)
         return self.bytes[pc]
 
+    def inline_cache_at(self, pc, w_selector):
+        # Returns the polymorphic inline cache of the send ending at pc.
+        # Caches are created lazily and never copied on clone.
+        if self._inline_caches is None:
+            self._inline_caches = {}
+        cache = self._inline_caches.get(pc, None)
+        if cache is None:
+            from spyvm.storage_classes import InlineCache
+            cache = InlineCache(w_selector)
+            self._inline_caches[pc] = cache
+        return cache
+
+    def superinstructions(self):
+        # The quickened bytecode stream, see interpreter_bytecodes.quicken.
+        # It is recomputed whenever the version of the method changes.
+        if self._superinstructions_version is not self.version:
+            from spyvm.interpreter_bytecodes import quicken
+            self._superinstructions = quicken(self.bytes)
+            self._superinstructions_version = self.version
+        return self._superinstructions
+
     def compiled_in(self):
         # This method cannot be constant/elidable. Looking up the compiledin-class from
         # the literals must be done lazily because we cannot analyze the literals
@@ -1344,6 +1527,7 @@ class W_CompiledMethod(W_AbstractObjectWithIdentityHash):
         self.islarge, w_other.islarge = w_other.islarge, self.islarge
         self.lookup_selector, w_other.lookup_selector = w_other.lookup_selector, self.lookup_selector
         self.compiledin_class, w_other.compiledin_class = w_other.compiledin_class, self.compiledin_class
+        self._inline_caches, w_other._inline_caches = w_other._inline_caches, self._inline_caches
         W_AbstractObjectWithIdentityHash._become(self, w_other)
         self.changed()
         w_other.changed()
@@ -1,6 +1,7 @@
 
 from spyvm import model, constants, display
 from spyvm.util import system
+from spyvm.util.word_buffer import WordBuffer
 from rpython.rlib import jit, objectmodel
 from rpython.rtyper.lltypesystem import lltype, rffi
 from rpython.rlib.rarithmetic import r_uint
@@ -31,28 +32,39 @@ def from_words_object(w_obj, form):
     size = w_obj.size()
     w_class = w_obj.getclass(space)
 
+    if isinstance(w_obj, model.W_WordsObject) or isinstance(w_obj, W_DisplayBitmap):
+        # share the words, no copy needed
+        words = w_obj.get_word_buffer()
+    else:
+        words = WordBuffer(size)
+        for idx in range(size):
+            words.set(idx, w_obj.getword(idx))
+
     if depth < 8:
-        w_display_bitmap = W_MappingDisplayBitmap(space, w_class, size, depth)
+        w_display_bitmap = W_MappingDisplayBitmap(space, w_class, size, depth, words)
     elif depth == 8:
-        w_display_bitmap = W_8BitDisplayBitmap(space, w_class, size, depth)
+        w_display_bitmap = W_8BitDisplayBitmap(space, w_class, size, depth, words)
     elif depth == 16:
-        w_display_bitmap = W_16BitDisplayBitmap(space, w_class, size, depth)
+        w_display_bitmap = W_16BitDisplayBitmap(space, w_class, size, depth, words)
     else:
-        w_display_bitmap = W_DisplayBitmap(space, w_class, size, depth)
-
-    for idx in range(size):
-        w_display_bitmap.setword(idx, w_obj.getword(idx))
+        w_display_bitmap = W_DisplayBitmap(space, w_class, size, depth, words)
 
     return w_display_bitmap
 
 class W_DisplayBitmap(model.W_AbstractObjectWithClassReference):
-    _attrs_ = ['pixelbuffer_words', '_real_depth_buffer', '_realsize', 'display', '_depth']
-    _immutable_fields_ = ['pixelbuffer_words?', '_real_depth_buffer', '_realsize', 'display', '_depth']
+    _attrs_ = ['pixelbuffer_words', 'words', '_realsize', 'display', '_depth']
+    _immutable_fields_ = ['pixelbuffer_words?', 'words', '_realsize', 'display', '_depth']
     repr_classname = "W_DisplayBitmap"
+    # The words have the pixel format of the screen, so the screen can be
+    # updated by copying them.
+    words_are_pixels = not system.IS_DARWIN
 
-    def __init__(self, space, w_class, size, depth):
+    def __init__(self, space, w_class, size, depth, words=None):
         model.W_AbstractObjectWithClassReference.__init__(self, space, w_class)
-        self._real_depth_buffer = lltype.malloc(rffi.CArray(rffi.UINT), size, flavor='raw')
+        if words is None:
+            words = WordBuffer(size)
+        assert words.size == size
+        self.words = words
         self._realsize = size
         self._depth = depth
         self.display = space.display()
@@ -69,24 +81,32 @@ class W_DisplayBitmap(model.W_AbstractObjectWithClassReference):
         self.setword(index0, word)
 
     def unwrap_string(self, space):
-        # OH GOD! TODO: Make this sane!
-        res = []
-        for i in range(self._realsize):
-            res += [chr(self.getword(i) & r_uint(0x000000ff)),
-                    chr((self.getword(i) & r_uint(0x0000ff00)) >> 8),
-                    chr((self.getword(i) & r_uint(0x00ff0000)) >> 16),
-                    chr((self.getword(i) & r_uint(0xff000000)) >> 24)]
-        return "".join(res)
+        return self.words.as_string()
 
     def getword(self, n):
         assert self.size() > n >= 0
-        return self._real_depth_buffer[n]
+        return self.words.get(n)
 
     def setword(self, n, word):
-        self._real_depth_buffer[n] = word
+        self.words.set(n, word)
         if self.pixelbuffer_words > 0:
             self.set_pixelbuffer_word(n, word)
 
+    def get_word_buffer(self):
+        return self.words
+
+    def fill(self, word):
+        self.words.fill(0, self.size(), word)
+        self.update_from_buffer()
+
+    def copy_words_from(self, w_source, start, stop, src_start):
+        words = w_source.get_word_buffer()
+        if not (0 <= start <= stop <= self.size() and
+                0 <= src_start <= src_start + stop - start <= words.size):
+            raise IndexError
+        self.words.copy_from(words, start, stop, src_start)
+        self.update_from_buffer()
+
     def size(self):
         return self._realsize
 
@@ -115,8 +135,14 @@ class W_DisplayBitmap(model.W_AbstractObjectWithClassReference):
 
     def update_from_buffer(self):
         if self.pixelbuffer_words > 0:
-            for i in range(self.size()):
-                self.set_pixelbuffer_word(i, self.getword(i))
+            if self.words_are_pixels:
+                count = min(self.size(), self.pixelbuffer_words)
+                rffi.c_memcpy(rffi.cast(rffi.VOIDP, self.pixelbuffer()),
+                              rffi.cast(rffi.VOIDP, self.words.ptr),
+                              count * 4)
+            else:
+                for i in range(self.size()):
+                    self.set_pixelbuffer_word(i, self.getword(i))
 
     # === Misc
 
@@ -124,9 +150,8 @@ class W_DisplayBitmap(model.W_AbstractObjectWithClassReference):
         return False
 
     def clone(self, space):
-        w_result = model.W_WordsObject(space, self.getclass(space), self.size())
-        for n in range(self.size()):
-            w_result.setword(n, self.getword(n))
+        w_result = model.W_WordsObject(space, self.getclass(space), 0)
+        w_result.words = self.words.copy()
         return w_result
 
     def is_array_object(self):
@@ -137,10 +162,7 @@ class W_DisplayBitmap(model.W_AbstractObjectWithClassReference):
         return False
 
     def convert_to_c_layout(self):
-        return self._real_depth_buffer
-
-    def __del__(self):
-        lltype.free(self._real_depth_buffer, flavor='raw')
+        return self.words.ptr
 
     def repr_content(self):
         return "len=%d depth=%d %s" % (self.size(), self._depth, self.str_content())
@@ -148,6 +170,7 @@ class W_DisplayBitmap(model.W_AbstractObjectWithClassReference):
 class W_16BitDisplayBitmap(W_DisplayBitmap):
 
     repr_classname = "W_16BitDisplayBitmap"
+    words_are_pixels = False
 
     def set_pixelbuffer_word(self, n, word):
         mask = 0b11111
@@ -171,6 +194,7 @@ class W_16BitDisplayBitmap(W_DisplayBitmap):
 class W_8BitDisplayBitmap(W_DisplayBitmap):
 
     repr_classname = "W_8BitDisplayBitmap"
+    words_are_pixels = False
 
     def set_pixelbuffer_word(self, n, word):
         # Invert the byte-order.
@@ -185,12 +209,13 @@ BITS = r_uint(32)
 class W_MappingDisplayBitmap(W_DisplayBitmap):
 
     repr_classname = "W_MappingDisplayBitmap"
+    words_are_pixels = False
     _attrs_ = ['words_per_line', 'bits_in_last_word', 'pitch']
     _immutable_fields_ = ['words_per_line?', 'bits_in_last_word?', 'pitch?']
 
-    def __init__(self, space, w_class, size, depth):
+    def __init__(self, space, w_class, size, depth, words=None):
         assert depth in [1, 2, 4]
-        W_DisplayBitmap.__init__(self, space, w_class, size, depth)
+        W_DisplayBitmap.__init__(self, space, w_class, size, depth, words)
 
     def take_over_display(self):
         pitch = r_uint(self.display.pitch) # The pitch is different from the width input to SDL!
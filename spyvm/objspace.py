@@ -1,6 +1,6 @@
 import os
 
-from spyvm import constants, model, wrapper, display, storage
+from spyvm import constants, model, wrapper, display, storage, storage_classes
 from spyvm.util.version import Version
 from spyvm.error import UnwrappingError, WrappingError
 from spyvm.constants import SYSTEM_ATTRIBUTE_IMAGE_NAME_INDEX
@@ -50,7 +50,7 @@ def empty_object():
     return instantiate(model.W_PointersObject)
 
 class ObjSpace(object):
-    _immutable_fields_ = ['objtable']
+    _immutable_fields_ = ['objtable', 'method_cache', 'symbol_table']
 
     def __init__(self):
         # This is a hack; see compile_code() in targetrsqueak.py
@@ -76,6 +76,8 @@ class ObjSpace(object):
         self.add_bootstrap_object("w_nil", w_nil)
 
         self.strategy_factory = storage.StrategyFactory(self)
+        self.method_cache = storage_classes.MethodCache()
+        self.symbol_table = storage_classes.SymbolTable()
         self.make_bootstrap_classes()
         self.make_bootstrap_objects()
 
@@ -173,6 +175,13 @@ class ObjSpace(object):
     def special_object(self, which):
         return self.objtable[which]
 
+    def large_negative_integer_class(self):
+        # Older images don't have it in their special objects array.
+        w_class = self.special_object("w_LargeNegativeInteger")
+        if w_class is None or w_class.is_nil(self):
+            return None
+        return w_class
+
     # ============= Methods for wrapping and unwrapping stuff =============
 
     @specialize.argtype(1)
@@ -205,13 +214,42 @@ class ObjSpace(object):
         else:
             return model.W_LargePositiveInteger1Word(val)
 
+    def wrap_positive_64bit_int(self, val):
+        assert isinstance(val, r_ulonglong)
+        if val <= r_ulonglong(constants.U_MAXINT):
+            return self.wrap_positive_32bit_int(intmask(val))
+        digits = []
+        while val != 0:
+            digits.append(chr(intmask(val & 0xFF)))
+            val = val >> 8
+        w_result = model.W_BytesObject(self, self.w_LargePositiveInteger, len(digits))
+        w_result.setslice(0, "".join(digits))
+        return w_result
+
+    def wrap_rbigint(self, val):
+        # Answer the smallest representation, as the image expects normalized
+        # LargeIntegers.
+        try:
+            return self.wrap_int(val.toint())
+        except OverflowError:
+            pass
+        if val.sign > 0 and val.bit_length() <= 32:
+            return self.wrap_positive_32bit_int(intmask(val.touint()))
+        if val.sign > 0:
+            w_class = self.w_LargePositiveInteger
+        else:
+            w_class = self.large_negative_integer_class()
+            if w_class is None:
+                raise WrappingError("no LargeNegativeInteger class")
+        return model.W_LargeInteger(self, w_class, val)
+
     def wrap_float(self, i):
         return model.W_Float(i)
 
     def wrap_string(self, string):
         w_inst = self.w_String.as_class_get_shadow(self).new(len(string))
-        for i in range(len(string)):
-            w_inst.setchar(i, string[i])
+        assert isinstance(w_inst, model.W_BytesObject)
+        w_inst.setslice(0, string)
         return w_inst
 
     def wrap_char(self, c):
@@ -254,6 +292,9 @@ class ObjSpace(object):
     def unwrap_longlong(self, w_value):
         return w_value.unwrap_longlong(self)
 
+    def unwrap_rbigint(self, w_value):
+        return w_value.unwrap_rbigint(self)
+
     def unwrap_char(self, w_char):
         return w_char.unwrap_char(self)
 
@@ -272,7 +313,13 @@ class ObjSpace(object):
     def get_special_selector(self, selector):
         i0 = constants.find_selectorindex(selector)
         self.w_special_selectors.as_cached_object_get_shadow(self)
-        return self.w_special_selectors.fetch(self, i0)
+        w_selector = self.w_special_selectors.fetch(self, i0)
+        if w_selector.is_nil(self):
+            # Not in the special selectors of the image, but maybe a Symbol.
+            w_symbol = self.symbol_table.lookup(self, selector)
+            if w_symbol is not None:
+                return w_symbol
+        return w_selector
 
     def executable_path(self):
         return self._executable_path.get()
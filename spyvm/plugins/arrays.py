@@ -0,0 +1,29 @@
+from spyvm import model
+from spyvm.plugins.plugin import Plugin
+from spyvm.primitives import PrimitiveFailedError, index1_0
+
+# Bulk operations on Arrays (and other pointers objects without named
+# instance variables), copying the storage of the strategy instead of boxing
+# and storing element by element like the Smalltalk fallback code.
+ArrayPlugin = Plugin()
+
+
+def assert_indexable_pointers(interp, w_obj):
+    if not isinstance(w_obj, model.W_PointersObject) or w_obj.instsize() != 0:
+        raise PrimitiveFailedError
+    return w_obj
+
+@ArrayPlugin.expose_primitive(unwrap_spec=[object, index1_0, int])
+def primitiveCopyFromTo(interp, s_frame, w_rcvr, start, stop):
+    # copyFrom: start to: stop, stop is inclusive and 1-based
+    w_rcvr = assert_indexable_pointers(interp, w_rcvr)
+    try:
+        return w_rcvr.copy_slice(interp.space, start, stop)
+    except IndexError:
+        raise PrimitiveFailedError
+
+@ArrayPlugin.expose_primitive(unwrap_spec=[object, object])
+def primitiveConcat(interp, s_frame, w_rcvr, w_other):
+    w_rcvr = assert_indexable_pointers(interp, w_rcvr)
+    w_other = assert_indexable_pointers(interp, w_other)
+    return w_rcvr.concat(interp.space, w_other)
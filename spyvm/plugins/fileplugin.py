@@ -158,8 +158,7 @@ def primitiveFileRead(interp, s_frame, w_rcvr, fd, target, start, count):
     len_read = len(contents)
     if target.size() < start + len_read:
         raise PrimitiveFailedError
-    for i in range(len_read):
-        target.setchar(start + i, contents[i])
+    target.setslice(start, contents)
     return space.wrap_int(len_read)
 
 @FilePlugin.expose_primitive(unwrap_spec=[object, int])
@@ -217,15 +216,19 @@ def primitiveFileWrite(interp, s_frame, w_rcvr, fd, content, start, count):
     else:
         raise PrimitiveFailedError
 
-    string_content = interp.space.unwrap_string(content)
     byte_start = start * byte_size
     byte_end = min(start + 1 + count, size) * byte_size
 
     space = interp.space
     if not (byte_start >= 0 and byte_end > byte_start):
         return space.wrap_int(0)
+    if isinstance(content, model.W_BytesObject):
+        # only copy the bytes that are written
+        string_content = content.getslice(byte_start, byte_end)
+    else:
+        string_content = space.unwrap_string(content)[byte_start:byte_end]
     try:
-        written = os.write(fd, string_content[byte_start:byte_end])
+        written = os.write(fd, string_content)
     except OSError:
         raise PrimitiveFailedError
     else:
@@ -0,0 +1,28 @@
+from spyvm.plugins.plugin import Plugin
+from spyvm.primitives import PrimitiveFailedError
+from spyvm.util import io_waiters
+
+# Lets the image wait for file descriptors (sockets, pipes, stdin) on a
+# Semaphore. The VM polls them at every interrupt check and blocks on them
+# when the image idles (primitive 230), so waiting costs no CPU.
+IOPollPlugin = Plugin()
+
+
+def add_waiter(interp, fd, events, w_semaphore):
+    if fd < 0 or not w_semaphore.getclass(interp.space).is_same_object(interp.space.w_Semaphore):
+        raise PrimitiveFailedError
+    interp.io_waiters.add(fd, events, w_semaphore)
+
+@IOPollPlugin.expose_primitive(unwrap_spec=[object, int, object])
+def primitiveSignalWhenReadable(interp, s_frame, w_rcvr, fd, w_semaphore):
+    add_waiter(interp, fd, io_waiters.READABLE, w_semaphore)
+    return w_rcvr
+
+@IOPollPlugin.expose_primitive(unwrap_spec=[object, int, object])
+def primitiveSignalWhenWritable(interp, s_frame, w_rcvr, fd, w_semaphore):
+    add_waiter(interp, fd, io_waiters.WRITABLE, w_semaphore)
+    return w_rcvr
+
+@IOPollPlugin.expose_primitive(unwrap_spec=[object, int])
+def primitiveCancelWait(interp, s_frame, w_rcvr, fd):
+    return interp.space.wrap_bool(interp.io_waiters.remove(fd) is not None)
@@ -1,43 +1,212 @@
+from rpython.rlib.rbigint import rbigint
+from rpython.rlib.rarithmetic import r_ulonglong
+
 from spyvm import model
-from spyvm.primitives import prim_table, \
-    BIT_AND, BIT_OR, BIT_XOR, BIT_SHIFT, ADD, SUBTRACT, DIVIDE, MULTIPLY
 from spyvm.error import PrimitiveFailedError
 from spyvm.plugins.plugin import Plugin
 
 
 LargeIntegerPlugin = Plugin()
 
+# The primDigit* primitives work on the magnitudes of their arguments, the
+# sign of the result is given by the receiver or by an explicit flag. The
+# *With* variants take the first operand as argument instead of the receiver.
+
+MONTGOMERY_DIGIT_LENGTH = 32
+MONTGOMERY_DIGIT_MASK = (1 << MONTGOMERY_DIGIT_LENGTH) - 1
+
+def wrap_signed(interp, magnitude, negative):
+    if negative:
+        magnitude = magnitude.neg()
+    return interp.space.wrap_rbigint(magnitude)
+
+def digit_add(interp, first, second):
+    result = first.abs().add(second.abs())
+    return wrap_signed(interp, result, first.sign < 0)
+
+def digit_subtract(interp, first, second):
+    result = first.abs().sub(second.abs())
+    return wrap_signed(interp, result, first.sign < 0)
+
+def digit_multiply(interp, first, second, neg):
+    result = first.abs().mul(second.abs())
+    return wrap_signed(interp, result, neg)
+
+def digit_div(interp, first, second, neg):
+    if second.sign == 0:
+        raise PrimitiveFailedError
+    quo, rem = first.abs().divmod(second.abs())
+    return interp.space.wrap_list([wrap_signed(interp, quo, neg),
+                                   wrap_signed(interp, rem, first.sign < 0)])
+
+def digit_compare(interp, first, second):
+    first = first.abs()
+    second = second.abs()
+    if first.lt(second):
+        return interp.space.wrap_int(-1)
+    elif first.eq(second):
+        return interp.space.wrap_int(0)
+    else:
+        return interp.space.wrap_int(1)
+
+def digit_bit_logic(interp, first, second, op):
+    first = first.abs()
+    second = second.abs()
+    if op == 1:
+        result = first.and_(second)
+    elif op == 2:
+        result = first.or_(second)
+    elif op == 3:
+        result = first.xor(second)
+    else:
+        raise PrimitiveFailedError
+    return interp.space.wrap_rbigint(result)
+
+def digit_bit_shift(interp, receiver, shift):
+    if shift >= 0:
+        result = receiver.abs().lshift(shift)
+    else:
+        result = receiver.abs().rshift(-shift)
+    return wrap_signed(interp, result, receiver.sign < 0)
+
+
+@LargeIntegerPlugin.expose_primitive(unwrap_spec=[rbigint, rbigint])
+def primDigitAdd(interp, s_frame, receiver, argument):
+    return digit_add(interp, receiver, argument)
+
+@LargeIntegerPlugin.expose_primitive(unwrap_spec=[object, rbigint, rbigint])
+def primDigitAddWith(interp, s_frame, w_rcvr, first, second):
+    return digit_add(interp, first, second)
+
+@LargeIntegerPlugin.expose_primitive(unwrap_spec=[rbigint, rbigint])
+def primDigitSubtract(interp, s_frame, receiver, argument):
+    return digit_subtract(interp, receiver, argument)
+
+@LargeIntegerPlugin.expose_primitive(unwrap_spec=[object, rbigint, rbigint])
+def primDigitSubtractWith(interp, s_frame, w_rcvr, first, second):
+    return digit_subtract(interp, first, second)
+
+@LargeIntegerPlugin.expose_primitive(unwrap_spec=[rbigint, rbigint, bool])
+def primDigitMultiplyNegative(interp, s_frame, receiver, argument, neg):
+    return digit_multiply(interp, receiver, argument, neg)
+
+@LargeIntegerPlugin.expose_primitive(unwrap_spec=[object, rbigint, rbigint, bool])
+def primDigitMultiplyWithNegative(interp, s_frame, w_rcvr, first, second, neg):
+    return digit_multiply(interp, first, second, neg)
+
+@LargeIntegerPlugin.expose_primitive(unwrap_spec=[rbigint, rbigint, bool])
+def primDigitDivNegative(interp, s_frame, receiver, argument, neg):
+    return digit_div(interp, receiver, argument, neg)
+
+@LargeIntegerPlugin.expose_primitive(unwrap_spec=[object, rbigint, rbigint, bool])
+def primDigitDivWithNegative(interp, s_frame, w_rcvr, first, second, neg):
+    return digit_div(interp, first, second, neg)
+
+@LargeIntegerPlugin.expose_primitive(unwrap_spec=[rbigint, rbigint])
+def primDigitCompare(interp, s_frame, receiver, argument):
+    return digit_compare(interp, receiver, argument)
+
+@LargeIntegerPlugin.expose_primitive(unwrap_spec=[object, rbigint, rbigint])
+def primDigitCompareWith(interp, s_frame, w_rcvr, first, second):
+    return digit_compare(interp, first, second)
+
+@LargeIntegerPlugin.expose_primitive(unwrap_spec=[rbigint, rbigint])
+def primDigitBitAnd(interp, s_frame, receiver, argument):
+    return digit_bit_logic(interp, receiver, argument, 1)
+
+@LargeIntegerPlugin.expose_primitive(unwrap_spec=[rbigint, rbigint])
+def primDigitBitOr(interp, s_frame, receiver, argument):
+    return digit_bit_logic(interp, receiver, argument, 2)
+
+@LargeIntegerPlugin.expose_primitive(unwrap_spec=[rbigint, rbigint])
+def primDigitBitXor(interp, s_frame, receiver, argument):
+    return digit_bit_logic(interp, receiver, argument, 3)
+
+@LargeIntegerPlugin.expose_primitive(unwrap_spec=[object, rbigint, rbigint, int])
+def primDigitBitLogicWithOp(interp, s_frame, w_rcvr, first, second, op):
+    return digit_bit_logic(interp, first, second, op)
+
+@LargeIntegerPlugin.expose_primitive(unwrap_spec=[rbigint, int])
+def primDigitBitShift(interp, s_frame, receiver, shift):
+    return digit_bit_shift(interp, receiver, shift)
+
+@LargeIntegerPlugin.expose_primitive(unwrap_spec=[rbigint, int])
+def primDigitBitShiftMagnitude(interp, s_frame, receiver, shift):
+    return digit_bit_shift(interp, receiver, shift)
+
+@LargeIntegerPlugin.expose_primitive(unwrap_spec=[rbigint, int, int])
+def primAnyBitFromTo(interp, s_frame, receiver, start, stop):
+    # bit indices are 1-based and inclusive
+    if start < 1 or stop < 1:
+        raise PrimitiveFailedError
+    if stop < start:
+        return interp.space.w_false
+    width = stop - start + 1
+    bits = receiver.abs().rshift(start - 1)
+    mask = rbigint.fromint(1).lshift(width).sub(rbigint.fromint(1))
+    return interp.space.wrap_bool(bits.and_(mask).sign != 0)
+
+@LargeIntegerPlugin.expose_primitive(unwrap_spec=[object, rbigint])
+def primAsLargeInteger(interp, s_frame, w_rcvr, value):
+    # Not normalized on purpose, even small values answer a LargeInteger.
+    space = interp.space
+    if value.sign < 0:
+        w_class = space.large_negative_integer_class()
+        if w_class is None:
+            raise PrimitiveFailedError
+    else:
+        w_class = space.w_LargePositiveInteger
+    return model.W_LargeInteger(space, w_class, value)
+
+@LargeIntegerPlugin.expose_primitive(unwrap_spec=[rbigint])
+def primNormalize(interp, s_frame, receiver):
+    return interp.space.wrap_rbigint(receiver)
+
+@LargeIntegerPlugin.expose_primitive(unwrap_spec=[rbigint])
+def primNormalizePositive(interp, s_frame, receiver):
+    return interp.space.wrap_rbigint(receiver)
+
+@LargeIntegerPlugin.expose_primitive(unwrap_spec=[rbigint])
+def primNormalizeNegative(interp, s_frame, receiver):
+    return interp.space.wrap_rbigint(receiver)
+
+@LargeIntegerPlugin.expose_primitive(unwrap_spec=[rbigint, rbigint])
+def primDigitGCD(interp, s_frame, receiver, argument):
+    # Not part of the reference plugin, #gcd: can bind to it with a fallback.
+    a = receiver.abs()
+    b = argument.abs()
+    while b.sign != 0:
+        a, b = b, a.mod(b)
+    return interp.space.wrap_rbigint(a)
+
+@LargeIntegerPlugin.expose_primitive(unwrap_spec=[object])
+def primMontgomeryDigitLength(interp, s_frame, w_rcvr):
+    return interp.space.wrap_int(MONTGOMERY_DIGIT_LENGTH)
+
+@LargeIntegerPlugin.expose_primitive(unwrap_spec=[rbigint, rbigint, rbigint, rbigint])
+def primMontgomeryTimesModulo(interp, s_frame, receiver, factor, modulo, m_inv):
+    # Montgomery product receiver * factor / B^n mod modulo, with B the digit
+    # base and n the number of digits of modulo. m_inv is -1/modulo mod B.
+    if receiver.sign < 0 or factor.sign < 0 or modulo.sign <= 0 or m_inv.sign < 0:
+        raise PrimitiveFailedError
+    n = (modulo.bit_length() + MONTGOMERY_DIGIT_LENGTH - 1) // MONTGOMERY_DIGIT_LENGTH
+    if (receiver.bit_length() > n * MONTGOMERY_DIGIT_LENGTH or
+            factor.bit_length() > n * MONTGOMERY_DIGIT_LENGTH or
+            m_inv.bit_length() > MONTGOMERY_DIGIT_LENGTH):
+        raise PrimitiveFailedError
+    digit_mask = rbigint.fromrarith_int(r_ulonglong(MONTGOMERY_DIGIT_MASK))
+    accum = receiver.mul(factor)
+    for i in range(n):
+        u = accum.and_(digit_mask).mul(m_inv).and_(digit_mask)
+        accum = accum.add(u.mul(modulo)).rshift(MONTGOMERY_DIGIT_LENGTH)
+    if accum.ge(modulo):
+        accum = accum.sub(modulo)
+    return interp.space.wrap_rbigint(accum)
+
+@LargeIntegerPlugin.expose_primitive(unwrap_spec=[object])
+def primGetModuleName(interp, s_frame, w_rcvr):
+    return interp.space.wrap_string("LargeIntegers (rsqueak, rbigint)")
 
-ops = {
-    'primDigitBitAnd': BIT_AND,
-    'primDigitBitOr': BIT_OR,
-    'primDigitBitXor': BIT_XOR,
-    'primDigitBitShiftMagnitude': BIT_SHIFT,
-    'primDigitAdd': ADD,
-    'primDigitSubtract': SUBTRACT,
-}
-for (name, primitive) in ops.items():
-    def make_func(primitive):
-        primfunc = prim_table[primitive]
-        def func(interp, s_frame, argcount):
-            return primfunc(interp, s_frame, argcount)
-        func.func_name = name
-        LargeIntegerPlugin.expose_primitive(clean_stack=False, no_result=True)(func)
-    make_func(primitive)
-
-
-negOps = {
-    'primDigitDivNegative': DIVIDE,
-    'primDigitMultiplyNegative': MULTIPLY
-}
-for (name, primitive) in negOps.items():
-    def make_func(primitive):
-        primfunc = prim_table[primitive]
-        def func(interp, s_frame, argcount):
-            if argcount != 3:
-                raise PrimitiveFailedError
-            neg = interp.space.w_true is s_frame.pop()
-            return primfunc(interp, s_frame, 2)
-        func.func_name = name
-        LargeIntegerPlugin.expose_primitive(clean_stack=False, no_result=True)(func)
-    make_func(primitive)
+@LargeIntegerPlugin.expose_primitive(unwrap_spec=[object])
+def primCheckIfCModuleExists(interp, s_frame, w_rcvr):
+    return interp.space.w_true
@@ -51,10 +51,14 @@ class SimulationPluginClass(Plugin):
         try:
             s_frame._sendSelector(interp.image.w_simulatePrimitive, 2, interp, w_rcvr, w_rcvr.class_shadow(interp.space), s_fallback=s_fallback)
         except Return, ret:
-            # must clean the stack, including the rcvr
-            s_frame.pop_n(argcount + 1)
-            s_frame.push(ret.value)
-            return w_rcvr
+            w_result = ret.value
+        else:
+            # The simulation returned locally, its result was pushed.
+            w_result = s_frame.pop()
+        # must clean the stack, including the rcvr
+        s_frame.pop_n(argcount + 1)
+        s_frame.push(w_result)
+        return w_rcvr
 
     def simulate(self, w_name, signature, interp, s_frame, argcount, w_method):
         self._simulate(w_name, interp, s_frame, argcount, w_method)
@@ -248,6 +248,8 @@ def firstIndexableField(w_object):
     if isinstance(w_object, model.W_WordsObject):
         return w_object.convert_to_c_layout()
     elif isinstance(w_object, model.W_BytesObject):
+        # the plugin may write into the bytes until the call returns
+        IProxy.c_bytes_w.append(w_object)
         return rffi.cast(sqIntArrayPtr, w_object.convert_to_c_layout())
     elif isinstance(w_object, model_display.W_DisplayBitmap):
         return rffi.cast(sqIntArrayPtr, w_object.convert_to_c_layout())
@@ -999,10 +1001,15 @@ class _InterpreterProxy(object):
         self.loaded_modules = {}
         self.missing_modules = []
         self.remappable_objects = []
+        self.c_bytes_w = [] # bytes objects handed out to the current call
         self.trace_proxy = objspace.ConstantFlag()
         self.reset()
 
     def reset(self):
+        # The plugin wrote through raw pointers, cached strings are stale.
+        for w_bytes in self.c_bytes_w:
+            w_bytes.mutate()
+        self.c_bytes_w = []
         self.interp = None
         self.s_frame = None
         self.argcount = 0
@@ -0,0 +1,39 @@
+from spyvm.plugins.plugin import Plugin
+from spyvm.primitives import PrimitiveFailedError
+
+# Timers are kept in a heap in the VM, so the image does not have to
+# multiplex many Delays over the single timer semaphore. Deadlines are
+# values of the millisecond clock (primitive 135).
+TimerPlugin = Plugin()
+
+
+def assert_semaphore(interp, w_semaphore):
+    if not w_semaphore.getclass(interp.space).is_same_object(interp.space.w_Semaphore):
+        raise PrimitiveFailedError
+
+@TimerPlugin.expose_primitive(unwrap_spec=[object, object, int])
+def primitiveSignalAtMilliseconds(interp, s_frame, w_rcvr, w_semaphore, tick):
+    assert_semaphore(interp, w_semaphore)
+    return interp.space.wrap_int(interp.signal_at(w_semaphore, tick))
+
+@TimerPlugin.expose_primitive(unwrap_spec=[object, object, int])
+def primitiveSignalAfterMilliseconds(interp, s_frame, w_rcvr, w_semaphore, delay):
+    assert_semaphore(interp, w_semaphore)
+    if delay < 0:
+        raise PrimitiveFailedError
+    tick = interp.time_now() + delay
+    return interp.space.wrap_int(interp.signal_at(w_semaphore, tick))
+
+@TimerPlugin.expose_primitive(unwrap_spec=[object, int])
+def primitiveCancelTimer(interp, s_frame, w_rcvr, timer_id):
+    return interp.space.wrap_bool(interp.timers.cancel(timer_id))
+
+@TimerPlugin.expose_primitive(unwrap_spec=[object])
+def primitivePendingTimers(interp, s_frame, w_rcvr):
+    return interp.space.wrap_int(interp.timers.size())
+
+@TimerPlugin.expose_primitive(unwrap_spec=[object])
+def primitiveNextDeadline(interp, s_frame, w_rcvr):
+    if interp.timers.size() == 0:
+        return interp.space.w_nil
+    return interp.space.wrap_int(interp.timers.next_deadline())
@@ -5,9 +5,11 @@ import operator
 from spyvm import model, model_display, storage_contexts, error, constants, display
 from spyvm.error import PrimitiveFailedError, PrimitiveNotYetWrittenError, MetaPrimFailed
 from spyvm import wrapper
+from spyvm.util import clock
 
 from rpython.rlib import rfloat, unroll, jit, objectmodel
-from rpython.rlib.rarithmetic import intmask, r_uint, ovfcheck, ovfcheck_float_to_int, r_longlong, int_between
+from rpython.rlib.rarithmetic import intmask, r_uint, ovfcheck, ovfcheck_float_to_int, r_longlong, r_ulonglong, int_between
+from rpython.rlib.rbigint import rbigint
 
 def assert_class(interp, w_obj, w_class):
     if not w_obj.getclass(interp.space).is_same_object(w_class):
@@ -105,6 +107,8 @@ def wrap_primitive(unwrap_spec=None, no_result=False,
                         args += (interp.space.unwrap_uint(w_arg),)
                     elif spec is r_longlong:
                         args += (interp.space.unwrap_longlong(w_arg),)
+                    elif spec is rbigint:
+                        args += (interp.space.unwrap_rbigint(w_arg),)
                     elif spec is index1_0:
                         args += (interp.space.unwrap_int(w_arg)-1, )
                     elif spec is float:
@@ -226,7 +230,6 @@ BIT_OR      = 15
 BIT_XOR     = 16
 BIT_SHIFT   = 17
 
-_LARGE_OFFSET = 20
 LARGE_REM = 20
 LARGE_ADD = 21
 LARGE_SUBTRACT = 22
@@ -247,7 +250,6 @@ math_ops = {
     }
 for (code,op) in math_ops.items():
     def make_func(op):
-        @expose_also_as(code + _LARGE_OFFSET)
         @expose_primitive(code, unwrap_specs=[[int, int], [r_longlong, r_longlong]])
         def func(interp, s_frame, receiver, argument):
             try:
@@ -268,7 +270,6 @@ bitwise_binary_ops = {
     }
 for (code,op) in bitwise_binary_ops.items():
     def make_func(op):
-        @expose_also_as(code + _LARGE_OFFSET)
         @expose_primitive(code, unwrap_specs=[[int,int], [r_uint, r_uint]])
         def func(interp, s_frame, receiver, argument):
             res = op(intmask(receiver), intmask(argument))
@@ -280,7 +281,6 @@ for (code,op) in bitwise_binary_ops.items():
 
 combination_specs = [[int, int], [pos_32bit_int, pos_32bit_int], [r_longlong, r_longlong]]
 # #/ -- return the result of a division, only succeed if the division is exact
-@expose_also_as(LARGE_DIVIDE)
 @expose_primitive(DIVIDE, unwrap_specs=combination_specs)
 def func(interp, s_frame, receiver, argument):
     if argument == 0:
@@ -290,7 +290,6 @@ def func(interp, s_frame, receiver, argument):
     return interp.space.wrap_int(receiver // argument)
 
 # #\\ -- return the remainder of a division
-@expose_also_as(LARGE_MOD)
 @expose_primitive(MOD, unwrap_specs=combination_specs)
 def func(interp, s_frame, receiver, argument):
     if argument == 0:
@@ -298,7 +297,6 @@ def func(interp, s_frame, receiver, argument):
     return interp.space.wrap_int(receiver % argument)
 
 # #// -- return the result of a division, rounded towards negative infinity
-@expose_also_as(LARGE_DIV)
 @expose_primitive(DIV, unwrap_specs=combination_specs)
 def func(interp, s_frame, receiver, argument):
     if argument == 0:
@@ -306,7 +304,6 @@ def func(interp, s_frame, receiver, argument):
     return interp.space.wrap_int(receiver // argument)
 
 # #// -- return the result of a division, rounded towards negative infinite
-@expose_also_as(LARGE_QUO)
 @expose_primitive(QUO, unwrap_specs=combination_specs)
 def func(interp, s_frame, receiver, argument):
     if argument == 0:
@@ -318,7 +315,6 @@ def func(interp, s_frame, receiver, argument):
     return interp.space.wrap_int(res)
 
 # #bitShift: -- return the shifted value
-@expose_also_as(LARGE_BIT_SHIFT)
 @expose_primitive(BIT_SHIFT, unwrap_spec=[object, int])
 def func(interp, s_frame, w_receiver, argument):
     from rpython.rlib.rarithmetic import LONG_BIT
@@ -331,6 +327,105 @@ def func(interp, s_frame, w_receiver, argument):
     else:
         raise PrimitiveFailedError()
 
+# ___________________________________________________________________________
+# LargeInteger Primitives
+#
+# These work on integers of any size: SmallIntegers, W_LargePositiveInteger1Word
+# and LargeIntegers of both signs, be they W_LargeIntegers (rbigint) or bytes
+# objects created by the image. Results are normalized by wrap_rbigint.
+
+large_math_ops = {
+    LARGE_ADD: (operator.add, lambda a, b: a.add(b)),
+    LARGE_SUBTRACT: (operator.sub, lambda a, b: a.sub(b)),
+    LARGE_MULTIPLY: (operator.mul, lambda a, b: a.mul(b)),
+    }
+for (code, (op, bigop)) in large_math_ops.items():
+    def make_func(op, bigop):
+        @expose_primitive(code, unwrap_specs=[[int, int], [rbigint, rbigint]])
+        def func(interp, s_frame, receiver, argument):
+            if isinstance(receiver, rbigint):
+                return interp.space.wrap_rbigint(bigop(receiver, argument))
+            assert isinstance(receiver, int) and isinstance(argument, int)
+            try:
+                return interp.space.wrap_int(ovfcheck(op(receiver, argument)))
+            except OverflowError:
+                return interp.space.wrap_rbigint(
+                    bigop(rbigint.fromint(receiver), rbigint.fromint(argument)))
+    make_func(op, bigop)
+
+large_bitwise_ops = {
+    LARGE_BIT_AND: (operator.and_, lambda a, b: a.and_(b)),
+    LARGE_BIT_OR: (operator.or_, lambda a, b: a.or_(b)),
+    LARGE_BIT_XOR: (operator.xor, lambda a, b: a.xor(b)),
+    }
+for (code, (op, bigop)) in large_bitwise_ops.items():
+    def make_func(op, bigop):
+        @expose_primitive(code, unwrap_specs=[[int, int], [rbigint, rbigint]])
+        def func(interp, s_frame, receiver, argument):
+            if isinstance(receiver, rbigint):
+                return interp.space.wrap_rbigint(bigop(receiver, argument))
+            return interp.space.wrap_int(op(receiver, argument))
+    make_func(op, bigop)
+
+def big_quo_rem(receiver, argument):
+    # division truncated towards zero
+    if argument.sign == 0:
+        raise PrimitiveFailedError()
+    quo, rem = receiver.abs().divmod(argument.abs())
+    if receiver.sign != argument.sign:
+        quo = quo.neg()
+    if receiver.sign < 0:
+        rem = rem.neg()
+    return quo, rem
+
+@expose_primitive(LARGE_DIVIDE, unwrap_spec=[rbigint, rbigint])
+def func(interp, s_frame, receiver, argument):
+    quo, rem = big_quo_rem(receiver, argument)
+    if rem.sign != 0:
+        raise PrimitiveFailedError()
+    return interp.space.wrap_rbigint(quo)
+
+@expose_primitive(LARGE_MOD, unwrap_spec=[rbigint, rbigint])
+def func(interp, s_frame, receiver, argument):
+    if argument.sign == 0:
+        raise PrimitiveFailedError()
+    return interp.space.wrap_rbigint(receiver.mod(argument))
+
+@expose_primitive(LARGE_DIV, unwrap_spec=[rbigint, rbigint])
+def func(interp, s_frame, receiver, argument):
+    if argument.sign == 0:
+        raise PrimitiveFailedError()
+    return interp.space.wrap_rbigint(receiver.floordiv(argument))
+
+@expose_primitive(LARGE_QUO, unwrap_spec=[rbigint, rbigint])
+def func(interp, s_frame, receiver, argument):
+    quo, _ = big_quo_rem(receiver, argument)
+    return interp.space.wrap_rbigint(quo)
+
+@expose_primitive(LARGE_REM, unwrap_spec=[rbigint, rbigint])
+def func(interp, s_frame, receiver, argument):
+    _, rem = big_quo_rem(receiver, argument)
+    return interp.space.wrap_rbigint(rem)
+
+@expose_primitive(LARGE_BIT_SHIFT, unwrap_spec=[rbigint, int])
+def func(interp, s_frame, receiver, argument):
+    if argument >= 0:
+        # The size of the result in bits has to be a SmallInteger.
+        if argument > constants.TAGGED_MAXINT - receiver.bit_length():
+            raise PrimitiveFailedError()
+        try:
+            result = receiver.lshift(argument)
+        except MemoryError:
+            raise PrimitiveFailedError()
+    else:
+        # Shifting right by all bits of the receiver gives 0 or -1 already,
+        # and -argument overflows for the most negative int.
+        shift = receiver.bit_length()
+        if argument > -shift:
+            shift = -argument
+        result = receiver.rshift(shift)
+    return interp.space.wrap_rbigint(result)
+
 # ___________________________________________________________________________
 # Float Primitives
 
@@ -555,13 +650,19 @@ def func(interp, s_frame, w_rcvr, n0, w_value):
     w_rcvr.literalatput0(interp.space, n0, w_value)
     return w_value
 
+def record_allocation(interp, s_frame, w_new):
+    profiler = interp.space.strategy_factory.profiler
+    if profiler.active:
+        profiler.record_allocation(w_new, s_frame)
+    return w_new
+
 @expose_primitive(NEW, unwrap_spec=[object])
 def func(interp, s_frame, w_cls):
     w_cls = assert_pointers(w_cls)
     s_class = w_cls.as_class_get_shadow(interp.space)
     if s_class.isvariable():
         raise PrimitiveFailedError()
-    return s_class.new()
+    return record_allocation(interp, s_frame, s_class.new())
 
 @expose_primitive(NEW_WITH_ARG, unwrap_spec=[object, int])
 def func(interp, s_frame, w_cls, size):
@@ -572,9 +673,10 @@ def func(interp, s_frame, w_cls, size):
     if size < 0:
         raise PrimitiveFailedError()
     try:
-        return s_class.new(size)
+        w_new = s_class.new(size)
     except MemoryError:
         raise PrimitiveFailedError
+    return record_allocation(interp, s_frame, w_new)
 
 @expose_primitive(ARRAY_BECOME_ONE_WAY, unwrap_spec=[object, object])
 def func(interp, s_frame, w_obj1, w_obj2):
@@ -734,7 +836,7 @@ def func(interp, s_frame, w_rcvr):
 def func(interp, s_frame, w_rcvr, w_into):
     if not interp.evented:
         raise PrimitiveFailedError()
-    ary = interp.space.display().get_next_event(time=interp.time_now())
+    ary = interp.space.display().get_next_event(time=interp.cached_time_now())
     for i in range(8):
         w_into.store(interp.space, i, interp.space.wrap_int(ary[i]))
     # XXX - hack
@@ -750,6 +852,37 @@ def func(interp, s_frame, argcount, w_method):
     from spyvm.plugins.simulation import SimulationPlugin
     return SimulationPlugin.simulate(w_name, signature, interp, s_frame, argcount, w_method)
 
+@expose_primitive(SNAPSHOT, unwrap_spec=[object], clean_stack=False, no_result=True)
+def func(interp, s_frame, w_rcvr):
+    from spyvm.constants import SYSTEM_ATTRIBUTE_IMAGE_NAME_INDEX
+    from spyvm.squeakimage import ImageWriter
+    space = interp.space
+    image = interp.image
+    if image is None or image.version.is_64bit:
+        raise PrimitiveFailedError
+    filename = space.get_system_attribute(SYSTEM_ATTRIBUTE_IMAGE_NAME_INDEX)
+    if not filename:
+        raise PrimitiveFailedError
+    # The written image resumes from the current context of the active
+    # process, with true as the result of this primitive. The running image
+    # gets false.
+    process = wrapper.ProcessWrapper(space, wrapper.scheduler(space).active_process())
+    w_suspended_context = process.suspended_context()
+    s_frame.pop()
+    s_frame.push(space.w_true)
+    process.store_suspended_context(s_frame.w_self())
+    try:
+        ImageWriter(space, image).write(filename)
+        w_result = space.w_false
+    except (OSError, PrimitiveFailedError):
+        w_result = None
+    process.store_suspended_context(w_suspended_context)
+    s_frame.pop()
+    if w_result is None:
+        s_frame.push(w_rcvr)
+        raise PrimitiveFailedError
+    s_frame.push(w_result)
+
 @expose_primitive(BE_CURSOR)
 def func(interp, s_frame, argcount):
     if not (0 <= argcount <= 1):
@@ -760,12 +893,12 @@ def func(interp, s_frame, argcount):
         # TODO: use mask
         w_mask = s_frame.peek(0)
         if isinstance(w_mask, model.W_WordsObject):
-            mask_words = w_mask.words
+            mask_words = w_mask.getwords()
         elif isinstance(w_mask, model.W_PointersObject):
             # mask is a form object
             w_contents = w_mask.fetch(interp.space, 0)
             if isinstance(w_contents, model.W_WordsObject):
-                mask_words = w_contents.words
+                mask_words = w_contents.getwords()
             else:
                 raise PrimitiveFailedError
         else:
@@ -779,7 +912,7 @@ def func(interp, s_frame, argcount):
     hotpt = wrapper.PointWrapper(interp.space, w_rcvr.fetch(interp.space, 4))
     if not interp.image.version.is_modern:
         display.SDLCursor.set(
-            w_bitmap.words,
+            w_bitmap.getwords(),
             width,
             height,
             hotpt.x(),
@@ -815,32 +948,80 @@ def func(interp, s_frame, w_rcvr):
         interp.image.lastWindowSize = (form.width() << 16) + form.height()
     return w_rcvr
 
-# @expose_primitive(STRING_REPLACE, unwrap_spec=[object, index1_0, index1_0, object, index1_0])
-# @jit.look_inside_iff(lambda interp, s_frame, w_rcvr, start, stop, w_replacement, repStart: jit.isconstant(stop) and jit.isconstant(start))
-# def func(interp, s_frame, w_rcvr, start, stop, w_replacement, repStart):
-#     """replaceFrom: start to: stop with: replacement startingAt: repStart
-#     Primitive. This destructively replaces elements from start to stop in the
-#     receiver starting at index, repStart, in the collection, replacement. Answer
-#     the receiver. Range checks are performed in the primitive only. Essential
-#     for Pharo Candle Symbols.
-#     | index repOff |
-#     repOff := repStart - start.
-#     index := start - 1.
-#     [(index := index + 1) <= stop]
-#         whileTrue: [self at: index put: (replacement at: repOff + index)]"""
-#     if (start < 0 or start - 1 > stop or repStart < 0):
-#         raise PrimitiveFailedError()
-#     # This test deliberately test for equal W_Object class. The Smalltalk classes
-#     # might be different (e.g. Symbol and ByteString)
-#     if w_rcvr.__class__ is not w_replacement.__class__:
-#         raise PrimitiveFailedError
-#     if (w_rcvr.size() - w_rcvr.instsize() <= stop
-#             or w_replacement.size() - w_replacement.instsize() <= repStart + (stop - start)):
-#         raise PrimitiveFailedError()
-#     repOff = repStart - start
-#     for i0 in range(start, stop + 1):
-#         w_rcvr.atput0(interp.space, i0, w_replacement.at0(interp.space, repOff + i0))
-#     return w_rcvr
+@expose_primitive(STRING_REPLACE, unwrap_spec=[object, index1_0, index1_0, object, index1_0])
+def func(interp, s_frame, w_rcvr, start, stop, w_replacement, repStart):
+    """replaceFrom: start to: stop with: replacement startingAt: repStart
+    Primitive. This destructively replaces elements from start to stop in the
+    receiver starting at index, repStart, in the collection, replacement. Answer
+    the receiver. Range checks are performed in the primitive only. The ranges
+    may overlap if receiver and replacement are the same object."""
+    if start < 0 or start - 1 > stop or repStart < 0:
+        raise PrimitiveFailedError()
+    space = interp.space
+    # stop is inclusive, the model copies take an exclusive end
+    count = stop - start + 1
+    if isinstance(w_rcvr, model.W_BytesObject) and isinstance(w_replacement, model.W_BytesObject):
+        check_replace_ranges(w_rcvr, start, count, w_replacement, repStart)
+        w_rcvr.copy_bytes_from(w_replacement, start, start + count, repStart)
+    elif (isinstance(w_rcvr, model.W_BytesObject) or
+            isinstance(w_rcvr, model.W_LargeInteger)):
+        # LargeIntegers are bytes to the image, too.
+        if not (isinstance(w_replacement, model.W_BytesObject) or
+                isinstance(w_replacement, model.W_LargeInteger)):
+            raise PrimitiveFailedError()
+        check_replace_ranges(w_rcvr, start, count, w_replacement, repStart)
+        if isinstance(w_replacement, model.W_LargeInteger):
+            replacement = w_replacement.getslice(repStart, repStart + count)
+        else:
+            assert isinstance(w_replacement, model.W_BytesObject)
+            replacement = w_replacement.getslice(repStart, repStart + count)
+        if isinstance(w_rcvr, model.W_LargeInteger):
+            w_rcvr.setslice(start, replacement)
+        else:
+            assert isinstance(w_rcvr, model.W_BytesObject)
+            w_rcvr.setslice(start, replacement)
+    elif (isinstance(w_rcvr, model.W_WordsObject) or
+            isinstance(w_rcvr, model_display.W_DisplayBitmap)):
+        if not (isinstance(w_replacement, model.W_WordsObject) or
+                isinstance(w_replacement, model_display.W_DisplayBitmap)):
+            raise PrimitiveFailedError()
+        check_replace_ranges(w_rcvr, start, count, w_replacement, repStart)
+        w_rcvr.copy_words_from(w_replacement, start, start + count, repStart)
+    elif isinstance(w_rcvr, model.W_PointersObject):
+        if not isinstance(w_replacement, model.W_PointersObject):
+            raise PrimitiveFailedError()
+        rcvr_offset = w_rcvr.instsize()
+        rep_offset = w_replacement.instsize()
+        if (stop >= w_rcvr.size() - rcvr_offset or
+                repStart + count > w_replacement.size() - rep_offset):
+            raise PrimitiveFailedError()
+        w_rcvr.copy_from(space, w_replacement, rcvr_offset + start,
+                         rcvr_offset + start + count, rep_offset + repStart)
+    elif isinstance(w_rcvr, model.W_CompiledMethod):
+        # Only the bytecodes can be replaced, the literals are not bytes.
+        if not (isinstance(w_replacement, model.W_CompiledMethod) or
+                isinstance(w_replacement, model.W_BytesObject)):
+            raise PrimitiveFailedError()
+        if start < w_rcvr.bytecodeoffset():
+            raise PrimitiveFailedError()
+        check_replace_ranges(w_rcvr, start, count, w_replacement, repStart)
+        copy_elements_at0(space, w_rcvr, start, count, w_replacement, repStart)
+    else:
+        raise PrimitiveFailedError()
+    return w_rcvr
+
+def check_replace_ranges(w_rcvr, start, count, w_replacement, repStart):
+    if start + count > w_rcvr.size() or repStart + count > w_replacement.size():
+        raise PrimitiveFailedError()
+
+def copy_elements_at0(space, w_rcvr, start, count, w_replacement, repStart):
+    if w_rcvr is w_replacement and start > repStart:
+        # copy backwards, the ranges overlap
+        for i in range(count - 1, -1, -1):
+            w_rcvr.atput0(space, start + i, w_replacement.at0(space, repStart + i))
+    else:
+        for i in range(count):
+            w_rcvr.atput0(space, start + i, w_replacement.at0(space, repStart + i))
 
 @expose_primitive(SCREEN_SIZE, unwrap_spec=[object])
 def func(interp, s_frame, w_rcvr):
@@ -974,9 +1155,18 @@ def func(interp, s_frame, argcount, w_method):
     elif signature[0] == "SocketPlugin":
         from spyvm.plugins.socket import SocketPlugin
         return SocketPlugin.call(signature[1], interp, s_frame, argcount, w_method)
+    elif signature[0] == "TimerPlugin":
+        from spyvm.plugins.timer import TimerPlugin
+        return TimerPlugin.call(signature[1], interp, s_frame, argcount, w_method)
+    elif signature[0] == "IOPollPlugin":
+        from spyvm.plugins.io_poll import IOPollPlugin
+        return IOPollPlugin.call(signature[1], interp, s_frame, argcount, w_method)
     elif signature[0] == "FilePlugin":
         from spyvm.plugins.fileplugin import FilePlugin
         return FilePlugin.call(signature[1], interp, s_frame, argcount, w_method)
+    elif signature[0] == "ArrayPlugin":
+        from spyvm.plugins.arrays import ArrayPlugin
+        return ArrayPlugin.call(signature[1], interp, s_frame, argcount, w_method)
     elif signature[0] == "VMDebugging":
         from spyvm.plugins.vmdebugging import DebuggingPlugin
         return DebuggingPlugin.call(signature[1], interp, s_frame, argcount, w_method)
@@ -992,6 +1182,7 @@ def func(interp, s_frame, w_rcvr):
     if w_class:
         w_class = assert_pointers(w_class)
         w_class.as_class_get_shadow(interp.space).flush_method_caches()
+    interp.space.method_cache.flush_method(w_rcvr)
     return w_rcvr
 
 @objectmodel.specialize.arg(0)
@@ -1020,13 +1211,15 @@ def walk_gc_objects_of_type(type, func):
             func(w_obj)
     walk_gc_objects(check_type)
 
-# XXX: We don't have a global symbol cache. Instead, we walk all
+# XXX: We don't have a global method cache per selector. Instead, we walk all
 # MethodDictionaryShadow objects and flush them.
 @expose_primitive(SYMBOL_FLUSH_CACHE, unwrap_spec=[object])
 def func(interp, s_frame, w_rcvr):
     # This takes a long time (at least in interpreted mode), and is not really necessary.
     # We are monitoring changes to MethodDictionaries, so there is no need for the image to tell us.
     #walk_gc_objects_of_type(storage_contexts.MethodDictionaryShadow, lambda s_dict: s_dict.flush_method_cache())
+    # The global lookup cache is not versioned per selector, though.
+    interp.space.method_cache.flush_selector(w_rcvr)
     return w_rcvr
 
 # ___________________________________________________________________________
@@ -1142,13 +1335,16 @@ def func(interp, s_frame, w_arg):
 
 @expose_primitive(SIGNAL_AT_MILLISECONDS, unwrap_spec=[object, object, int])
 def func(interp, s_frame, w_delay, w_semaphore, timestamp):
+    # The timer semaphore is just one of the timers of the TimerPlugin.
+    interp.timers.cancel(interp.timer_semaphore_id)
+    interp.timer_semaphore_id = 0
     if not w_semaphore.getclass(interp.space).is_same_object(
             interp.space.w_Semaphore):
         interp.space.objtable["w_timerSemaphore"] = interp.space.w_nil
-        interp.next_wakeup_tick = timestamp
     else:
         interp.space.objtable["w_timerSemaphore"] = w_semaphore
-        interp.next_wakeup_tick = timestamp
+        if timestamp != 0:
+            interp.timer_semaphore_id = interp.signal_at(w_semaphore, timestamp)
     return w_delay
 
 
@@ -1224,24 +1420,31 @@ def func(interp, s_frame, w_receiver, n0, w_value):
         raise PrimitiveFailedError
     return w_receiver.short_atput0(interp.space, n0, w_value)
 
-@expose_primitive(FILL, unwrap_spec=[object, pos_32bit_int])
-def func(interp, s_frame, w_arg, new_value):
+@expose_primitive(FILL, unwrap_spec=[object, object])
+def func(interp, s_frame, w_arg, w_value):
     space = interp.space
+    if isinstance(w_arg, model.W_PointersObject):
+        # only the indexable fields
+        w_arg.fill(space, w_arg.instsize(), w_arg.size(), w_value)
+        return w_arg
+    new_value = space.unwrap_positive_32bit_int(w_value)
     if isinstance(w_arg, model.W_BytesObject):
         if new_value > 255:
             raise PrimitiveFailedError
-        for i in xrange(w_arg.size()):
-            w_arg.setchar(i, chr(new_value))
+        w_arg.setslice(0, chr(new_value) * w_arg.size())
+    elif isinstance(w_arg, model.W_LargeInteger):
+        if new_value > 255:
+            raise PrimitiveFailedError
+        w_arg.setslice(0, chr(new_value) * w_arg.size())
     elif isinstance(w_arg, model.W_WordsObject) or isinstance(w_arg, model_display.W_DisplayBitmap):
-        for i in xrange(w_arg.size()):
-            w_arg.setword(i, new_value)
+        w_arg.fill(new_value)
     else:
         raise PrimitiveFailedError
     return w_arg
 
 @expose_primitive(CLONE, unwrap_spec=[object])
 def func(interp, s_frame, w_arg):
-    return w_arg.clone(interp.space)
+    return record_allocation(interp, s_frame, w_arg.clone(interp.space))
 
 @expose_primitive(SYSTEM_ATTRIBUTE, unwrap_spec=[object, int])
 def func(interp, s_frame, w_receiver, attr_id):
@@ -1339,7 +1542,6 @@ bool_ops = {
     }
 for (code,op) in bool_ops.items():
     def make_func(op):
-        @expose_also_as(code + _LARGE_OFFSET)
         @expose_primitive(code, unwrap_specs=combination_specs)
         def func(interp, s_frame, v1, v2):
             res = op(v1, v2)
@@ -1347,6 +1549,23 @@ for (code,op) in bool_ops.items():
             return w_res
     make_func(op)
 
+large_bool_ops = {
+    LARGE_LESSTHAN: (operator.lt, lambda a, b: a.lt(b)),
+    LARGE_GREATERTHAN: (operator.gt, lambda a, b: a.gt(b)),
+    LARGE_LESSOREQUAL: (operator.le, lambda a, b: a.le(b)),
+    LARGE_GREATEROREQUAL: (operator.ge, lambda a, b: a.ge(b)),
+    LARGE_EQUAL: (operator.eq, lambda a, b: a.eq(b)),
+    LARGE_NOTEQUAL: (operator.ne, lambda a, b: a.ne(b)),
+    }
+for (code, (op, bigop)) in large_bool_ops.items():
+    def make_func(op, bigop):
+        @expose_primitive(code, unwrap_specs=[[int, int], [rbigint, rbigint]])
+        def func(interp, s_frame, v1, v2):
+            if isinstance(v1, rbigint):
+                return interp.space.wrap_bool(bigop(v1, v2))
+            return interp.space.wrap_bool(op(v1, v2))
+    make_func(op, bigop)
+
 for (code,op) in bool_ops.items():
     def make_func(op):
         @expose_primitive(code+_FLOAT_OFFSET, unwrap_spec=[float, float])
@@ -1475,9 +1694,25 @@ def func(interp, s_frame, w_block_ctx, args_w):
     s_block_ctx.reset_pc()
     return s_block_ctx
 
-@expose_primitive(PERFORM)
+@expose_primitive(PERFORM, no_result=True)
 def func(interp, s_frame, argcount):
-    raise PrimitiveFailedError()
+    # The selector is the first argument, the remaining ones are passed on.
+    if argcount < 1:
+        raise PrimitiveFailedError()
+    w_selector = s_frame.peek(argcount - 1)
+    w_rcvr = s_frame.peek(argcount)
+    s_class = w_rcvr.class_shadow(interp.space)
+    try:
+        w_method = interp.space.method_cache.lookup(s_class, w_selector)
+    except error.MethodNotFound:
+        w_method = None
+    if (isinstance(w_method, model.W_CompiledMethod) and
+            w_method.argsize != argcount - 1):
+        raise PrimitiveFailedError()
+    w_arguments = s_frame.pop_and_return_n(argcount - 1)
+    s_frame.pop() # the selector
+    return s_frame._sendSelector(w_selector, argcount - 1, interp, w_rcvr,
+                                 s_class, w_arguments=w_arguments)
 
 @expose_primitive(PERFORM_WITH_ARGS,
                   unwrap_spec=[object, object, list],
@@ -1527,6 +1762,7 @@ def func(interp, s_frame, w_rcvr):
     w_rcvr = assert_pointers(w_rcvr)
     s_class = w_rcvr.as_class_get_shadow(interp.space)
     s_class.flush_method_caches()
+    interp.space.method_cache.flush_class(s_class)
     return w_rcvr
 
 # ___________________________________________________________________________
@@ -1634,20 +1870,30 @@ FORCE_DISPLAY_UPDATE = 231
 
 @expose_primitive(IDLE_FOR_MICROSECONDS, unwrap_spec=[object, int], no_result=True, clean_stack=False)
 def func(interp, s_frame, w_rcvr, time_mu_s):
-    import time
     s_frame.pop()
-    time_s = time_mu_s / 1000000.0
-    interp.interrupt_check_counter = 0
-    interp.quick_check_for_interrupt(s_frame, dec=0)
-    time.sleep(time_s)
-    interp.interrupt_check_counter = 0
-    interp.quick_check_for_interrupt(s_frame, dec=0)
+    # idle does not block if a timer is overdue or a descriptor is ready, the
+    # interrupt check afterwards signals the timers
+    interp.idle(s_frame, time_mu_s)
+    interp.force_check_for_interrupts(s_frame)
 
 @expose_primitive(FORCE_DISPLAY_UPDATE, unwrap_spec=[object])
 def func(interp, s_frame, w_rcvr):
     interp.space.display().flip(force=True)
     return w_rcvr
 
+# ___________________________________________________________________________
+# Microsecond clocks (since 1 January 1901)
+UTC_MICROSECOND_CLOCK = 240
+LOCAL_MICROSECOND_CLOCK = 241
+
+@expose_primitive(UTC_MICROSECOND_CLOCK, unwrap_spec=[object])
+def func(interp, s_frame, w_rcvr):
+    return interp.space.wrap_positive_64bit_int(r_ulonglong(clock.utc_microseconds()))
+
+@expose_primitive(LOCAL_MICROSECOND_CLOCK, unwrap_spec=[object])
+def func(interp, s_frame, w_rcvr):
+    return interp.space.wrap_positive_64bit_int(r_ulonglong(clock.local_microseconds()))
+
 # ___________________________________________________________________________
 # VM implementor primitives
 VM_CLEAR_PROFILE = 250
@@ -1742,8 +1988,10 @@ def func(interp, s_frame, argcount):
     arg1_w = s_frame.pop() # receiver
 
     vm_w_params = [interp.space.wrap_int(0)] * 71
+    vm_w_params[25] = interp.space.wrap_int(interp.interrupt_checks_every_ms)
     vm_w_params[39] = interp.space.wrap_int(constants.BYTES_PER_WORD)
-    vm_w_params[40] = interp.space.wrap_int(interp.image.version.magic)
+    if interp.image is not None:
+        vm_w_params[40] = interp.space.wrap_int(interp.image.version.magic)
     vm_w_params[69] = interp.space.wrap_int(constants.INTERP_PROXY_MAJOR)
     vm_w_params[70] = interp.space.wrap_int(constants.INTERP_PROXY_MINOR)
 
@@ -1760,6 +2008,15 @@ def func(interp, s_frame, argcount):
 
     s_frame.pop() # new value
     if argcount == 2:
+        # arg2_w is the index, arg1_w the new value
+        if not isinstance(arg2_w, model.W_SmallInteger):
+            raise PrimitiveFailedError
+        if arg2_w.value == 26:
+            if arg1_w.value < 0:
+                raise PrimitiveFailedError
+            w_old_value = vm_w_params[25]
+            interp.interrupt_checks_every_ms = arg1_w.value
+            return w_old_value
         # return the 'old value'
         return interp.space.wrap_int(0)
 
@@ -1,8 +1,12 @@
-import os, time
+import os
 from spyvm import constants, model, util, error
-from spyvm.util import stream, system
+from spyvm.util import stream, system, clock
 from spyvm.util.bitmanipulation import splitter
-from rpython.rlib import objectmodel
+from spyvm.util.word_buffer import WordBuffer
+from spyvm.storage_classes import WEAK_POINTERS
+from rpython.rlib import objectmodel, longlong2float
+from rpython.rlib.rarithmetic import intmask
+from rpython.rlib.rbigint import rbigint
 
 # Access for module users
 Stream = stream.Stream
@@ -67,8 +71,10 @@ class ImageReader(object):
         self.space = space
         self.stream = stream
         self.version = None
-        self.chunks = {} # Dictionary mapping old address to chunk object
-        self.chunklist = [] # Flat list of all read chunks
+        self.chunklist = [] # All read chunks, in the order of their addresses
+        # Maps the word offset of an object in the image body to its index
+        # in chunklist + 1 (0 marks offsets where no object starts)
+        self.chunk_table = None
         self.intcache = {} # Cached instances of SmallInteger
         self.lastWindowSize = 0
 
@@ -76,6 +82,13 @@ class ImageReader(object):
         self.read_all()
         return SqueakImage(self)
 
+    def close(self):
+        """ Close the stream once the image is created. The chunks decode
+        their bodies from it, so they are detached from the reader first. """
+        for chunk in self.chunklist:
+            chunk.reader = None
+        self.stream.close()
+
     def log_progress(self, progress, char):
         if progress % 1000 == 0:
             os.write(2, char)
@@ -85,7 +98,6 @@ class ImageReader(object):
         self.read_body()
         self.init_compactclassesarray()
         # All chunks are read, now convert them to real objects.
-        self.init_g_objects()
         self.assign_prebuilt_constants()
         self.init_w_objects()
         self.fillin_w_objects()
@@ -136,12 +148,12 @@ class ImageReader(object):
 
     def read_body(self):
         self.stream.reset_count()
+        self.chunk_table = WordBuffer(self.endofmemory >> 2)
         while self.stream.count < self.endofmemory:
             chunk, pos = self.read_object()
             self.log_progress(len(self.chunklist), '#')
             self.chunklist.append(chunk)
-            self.chunks[pos + self.oldbaseaddress] = chunk
-        self.stream.close()
+            self.chunk_table.set(pos >> 2, len(self.chunklist))
         return self.chunklist # return for testing
 
     def read_object(self):
@@ -154,9 +166,11 @@ class ImageReader(object):
             chunk, pos = self.read_1wordobjectheader()
         else: # 10 bits
             raise error.CorruptImageError("Unused block not allowed in image")
-        size = chunk.size
-        chunk.data = [self.stream.next()
-                     for _ in range(size - 1)] #size-1, excluding header
+        # The body (size-1 words, excluding the header) stays in the stream
+        # and is decoded when the object is created.
+        chunk.reader = self
+        chunk.offset = self.stream.pos
+        self.stream.skipwords(chunk.size - 1)
         return chunk, pos
 
     def read_1wordobjectheader(self):
@@ -181,21 +195,49 @@ class ImageReader(object):
         assert kind == 0
         return ImageChunk(self.space, size, format, classid, idhash), self.stream.count - 4
 
+    def chunk_index(self, pointer):
+        offset = pointer - self.oldbaseaddress
+        if offset < 0 or offset & 3 != 0 or offset >= self.endofmemory:
+            return -1
+        return intmask(self.chunk_table.get(offset >> 2)) - 1
+
+    def has_chunk(self, pointer):
+        return self.chunk_index(pointer) >= 0
+
+    def chunk_at(self, pointer):
+        index = self.chunk_index(pointer)
+        if index < 0:
+            raise error.CorruptImageError("No object at address %d" % pointer)
+        return self.chunklist[index]
+
     def init_compactclassesarray(self):
         """ from the blue book (CompiledMethod Symbol Array PseudoContext LargePositiveInteger nil MethodDictionary Association Point Rectangle nil TranslatedMethod BlockContext MethodContext nil nil nil nil nil nil nil nil nil nil nil nil nil nil nil nil nil ) """
-        special = self.chunks[self.specialobjectspointer]
+        special = self.chunk_at(self.specialobjectspointer)
         assert special.size > 24 #at least
         assert special.format == 2
         # squeak-specific: compact classes array
-        chunk = self.chunks[special.data[COMPACT_CLASSES_ARRAY]]
-        assert len(chunk.data) == 31
+        chunk = self.chunk_at(special.word(COMPACT_CLASSES_ARRAY))
+        assert chunk.word_count() == 31
         assert chunk.format == 2
-        self.compactclasses = [self.chunks[pointer] for pointer in chunk.data]
+        self.compactclasses = [self.chunk_at(pointer) for pointer in chunk.words()]
 
-    def init_g_objects(self):
-        for chunk in self.chunks.itervalues():
-            chunk.as_g_object(self) # initialize g_object
-        self.special_g_objects = self.chunks[self.specialobjectspointer].g_object.pointers
+    def wrap_int(self, value):
+        w_int = self.intcache.get(value, None)
+        if w_int is None:
+            w_int = self.space.wrap_int(value)
+            self.intcache[value] = w_int
+        return w_int
+
+    def pointer_chunk(self, pointer):
+        """ The chunk a pointer refers to, or None for SmallIntegers. """
+        if (pointer & 1) == 1:
+            return None
+        return self.chunk_at(pointer)
+
+    def decode_pointer(self, pointer):
+        if (pointer & 1) == 1:
+            return self.wrap_int(pointer >> 1)
+        return self.chunk_at(pointer).w_object
 
     def assign_prebuilt_constants(self):
         # Assign classes and objects that in special objects array that are already created.
@@ -213,11 +255,11 @@ class ImageReader(object):
             if name in prebuilt_objects:
                 try:
                     w_object = prebuilt_objects[name]
-                    g_object = self.special_object(so_index)
-                    if g_object.w_object is None:
-                        g_object.w_object = w_object
+                    chunk = self.special_object(so_index)
+                    if chunk.w_object is None:
+                        chunk.w_object = w_object
                     else:
-                        if not g_object.w_object.is_nil(self.space):
+                        if not chunk.w_object.is_nil(self.space):
                            raise Warning('Object found in multiple places in the special objects array')
                 except IndexError:
                     # certain special objects might not yet be in the image's table
@@ -225,27 +267,33 @@ class ImageReader(object):
 
     def special_object(self, index):
         # while python would raise an IndexError, after translation a nonexisting key results in a segfault...
-        if index >= len(self.special_g_objects):
+        special = self.chunk_at(self.specialobjectspointer)
+        if index >= special.word_count():
             raise IndexError
-        return self.special_g_objects[index]
+        return self.chunk_at(special.word(index))
 
     def init_w_objects(self):
-        for chunk in self.chunks.itervalues():
-            chunk.g_object.init_w_object()
-        self.special_objects_w = [g.w_object for g in self.special_g_objects]
+        for chunk in self.chunklist:
+            chunk.init_w_object()
+        self.special_objects_w = self.chunk_at(self.specialobjectspointer).get_pointers()
 
     def populate_special_objects(self):
         self.space.populate_special_objects(self.special_objects_w)
 
     def fillin_weak_w_objects(self):
         self.filledin_weakobjects = 0
-        for chunk in self.chunks.itervalues():
-            chunk.g_object.fillin_weak(self.space)
+        for chunk in self.chunklist:
+            chunk.fillin_weak(self.space)
 
     def fillin_w_objects(self):
         self.filledin_objects = 0
-        for chunk in self.chunks.itervalues():
-            chunk.g_object.fillin(self.space)
+        # Arrays can only store Characters unboxed once the character table is there.
+        try:
+            self.special_object(constants.SO_CHARACTER_TABLE_ARRAY).fillin(self.space)
+        except IndexError:
+            pass
+        for chunk in self.chunklist:
+            chunk.fillin(self.space)
 
     def log_object_filledin(self):
         self.filledin_objects = self.filledin_objects + 1
@@ -269,13 +317,14 @@ class SqueakImage(object):
     def __init__(self, reader):
         space = self.space = reader.space
         self.special_objects = space.wrap_list(reader.special_objects_w)
-        self.w_asSymbol = self.find_symbol(space, reader, "asSymbol")
+        self.init_symbol_table(space, reader)
+        self.w_asSymbol = self.find_symbol(space, "asSymbol")
         self.lastWindowSize = reader.lastWindowSize
         self.version = reader.version
         self.run_spy_hacks(space)
-        self.startup_time = time.time()
+        self.startup_time = clock.monotonic_milliseconds()
         from spyvm.plugins.simulation import SIMULATE_PRIMITIVE_SELECTOR
-        self.w_simulatePrimitive = self.find_symbol(space, reader, SIMULATE_PRIMITIVE_SELECTOR)
+        self.w_simulatePrimitive = self.find_symbol(space, SIMULATE_PRIMITIVE_SELECTOR)
 
     def run_spy_hacks(self, space):
         if not space.run_spy_hacks.is_set():
@@ -286,22 +335,19 @@ class SqueakImage(object):
                 # non-native indexed color depth not well supported
                 w_display.store(space, 3, space.wrap_int(8))
 
-    def find_symbol(self, space, reader, symbol):
+    def init_symbol_table(self, space, reader):
         w_dnu = self.special(constants.SO_DOES_NOT_UNDERSTAND)
         assert isinstance(w_dnu, model.W_BytesObject)
         assert space.unwrap_string(w_dnu) == "doesNotUnderstand:"
-        w_Symbol = w_dnu.getclass(space)
-        w_obj = None
-        # bit annoying that we have to hunt through the image :-(
+        symbol_table = space.symbol_table
+        symbol_table.w_Symbol = w_dnu.getclass(space)
         for chunk in reader.chunklist:
-            w_obj = chunk.g_object.w_object
-            if not isinstance(w_obj, model.W_BytesObject):
-                continue
-            if not w_obj.getclass(space).is_same_object(w_Symbol):
-                continue
-            if space.unwrap_string(w_obj) == symbol:
-                return w_obj
-        w_obj = space.w_nil
+            symbol_table.add(space, chunk.w_object) # ignores all but Symbols
+
+    def find_symbol(self, space, symbol):
+        w_obj = space.symbol_table.lookup(space, symbol)
+        if w_obj is None:
+            w_obj = space.w_nil
         return w_obj
 
     def special(self, index):
@@ -309,87 +355,87 @@ class SqueakImage(object):
 
 # ____________________________________________________________
 
-class GenericObject(object):
-    """ Intermediate representation of squeak objects. To establish all
-        pointers as object references, ImageReader creates instances of
-        GenericObject from the image chunks, and uses them as starting
-        point for the actual create of spyvm.model classes.
-        """
-
-    def __init__(self, space):
+class ImageChunk(object):
+    """ A chunk knows the information from the header, the body of the
+    object is decoded from the stream of the reader when its w_object is
+    filled in. The chunk is what the fillin methods of the w_objects get
+    to read their contents from. """
+    def __init__(self, space, size, format, classid, hash12):
         self.space = space
+        self.size = size
+        self.format = format
+        self.classid = classid
+        self.hash12 = hash12
+        # the body of the object is read lazily from the stream of the
+        # reader, starting at byte position offset
         self.reader = None
+        self.offset = 0
+        self.w_object = None
         self.filled_in = False
         self.filled_in_weak = False
 
-    def isinitialized(self):
-        return self.reader is not None
+    def __eq__(self, other):
+        "(for testing)"
+        return (self.__class__ is other.__class__ and
+                self.format == other.format and
+                self.classid == other.classid and
+                self.hash12 == other.hash12 and
+                (self.reader is None or other.reader is None or
+                 self.words() == other.words()))
 
-    def initialize_int(self, value, reader):
-        self.reader = reader
-        self.value = value
-        self.size = -1
-        if value in reader.intcache:
-            w_int = reader.intcache[value]
-        else:
-            w_int = self.space.wrap_int(value)
-            reader.intcache[value] = w_int
-        self.w_object = w_int
-        self.filled_in = True
-
-    def initialize(self, chunk, reader):
-        self.reader = reader
-        self.size = chunk.size
-        self.hash12 = chunk.hash12
-        self.format = chunk.format
-        self.chunk = chunk # for bytes, words and compiledmethod
-        self.init_class()
-        self.init_data() # for pointers
-        self.w_object = None
+    def __ne__(self, other):
+        "(for testing)"
+        return not self == other
 
-    def init_class(self):
-        if self.chunk.iscompact():
-            self.g_class = self.reader.compactclasses[self.chunk.classid
-                - 1].g_object # Smalltalk is 1-based indexed
-        else:
-            self.g_class = self.reader.chunks[self.chunk.classid].g_object
+    def iscompact(self):
+        return 0 < self.classid < 32
 
-    def init_data(self):
+    # === Body ===
+
+    def word_count(self):
+        return self.size - 1 # excluding the header
+
+    def word(self, index):
+        assert 0 <= index < self.word_count()
+        stream = self.reader.stream
+        return stream.word_at(self.offset + index * stream.word_size)
+
+    def words(self):
+        return [self.word(i) for i in range(self.word_count())]
+
+    def bytes(self, count):
+        assert count <= self.word_count() * self.reader.stream.word_size
+        return self.reader.stream.getslice(self.offset, self.offset + count)
+
+    def pointer_count(self):
         if self.ispointers():
-            self.pointers = self.decode_pointers()
-            assert None not in self.pointers
+            return self.word_count()
         elif self.iscompiledmethod():
-            header = self.chunk.data[0] >> 1 # untag tagged int
+            header = self.word(0) >> 1 # untag tagged int
             _, literalsize, _, _, _ = constants.decode_compiled_method_header(header)
-            self.pointers = self.decode_pointers(literalsize + 1) # adjust +1 for the header
+            return literalsize + 1 # adjust +1 for the header
+        return 0
 
-    def decode_pointers(self, end=-1):
-        if end == -1:
-            end = len(self.chunk.data)
-        pointers = []
-        for i in range(end):
-            pointer = self.chunk.data[i]
-            if (pointer & 1) == 1:
-                small_int = GenericObject(self.space)
-                small_int.initialize_int(pointer >> 1, self.reader)
-                pointers.append(small_int)
-            else:
-                pointers.append(self.reader.chunks[pointer].g_object)
-        return pointers
+    # === Format ===
+
+    def class_chunk(self):
+        if self.iscompact():
+            return self.reader.compactclasses[self.classid - 1] # Smalltalk is 1-based indexed
+        return self.reader.chunk_at(self.classid)
 
     def isbytes(self):
         return 8 <= self.format <= 11
 
     def is32bitlargepositiveinteger(self):
         return (self.format == 8 and
-                self.space.w_LargePositiveInteger.is_same_object(self.g_class.w_object) and
-                len(self.get_bytes()) <= 4)
+                self.space.w_LargePositiveInteger.is_same_object(self.class_chunk().w_object) and
+                self.byte_count() <= 4)
 
     def iswords(self):
         return self.format == 6
 
     def isfloat(self):
-        return self.iswords() and self.space.w_Float.is_same_object(self.g_class.w_object)
+        return self.iswords() and self.space.w_Float.is_same_object(self.class_chunk().w_object)
 
     def ispointers(self):
         return self.format < 5
@@ -439,30 +485,7 @@ class GenericObject(object):
                 assert 0, "not reachable"
         return self.w_object
 
-    def get_bytes(self):
-        bytes = []
-        if self.reader.version.is_big_endian:
-            for each in self.chunk.data:
-                bytes.append(chr((each >> 24) & 0xff))
-                bytes.append(chr((each >> 16) & 0xff))
-                bytes.append(chr((each >> 8) & 0xff))
-                bytes.append(chr((each >> 0) & 0xff))
-        else:
-            for each in self.chunk.data:
-                bytes.append(chr((each >> 0) & 0xff))
-                bytes.append(chr((each >> 8) & 0xff))
-                bytes.append(chr((each >> 16) & 0xff))
-                bytes.append(chr((each >> 24) & 0xff))
-        stop = len(bytes) - (self.format & 3)
-        assert stop >= 0
-        return bytes[:stop] # omit odd bytes
-
-    def get_ruints(self, required_len=-1):
-        from rpython.rlib.rarithmetic import r_uint
-        words = [r_uint(x) for x in self.chunk.data]
-        if required_len != -1 and len(words) != required_len:
-            raise error.CorruptImageError("Expected %d words, got %d" % (required_len, len(words)))
-        return words
+    # === Filling in ===
 
     def fillin(self, space):
         if not self.filled_in:
@@ -476,50 +499,324 @@ class GenericObject(object):
             self.w_object.fillin_weak(space, self)
             self.reader.log_weakobject_filledin()
 
-    def get_g_pointers(self):
-        assert self.pointers is not None
-        return self.pointers
+    def fillin_pointers(self, space):
+        """ Fill in the objects this chunk points to, and answer them like
+        get_pointers does, decoding every word only once. """
+        pointers = []
+        for i in range(self.pointer_count()):
+            pointer = self.word(i)
+            chunk = self.reader.pointer_chunk(pointer)
+            if chunk is None:
+                pointers.append(self.reader.wrap_int(pointer >> 1))
+            else:
+                chunk.fillin(space)
+                pointers.append(chunk.w_object)
+        return pointers
 
     def get_pointers(self):
-        return [g_object.w_object for g_object in self.get_g_pointers()]
+        return [self.reader.decode_pointer(self.word(i))
+                for i in range(self.pointer_count())]
+
+    def byte_count(self):
+        count = self.word_count() * self.reader.stream.word_size - (self.format & 3)
+        assert count >= 0
+        return count # omit odd bytes
+
+    def get_bytes(self):
+        # Bytes are stored in memory order, independent of the endianness
+        # of the image, so they are copied from the stream unchanged.
+        return list(self.bytes(self.byte_count()))
+
+    def get_ruints(self, required_len=-1):
+        from rpython.rlib.rarithmetic import r_uint
+        words = [r_uint(x) for x in self.words()]
+        if required_len != -1 and len(words) != required_len:
+            raise error.CorruptImageError("Expected %d words, got %d" % (required_len, len(words)))
+        return words
 
     def get_class(self):
-        w_class = self.g_class.w_object
+        w_class = self.class_chunk().w_object
         assert isinstance(w_class, model.W_PointersObject)
         return w_class
 
     def get_hash(self):
-        return self.chunk.hash12
+        return self.hash12
 
+# ____________________________________________________________
+#
+# Writer for the Squeak image format.
 
-class ImageChunk(object):
-    """ A chunk knows the information from the header, but the body of the
-    object is not decoded yet."""
-    def __init__(self, space, size, format, classid, hash12):
-        self.size = size
-        self.format = format
-        self.classid = classid
-        self.hash12 = hash12
-        # list of integers forming the body of the object
-        self.data = None
-        self.g_object = GenericObject(space)
-
-    def __eq__(self, other):
-        "(for testing)"
-        return (self.__class__ is other.__class__ and
-                self.format == other.format and
-                self.classid == other.classid and
-                self.hash12 == other.hash12 and
-                self.data == other.data)
+IMAGE_HEADER_SIZE = 64 # bytes, 16 words
+MAX_SHORT_HEADER_SIZE = 63 # words, the size field of the base header has 6 bits
+WRITE_BUFFER_SIZE = 64 * 1024
 
-    def __ne__(self, other):
-        "(for testing)"
-        return not self == other
+SMALLINT_31BIT_MIN = -(1 << 30)
+SMALLINT_31BIT_MAX = (1 << 30) - 1
 
-    def as_g_object(self, reader):
-        if not self.g_object.isinitialized():
-            self.g_object.initialize(self, reader)
-        return self.g_object
+class ImageWriter(object):
+    """ Writes the objects reachable from the special objects array as a
+    32-bit image, in the version (and byte order) of the loaded image.
+    The objects are numbered in a first pass over the object graph and
+    written in a second one through a small buffer, so the image is never
+    built up in memory as a whole. """
 
-    def iscompact(self):
-        return 0 < self.classid < 32
+    def __init__(self, space, image):
+        assert not image.version.is_64bit
+        self.space = space
+        self.version = image.version
+        self.last_window_size = image.lastWindowSize
+        self.w_special_objects = image.special_objects
+        self.oops = {} # Maps objects to their address in the written image
+        # SmallIntegers that do not fit into 31 bits are written as
+        # LargeIntegers, this maps their values to the address of those
+        self.int_oops = {}
+        # Floats are compared by value and unboxing storage strategies wrap
+        # them anew on every fetch, so they are numbered by their bits
+        self.float_oops = {}
+        self.objects_w = [] # All objects to write, in the order of their addresses
+        self.compact_classes = {}
+        self.body_size = 0
+        self.out = None
+
+    def write(self, filename):
+        """ Can raise OSError. The image is written to a temporary file
+        next to filename first, so a failed snapshot does not destroy an
+        existing image. """
+        self.init_compact_classes()
+        self.trace_objects()
+        self.out = WordFileWriter(filename, self.version.is_big_endian)
+        try:
+            self.write_header()
+            for w_object in self.objects_w:
+                self.write_object(w_object)
+            self.out.finish()
+        finally:
+            self.out.close()
+
+    def init_compact_classes(self):
+        w_compact_classes = self.w_special_objects.fetch(self.space, constants.SO_COMPACT_CLASSES_ARRAY)
+        for i in range(w_compact_classes.size()):
+            w_class = w_compact_classes.fetch(self.space, i)
+            if not w_class.is_nil(self.space):
+                self.compact_classes[w_class] = i + 1
+
+    # === Numbering the objects ===
+
+    def trace_objects(self):
+        self.add_object(self.w_special_objects)
+        i = 0
+        while i < len(self.objects_w):
+            w_object = self.objects_w[i]
+            self.add_object(w_object.getclass(self.space))
+            for w_pointer in self.pointers_of(w_object):
+                self.add_object(w_pointer)
+            i += 1
+
+    def add_object(self, w_object):
+        if isinstance(w_object, model.W_SmallInteger):
+            value = w_object.value
+            if fits_31bit(value) or value in self.int_oops:
+                return
+            w_large = self.large_integer(value)
+            self.int_oops[value] = self.assign_oop(w_large)
+        elif isinstance(w_object, model.W_Float):
+            bits = longlong2float.float2longlong(w_object.value)
+            if bits not in self.float_oops:
+                self.float_oops[bits] = self.assign_oop(w_object)
+        elif w_object not in self.oops:
+            self.oops[w_object] = self.assign_oop(w_object)
+
+    def assign_oop(self, w_object):
+        format, word_count = self.layout(w_object)
+        header_words = self.header_word_count(w_object, word_count)
+        oop = self.body_size + (header_words - 1) * 4 # oops point to the base header
+        self.body_size += (header_words + word_count) * 4
+        self.objects_w.append(w_object)
+        return oop
+
+    def large_integer(self, value):
+        if value < 0:
+            w_class = self.space.large_negative_integer_class()
+            if w_class is None:
+                raise error.WrappingError("No LargeNegativeInteger class to write %d" % value)
+        else:
+            w_class = self.space.w_LargePositiveInteger
+        return model.W_LargeInteger(self.space, w_class, rbigint.fromint(value))
+
+    def header_word_count(self, w_object, word_count):
+        if word_count + 1 > MAX_SHORT_HEADER_SIZE:
+            return 3
+        elif self.compact_classes.get(w_object.getclass(self.space), 0) == 0:
+            return 2
+        return 1
+
+    # === Object layout ===
+
+    def layout(self, w_object):
+        """ The format of the object and the number of words of its body,
+        see ImageChunk.init_w_object for the formats. """
+        if isinstance(w_object, model.W_PointersObject):
+            return self.pointers_format(w_object), w_object.size()
+        elif isinstance(w_object, model.W_CompiledMethod):
+            byte_count = len(w_object.bytes)
+            return (12 + odd_bytes(byte_count),
+                    1 + w_object.literalsize + words_for_bytes(byte_count))
+        elif isinstance(w_object, model.W_Float):
+            return 6, 2
+        elif (isinstance(w_object, model.W_BytesObject) or
+                isinstance(w_object, model.W_LargePositiveInteger1Word) or
+                isinstance(w_object, model.W_LargeInteger)):
+            byte_count = w_object.size()
+            return 8 + odd_bytes(byte_count), words_for_bytes(byte_count)
+        else:
+            # Words objects and display bitmaps
+            return 6, w_object.size()
+
+    def pointers_format(self, w_object):
+        s_class = w_object.class_shadow(self.space)
+        if s_class.instance_kind == WEAK_POINTERS:
+            return 4
+        elif s_class.isvariable():
+            return 2 if s_class.instsize() == 0 else 3
+        return 0 if w_object.size() == 0 else 1
+
+    def pointers_of(self, w_object):
+        if isinstance(w_object, model.W_PointersObject):
+            return [w_object.fetch(self.space, i) for i in range(w_object.size())]
+        elif isinstance(w_object, model.W_CompiledMethod):
+            return [w_object.getliteral(i) for i in range(w_object.literalsize)]
+        return []
+
+    def bytes_of(self, w_object):
+        if isinstance(w_object, model.W_CompiledMethod):
+            return "".join(w_object.bytes)
+        return w_object.unwrap_string(self.space)[:w_object.size()]
+
+    # === Writing ===
+
+    def write_header(self):
+        self.out.write_word(self.version.magic)
+        self.out.write_word(IMAGE_HEADER_SIZE)
+        self.out.write_word(self.body_size) # endofmemory
+        self.out.write_word(0) # old base address
+        self.out.write_word(self.pointer(self.w_special_objects))
+        self.out.write_word(0) # last used hash
+        self.out.write_word(self.last_window_size)
+        self.out.write_word(0) # fullscreen flag
+        self.out.write_word(0) # extra VM memory
+        for _ in range(9, IMAGE_HEADER_SIZE / 4):
+            self.out.write_word(0)
+
+    def write_object(self, w_object):
+        format, word_count = self.layout(w_object)
+        w_class = w_object.getclass(self.space)
+        header_words = self.header_word_count(w_object, word_count)
+        # Objects with an identity hash have 12-bit hashes already, Floats
+        # hash by their value and do not need to keep the header hash.
+        hash = w_object.gethash() & 0xfff
+        if header_words == 3:
+            self.out.write_word((word_count + 1) << 2)
+            self.out.write_word(self.pointer(w_class))
+            self.out.write_word(base_header(0, 0, format, 0, hash))
+        elif header_words == 2:
+            self.out.write_word(self.pointer(w_class) | 1)
+            self.out.write_word(base_header(1, word_count + 1, format, 0, hash))
+        else:
+            compact_index = self.compact_classes[w_class]
+            self.out.write_word(base_header(3, word_count + 1, format, compact_index, hash))
+        self.write_body(w_object, format, word_count)
+
+    def write_body(self, w_object, format, word_count):
+        if isinstance(w_object, model.W_Float):
+            from rpython.rlib.rstruct.ieee import float_pack
+            r = float_pack(w_object.value, 8)
+            high = intmask(r >> 32)
+            low = intmask(r)
+            if self.version.has_floats_reversed:
+                self.out.write_word(low)
+                self.out.write_word(high)
+            else:
+                self.out.write_word(high)
+                self.out.write_word(low)
+        elif format < 5:
+            for w_pointer in self.pointers_of(w_object):
+                self.out.write_word(self.pointer(w_pointer))
+        elif format < 8:
+            for i in range(word_count):
+                self.out.write_word(intmask(w_object.getword(i)))
+        else:
+            if format >= 12:
+                assert isinstance(w_object, model.W_CompiledMethod)
+                self.out.write_word(w_object.getheader() << 1 | 1)
+                for w_literal in self.pointers_of(w_object):
+                    self.out.write_word(self.pointer(w_literal))
+            # Bytes are written in memory order, padded to full words.
+            self.out.write_bytes(self.bytes_of(w_object) + "\x00" * (format & 3))
+
+    def pointer(self, w_object):
+        if isinstance(w_object, model.W_SmallInteger):
+            value = w_object.value
+            if fits_31bit(value):
+                return value << 1 | 1
+            return self.int_oops[value]
+        elif isinstance(w_object, model.W_Float):
+            return self.float_oops[longlong2float.float2longlong(w_object.value)]
+        return self.oops[w_object]
+
+
+def fits_31bit(value):
+    return SMALLINT_31BIT_MIN <= value <= SMALLINT_31BIT_MAX
+
+def odd_bytes(byte_count):
+    return (4 - byte_count % 4) % 4
+
+def words_for_bytes(byte_count):
+    return (byte_count + 3) / 4
+
+def base_header(kind, size, format, compact_index, hash12):
+    return kind | size << 2 | format << 8 | compact_index << 12 | hash12 << 17
+
+class WordFileWriter(object):
+    """ Buffered output of 32-bit words and bytes. The file is written under
+    a temporary name and only renamed to filename by finish, so a failed
+    write does not destroy an existing file. Can raise OSError. """
+
+    def __init__(self, filename, big_endian):
+        self.filename = filename
+        self.temp_filename = filename + ".tmp"
+        self.big_endian = big_endian
+        self.buffer = []
+        self.buffered = 0
+        self.fd = os.open(self.temp_filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | stream.O_BINARY, 0644)
+
+    def write_word(self, word):
+        if self.big_endian:
+            self.write_bytes("".join([chr((word >> 24) & 0xff), chr((word >> 16) & 0xff),
+                                      chr((word >> 8) & 0xff), chr(word & 0xff)]))
+        else:
+            self.write_bytes("".join([chr(word & 0xff), chr((word >> 8) & 0xff),
+                                      chr((word >> 16) & 0xff), chr((word >> 24) & 0xff)]))
+
+    def write_bytes(self, bytes):
+        self.buffer.append(bytes)
+        self.buffered += len(bytes)
+        if self.buffered >= WRITE_BUFFER_SIZE:
+            self.flush()
+
+    def flush(self):
+        data = "".join(self.buffer)
+        self.buffer = []
+        self.buffered = 0
+        while data:
+            written = os.write(self.fd, data)
+            data = data[written:]
+
+    def finish(self):
+        self.flush()
+        self.close()
+        os.rename(self.temp_filename, self.filename)
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
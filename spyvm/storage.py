@@ -2,6 +2,7 @@
 import weakref, sys
 from spyvm import model, constants
 from spyvm.util.version import VersionMixin
+from spyvm.util.strategy_profiler import StrategyProfiler
 from rpython.rlib import objectmodel, jit
 from rpython.rlib.objectmodel import import_from_mixin
 from rpython.rlib.rstrategies import rstrategies as rstrat
@@ -67,6 +68,85 @@ class AbstractStrategy(object):
         # This is only needed in ShadowMixin, but has to be pulled up here because
         # both AbstractGenericShadow and ContextPartShadow use it.
         raise NotImplementedError("This strategy doesn't handle become.")
+    def copy_from(self, w_self, w_source, start, stop, src_start):
+        copy_fields(w_self, w_source, start, stop, src_start)
+    def fill(self, w_self, start, stop, w_value):
+        space = self.space
+        for i in range(start, stop):
+            w_self.store(space, i, w_value)
+    def copy_slice(self, w_self, start, stop):
+        """A new object of the class of w_self holding the fields start..stop
+        (exclusive) of w_self."""
+        space = self.space
+        w_new = model.W_PointersObject(space, w_self.getclass(space), stop - start)
+        w_new.copy_from(space, w_self, 0, stop - start, start)
+        return w_new
+    def concat(self, w_self, w_other):
+        """A new object of the class of w_self holding the fields of w_self
+        followed by the fields of w_other."""
+        space = self.space
+        size = self.size(w_self)
+        other_size = w_other.size()
+        w_new = model.W_PointersObject(space, w_self.getclass(space), size + other_size)
+        w_new.copy_from(space, w_self, 0, size, 0)
+        w_new.copy_from(space, w_other, size, size + other_size, 0)
+        return w_new
+
+def new_with_storage(space, w_class, strategy, storage):
+    """A new object of w_class, directly using strategy and storage."""
+    w_new = model.W_PointersObject(space, w_class, 0)
+    space.strategy_factory.set_strategy(w_new, strategy)
+    strategy.set_storage(w_new, storage)
+    return w_new
+
+def copy_fields(w_self, w_source, start, stop, src_start):
+    """Copy field by field. Stores may switch the strategy of w_self, so they
+    go through w_self."""
+    space = w_self.space()
+    count = stop - start
+    if w_self is w_source and start > src_start:
+        # copy backwards, the ranges overlap
+        for i in range(count - 1, -1, -1):
+            w_self.store(space, start + i, w_source.fetch(space, src_start + i))
+    else:
+        for i in range(count):
+            w_self.store(space, start + i, w_source.fetch(space, src_start + i))
+
+class StorageCopyMixin(object):
+    """For strategies with a storage list: copying between two objects of the
+    same strategy copies the unboxed storage and keeps the strategy. The same
+    goes for fill, copy_slice and concat."""
+    def copy_from(self, w_self, w_source, start, stop, src_start):
+        if w_source._get_strategy() is self and not self.is_shadow():
+            src_stop = src_start + stop - start
+            # slices of the same length, i.e. an array copy
+            self.get_storage(w_self)[start:stop] = self.get_storage(w_source)[src_start:src_stop]
+        else:
+            copy_fields(w_self, w_source, start, stop, src_start)
+    def fill(self, w_self, start, stop, w_value):
+        if self.is_shadow():
+            AbstractStrategy.fill(self, w_self, start, stop, w_value)
+        elif self._check_can_handle(w_value):
+            value = self._unwrap(w_value)
+            storage = self.get_storage(w_self)
+            for i in range(start, stop):
+                storage[i] = value
+        elif start < stop:
+            # generalize once, not for every field
+            new_strategy = self._generalize_for_value(w_self, w_value)
+            new_strategy.fill(w_self, start, stop, w_value)
+    def copy_slice(self, w_self, start, stop):
+        if self.is_shadow():
+            return AbstractStrategy.copy_slice(self, w_self, start, stop)
+        space = self.space
+        return new_with_storage(space, w_self.getclass(space), self,
+                                self.get_storage(w_self)[start:stop])
+    def concat(self, w_self, w_other):
+        if w_other._get_strategy() is self and not self.is_shadow():
+            space = self.space
+            return new_with_storage(space, w_self.getclass(space), self,
+                                    self.get_storage(w_self) + self.get_storage(w_other))
+        return AbstractStrategy.concat(self, w_self, w_other)
 
 # ========== Storage classes implementing storage strategies ==========
 
@@ -88,6 +168,7 @@ class ListStrategy(SingletonStorageStrategy):
     _attrs_ = []
     repr_classname = "ListStrategy"
     import_from_mixin(rstrat.GenericStrategy)
+    import_from_mixin(StorageCopyMixin)
 
 class ListEntry(object):
     _attrs_ = ['strong_content', 'weak_content']
@@ -184,6 +265,7 @@ class WeakListStrategy(SingletonStorageStrategy):
 class SmallIntegerOrNilStrategy(SingletonStorageStrategy):
     repr_classname = "SmallIntegerOrNilStrategy"
     import_from_mixin(rstrat.TaggingStrategy)
+    import_from_mixin(StorageCopyMixin)
     contained_type = model.W_SmallInteger
     def wrap(self, val): return self.space.wrap_int(val)
     def unwrap(self, w_val): return self.space.unwrap_int(w_val)
@@ -194,6 +276,7 @@ class SmallIntegerOrNilStrategy(SingletonStorageStrategy):
 class FloatOrNilStrategy(SingletonStorageStrategy):
     repr_classname = "FloatOrNilStrategy"
     import_from_mixin(rstrat.TaggingStrategy)
+    import_from_mixin(StorageCopyMixin)
     contained_type = model.W_Float
     tag_float = sys.float_info.max
     def wrap(self, val): return self.space.wrap_float(val)
@@ -201,26 +284,329 @@ class FloatOrNilStrategy(SingletonStorageStrategy):
     def wrapped_tagged_value(self): return self.space.w_nil
     def unwrapped_tagged_value(self): return self.tag_float
 
+NIL_CHARACTER = u'\uffff'
+
+def character_table_index(space, w_value):
+    """Answer the code of w_value if it is one of the Characters of the
+    character table, else -1. Only those can be unboxed, as fetching them
+    must answer the identical object."""
+    if not isinstance(w_value, model.W_PointersObject) or not w_value.has_strategy():
+        return -1
+    w_table = space.w_charactertable
+    # while the image is loaded, the table might not be filled in yet
+    if not w_table.has_strategy() or isinstance(w_table.strategy, CharacterOrNilStrategy):
+        return -1
+    if not space.w_Character.is_same_object(w_value.getclass(space)):
+        return -1
+    w_code = w_value.fetch(space, constants.CHARACTER_VALUE_INDEX)
+    if not isinstance(w_code, model.W_SmallInteger):
+        return -1
+    code = w_code.value
+    if not (0 <= code < w_table.size()) or w_table.fetch(space, code) is not w_value:
+        return -1
+    return code
+
+@rstrat.strategy(generalize=[ListStrategy])
+class CharacterOrNilStrategy(SingletonStorageStrategy):
+    """Characters of the character table, stored as their code points."""
+    repr_classname = "CharacterOrNilStrategy"
+    import_from_mixin(rstrat.SpecializedStrategy)
+    import_from_mixin(StorageCopyMixin)
+    def _check_can_handle(self, w_value):
+        return w_value is self.space.w_nil or character_table_index(self.space, w_value) >= 0
+    def wrap(self, char):
+        if char == NIL_CHARACTER:
+            return self.space.w_nil
+        return self.space.w_charactertable.fetch(self.space, ord(char))
+    def unwrap(self, w_value):
+        if w_value is self.space.w_nil:
+            return NIL_CHARACTER
+        return unichr(character_table_index(self.space, w_value))
+    def store(self, w_self, index0, w_value):
+        # The index into the character table is both the check and the
+        # unwrapped value, so it is only looked up once.
+        self.check_index_store(w_self, index0)
+        assert index0 >= 0
+        if w_value is self.space.w_nil:
+            char = NIL_CHARACTER
+        else:
+            code = character_table_index(self.space, w_value)
+            if code < 0:
+                self._cannot_handle_store(w_self, index0, w_value)
+                return
+            char = unichr(code)
+        self.get_storage(w_self)[index0] = char
+
+class BooleanBitmap(object):
+    """Two bits per slot: 0 is nil, 1 false, 2 true."""
+    _attrs_ = ['size', 'bits']
+    def __init__(self, size):
+        self.size = size
+        self.bits = ['\x00'] * ((size + 3) // 4)
+    def get(self, index0):
+        return (ord(self.bits[index0 >> 2]) >> ((index0 & 3) * 2)) & 3
+    def set(self, index0, code):
+        shift = (index0 & 3) * 2
+        byte = ord(self.bits[index0 >> 2]) & ~(3 << shift)
+        self.bits[index0 >> 2] = chr(byte | (code << shift))
+
+@rstrat.strategy(generalize=[ListStrategy])
+class BooleanOrNilStrategy(SingletonStorageStrategy):
+    repr_classname = "BooleanOrNilStrategy"
+    def _initialize_storage(self, w_self, initial_size):
+        self.set_storage(w_self, BooleanBitmap(initial_size))
+    def _check_can_handle(self, w_value):
+        space = self.space
+        return w_value is space.w_nil or w_value is space.w_false or w_value is space.w_true
+    def size(self, w_self):
+        return self.get_storage(w_self).size
+    def fetch(self, w_self, index0):
+        code = self.get_storage(w_self).get(index0)
+        if code == 2:
+            return self.space.w_true
+        elif code == 1:
+            return self.space.w_false
+        return self.space.w_nil
+    def store(self, w_self, index0, w_value):
+        space = self.space
+        if w_value is space.w_nil:
+            code = 0
+        elif w_value is space.w_false:
+            code = 1
+        elif w_value is space.w_true:
+            code = 2
+        else:
+            self._cannot_handle_store(w_self, index0, w_value)
+            return
+        self.get_storage(w_self).set(index0, code)
+
 @rstrat.strategy(generalize=[
     SmallIntegerOrNilStrategy,
     FloatOrNilStrategy,
+    CharacterOrNilStrategy,
+    BooleanOrNilStrategy,
     ListStrategy])
 class AllNilStrategy(SingletonStorageStrategy):
     repr_classname = "AllNilStrategy"
     import_from_mixin(rstrat.SingleValueStrategy)
     def value(self): return self.space.w_nil
+    def copy_from(self, w_self, w_source, start, stop, src_start):
+        if w_source._get_strategy() is self:
+            return # nil over nil
+        copy_fields(w_self, w_source, start, stop, src_start)
+    def fill(self, w_self, start, stop, w_value):
+        if w_value is self.value() or start >= stop:
+            return
+        new_strategy = self._generalize_for_value(w_self, w_value)
+        new_strategy.fill(w_self, start, stop, w_value)
+
+# ========== Per-class shapes for fixed-size objects ==========
+
+# Kinds of the named slots of a shape, ordered by generality.
+FIELD_NIL = 0     # only nil stored so far, no storage needed
+FIELD_INT = 1     # SmallIntegers or nil, unboxed
+FIELD_FLOAT = 2   # Floats or nil, unboxed
+FIELD_OBJECT = 3  # anything
+
+INT_NIL = constants.MAXINT
+FLOAT_NIL = sys.float_info.max
+
+class FieldStorage(object):
+    """Storage of an object with a FieldShapeStrategy. The shape maps every
+    slot to an index into one of the three lists. Lists the shape has no
+    slots for are None, so objects pay only for the kinds they use."""
+    _attrs_ = ['ints', 'floats', 'objects_w']
+    def __init__(self, ints, floats, objects_w):
+        self.ints = ints
+        self.floats = floats
+        self.objects_w = objects_w
+
+def field_kind_for(space, kind, w_value):
+    """The kind a slot of the given kind generalizes to when storing w_value."""
+    if kind == FIELD_NIL:
+        if isinstance(w_value, model.W_SmallInteger) and w_value.value != INT_NIL:
+            return FIELD_INT
+        if isinstance(w_value, model.W_Float) and w_value.value != FLOAT_NIL:
+            return FIELD_FLOAT
+    return FIELD_OBJECT
+
+class FieldShapeStrategy(AbstractStrategy):
+    """
+    The shape (hidden class) of the instances of a fixed-size pointers class.
+    It is not a singleton, but shared by all instances of its class that were
+    created at runtime, and records the kind of every named slot, so
+    SmallIntegers and Floats are kept unboxed. A store that does not fit the
+    kind of its slot does not change the shape: the class gets a more general
+    successor shape, and objects of the old shape migrate to it on their next
+    access. The quasi-immutable successor field invalidates compiled code that
+    relied on the old shape, just like a version change.
+    """
+    repr_classname = "FieldShapeStrategy"
+    _attrs_ = ['s_class', 'kinds', 'positions', 'int_count', 'float_count',
+               'object_count', 'successor', 'empty_storage']
+    _immutable_fields_ = ['s_class', 'kinds[*]', 'positions[*]', 'int_count',
+                          'float_count', 'object_count', 'successor?',
+                          'empty_storage']
+
+    def __init__(self, space, s_class, kinds):
+        AbstractStrategy.__init__(self, space, None, len(kinds))
+        self.s_class = s_class
+        self.kinds = kinds
+        counts = [0, 0, 0, 0]
+        positions = [0] * len(kinds)
+        for i in range(len(kinds)):
+            positions[i] = counts[kinds[i]]
+            counts[kinds[i]] += 1
+        self.positions = positions
+        self.int_count = counts[FIELD_INT]
+        self.float_count = counts[FIELD_FLOAT]
+        self.object_count = counts[FIELD_OBJECT]
+        self.successor = None
+        # As long as all slots are nil, there is nothing to store, so all
+        # instances share one storage without any lists.
+        self.empty_storage = None
+        if len(kinds) == counts[FIELD_NIL]:
+            self.empty_storage = FieldStorage(None, None, None)
+
+    def _initialize_storage(self, w_self, initial_size):
+        assert initial_size == len(self.kinds)
+        storage = self.empty_storage
+        if storage is None:
+            ints = None
+            if self.int_count > 0:
+                ints = [INT_NIL] * self.int_count
+            floats = None
+            if self.float_count > 0:
+                floats = [FLOAT_NIL] * self.float_count
+            objects_w = None
+            if self.object_count > 0:
+                objects_w = [self.space.w_nil] * self.object_count
+            storage = FieldStorage(ints, floats, objects_w)
+        self.set_storage(w_self, storage)
+
+    def size(self, w_self):
+        return len(self.kinds)
+
+    def fetch(self, w_self, n0):
+        shape = jit.promote(self)
+        # While w_self is switched to another strategy, that strategy is set
+        # before it reads the old storage, and w_self must not migrate then.
+        if shape.successor is not None and w_self.strategy is shape:
+            return shape.migrate(w_self).fetch(w_self, n0)
+        return shape.read(shape.get_storage(w_self), n0)
+
+    def fetch_all(self, w_self):
+        storage = self.get_storage(w_self)
+        return [self.read(storage, i) for i in range(len(self.kinds))]
+
+    def store(self, w_self, n0, w_value):
+        shape = jit.promote(self)
+        if shape.successor is not None:
+            shape.migrate(w_self).store(w_self, n0, w_value)
+            return
+        if not shape.write(shape.get_storage(w_self), n0, w_value):
+            shape.generalize(n0, field_kind_for(self.space, shape.kinds[n0], w_value))
+            new_shape = shape.migrate(w_self)
+            stored = new_shape.write(new_shape.get_storage(w_self), n0, w_value)
+            assert stored
+
+    def read(self, storage, n0):
+        kind = self.kinds[n0]
+        pos = self.positions[n0]
+        if kind == FIELD_INT:
+            value = storage.ints[pos]
+            if value == INT_NIL:
+                return self.space.w_nil
+            return self.space.wrap_int(value)
+        elif kind == FIELD_FLOAT:
+            fvalue = storage.floats[pos]
+            if fvalue == FLOAT_NIL:
+                return self.space.w_nil
+            return self.space.wrap_float(fvalue)
+        elif kind == FIELD_OBJECT:
+            return storage.objects_w[pos]
+        return self.space.w_nil
+
+    def write(self, storage, n0, w_value):
+        """Store w_value unless it does not fit the kind of the slot."""
+        kind = self.kinds[n0]
+        pos = self.positions[n0]
+        if kind == FIELD_OBJECT:
+            storage.objects_w[pos] = w_value
+            return True
+        is_nil = w_value is self.space.w_nil
+        if kind == FIELD_INT:
+            if is_nil:
+                storage.ints[pos] = INT_NIL
+                return True
+            if isinstance(w_value, model.W_SmallInteger) and w_value.value != INT_NIL:
+                storage.ints[pos] = w_value.value
+                return True
+        elif kind == FIELD_FLOAT:
+            if is_nil:
+                storage.floats[pos] = FLOAT_NIL
+                return True
+            if isinstance(w_value, model.W_Float) and w_value.value != FLOAT_NIL:
+                storage.floats[pos] = w_value.value
+                return True
+        else:
+            return is_nil
+        return False
+
+    def generalize(self, n0, kind):
+        """Replace this shape by one with a more general kind for slot n0."""
+        assert self.successor is None
+        kinds = self.kinds[:]
+        kinds[n0] = kind
+        new_shape = FieldShapeStrategy(self.space, self.s_class, kinds)
+        self.successor = new_shape
+        self.s_class.shape_replaced(self, new_shape)
+        return new_shape
+
+    @jit.unroll_safe
+    def migrate(self, w_self):
+        """Move w_self from this deprecated shape to the current one. Kinds only
+        get more general along the successors, so every value still fits."""
+        new_shape = self.successor
+        assert new_shape is not None
+        while new_shape.successor is not None:
+            new_shape = new_shape.successor
+        storage = self.get_storage(w_self)
+        values_w = [self.read(storage, i) for i in range(len(self.kinds))]
+        self.space.strategy_factory.set_strategy(w_self, new_shape)
+        new_shape._initialize_storage(w_self, len(values_w))
+        new_storage = new_shape.get_storage(w_self)
+        for i in range(len(values_w)):
+            stored = new_shape.write(new_storage, i, values_w[i])
+            assert stored
+        return new_shape
 
 class StrategyFactory(rstrat.StrategyFactory):
-    _immutable_fields_ = ["space", "no_specialized_storage"]
+    _immutable_fields_ = ["space", "no_specialized_storage", "profiler"]
     def __init__(self, space):
         from spyvm import objspace
         self.space = space
         self.no_specialized_storage = objspace.ConstantFlag()
+        self.profiler = StrategyProfiler()
         rstrat.StrategyFactory.__init__(self, AbstractStrategy)
 
     def instantiate_strategy(self, strategy_type, w_self=None, initial_size=0):
+        if strategy_type is FieldShapeStrategy:
+            return self.existing_class_shadow(w_self).field_shape()
         return strategy_type(self.space, w_self, initial_size)
 
+    def existing_class_shadow(self, w_self):
+        """The ClassShadow of the class of w_self, if it already has one. The
+        class is not switched to a ClassShadow here."""
+        from spyvm.storage_classes import ClassShadow
+        w_class = w_self.w_class
+        if w_class is None or not w_class.has_strategy():
+            return None
+        s_class = w_class.strategy
+        if isinstance(s_class, ClassShadow):
+            return s_class
+        return None
+
     def strategy_type_for(self, objects, weak=False):
         if weak:
             return WeakListStrategy
@@ -233,9 +619,17 @@ class StrategyFactory(rstrat.StrategyFactory):
             return WeakListStrategy
         if self.no_specialized_storage.is_set():
             return ListStrategy
+        s_class = self.existing_class_shadow(w_self)
+        if s_class is not None and s_class.uses_field_shapes(size):
+            return FieldShapeStrategy
         return AllNilStrategy
 
     def log(self, w_self, new_strategy, old_strategy=None, new_element=None):
+        if self.profiler.active and old_strategy and self.space.image_loaded.is_set():
+            element_classname = new_element.guess_classname() if new_element else ""
+            self.profiler.record_switch(w_self, old_strategy.repr_classname,
+                                        new_strategy.repr_classname, element_classname,
+                                        new_strategy.size(w_self))
         if not self.logger.active: return
         # Gather information to be logged
         image_loaded = self.space.image_loaded.is_set()
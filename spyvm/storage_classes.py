@@ -1,8 +1,9 @@
 
 from spyvm import model, constants, error, wrapper
-from spyvm.storage import AbstractCachingShadow, AbstractGenericShadow
+from spyvm.storage import AbstractCachingShadow, AbstractGenericShadow, FieldShapeStrategy, FIELD_NIL
 from spyvm.util.version import constant_for_version, constant_for_version_arg, Version
-from rpython.rlib import jit
+from rpython.rlib import jit, rweakref
+from rpython.rlib.objectmodel import compute_identity_hash
 
 POINTERS = 0
 BYTES = 1
@@ -21,9 +22,9 @@ class ClassShadow(AbstractCachingShadow):
     """
 
     _attrs_ = ["name", "_instance_size", "instance_varsized", "instance_kind",
-                "_s_methoddict", "_s_superclass", "subclass_s"]
+                "_s_methoddict", "_s_superclass", "subclass_s", "_field_shape"]
     name = '??? (incomplete class info)'
-    _s_superclass = _s_methoddict = None
+    _s_superclass = _s_methoddict = _field_shape = None
     provides_getname = True
     repr_classname = "ClassShadow"
 
@@ -55,6 +56,8 @@ class ClassShadow(AbstractCachingShadow):
             # decode the instSpec
             format = (classformat >> 7) & 15
             self.instance_varsized = format >= 2
+            # Existing instances keep their shapes, new ones get a fresh shape.
+            self._field_shape = None
 
             # In case of raised exception below.
             self.changed()
@@ -176,6 +179,22 @@ class ClassShadow(AbstractCachingShadow):
             raise NotImplementedError(self.instance_kind)
         return w_new
 
+    def uses_field_shapes(self, size):
+        """Fixed-size pointers instances with named slots share a FieldShapeStrategy."""
+        return (self.instance_kind == POINTERS and not self.instance_varsized and
+                size > 0 and size == self.instsize())
+
+    def field_shape(self):
+        shape = self._field_shape
+        if shape is None:
+            shape = FieldShapeStrategy(self.space, self, [FIELD_NIL] * self.instsize())
+            self._field_shape = shape
+        return shape
+
+    def shape_replaced(self, old_shape, new_shape):
+        if self._field_shape is old_shape:
+            self._field_shape = new_shape
+
     def w_methoddict(self):
         return self._s_methoddict.w_self()
 
@@ -254,6 +273,152 @@ class ClassShadow(AbstractCachingShadow):
         self.s_methoddict().methoddict[w_selector] = w_method
         if isinstance(w_method, model.W_CompiledMethod):
             w_method.compiledin_class = self.w_self()
+        self.changed()
+
+INLINE_CACHE_SIZE = 4
+
+class InlineCache(object):
+    """A polymorphic inline cache for a single send site (a pc in a
+    CompiledMethod). It maps receiver class shadows to the method found for
+    the selector of the send. An entry is only valid as long as the class
+    shadow still has the version it had when the entry was filled, so
+    ClassShadow.changed() invalidates all entries of a class and its
+    subclasses.
+    """
+    _attrs_ = ["w_selector", "classes_s", "versions", "methods_w",
+               "next_slot", "hits", "misses"]
+
+    def __init__(self, w_selector):
+        self.hits = 0
+        self.misses = 0
+        self.flush(w_selector)
+
+    def flush(self, w_selector):
+        self.w_selector = w_selector
+        self.classes_s = [None] * INLINE_CACHE_SIZE
+        self.versions = [None] * INLINE_CACHE_SIZE
+        self.methods_w = [None] * INLINE_CACHE_SIZE
+        self.next_slot = 0
+
+    def lookup(self, w_selector, s_class, method_cache):
+        if self.w_selector is not w_selector:
+            # The literals of the method have changed.
+            self.flush(w_selector)
+        version = s_class.version
+        index = -1
+        for i in range(INLINE_CACHE_SIZE):
+            if self.classes_s[i] is s_class:
+                if self.versions[i] is version:
+                    self.hits += 1
+                    return self.methods_w[i]
+                index = i # Stale entry, refill it.
+                break
+        if index == -1:
+            # Polymorphic overflow: replace entries round-robin.
+            index = self.next_slot
+            self.next_slot = (index + 1) % INLINE_CACHE_SIZE
+        self.misses += 1
+        w_method = method_cache.lookup(s_class, w_selector)
+        self.classes_s[index] = s_class
+        self.versions[index] = version
+        self.methods_w[index] = w_method
+        return w_method
+
+METHOD_CACHE_SIZE = 2048 # Must be a power of two.
+
+class MethodCache(object):
+    """A global, direct-mapped method lookup cache like the one of the classic
+    Squeak interpreter, used for sends outside of traces. It maps (class
+    shadow, selector) to the method found. Entries record the version of the
+    class shadow, so changed classes miss implicitly; the cache flushing
+    primitives remove entries explicitly.
+    """
+    _attrs_ = ["classes_s", "versions", "selectors_w", "methods_w",
+               "hits", "misses"]
+    _immutable_fields_ = ["classes_s", "versions", "selectors_w", "methods_w"]
+
+    def __init__(self):
+        self.classes_s = [None] * METHOD_CACHE_SIZE
+        self.versions = [None] * METHOD_CACHE_SIZE
+        self.selectors_w = [None] * METHOD_CACHE_SIZE
+        self.methods_w = [None] * METHOD_CACHE_SIZE
+        self.hits = 0
+        self.misses = 0
+
+    def index(self, s_class, w_selector):
+        hash = compute_identity_hash(s_class) ^ compute_identity_hash(w_selector)
+        return hash & (METHOD_CACHE_SIZE - 1)
+
+    def lookup(self, s_class, w_selector):
+        index = self.index(s_class, w_selector)
+        if (self.classes_s[index] is s_class and
+                self.selectors_w[index] is w_selector and
+                self.versions[index] is s_class.version):
+            self.hits += 1
+            return self.methods_w[index]
+        self.misses += 1
+        version = s_class.version
+        w_method = s_class.lookup(w_selector)
+        self.classes_s[index] = s_class
+        self.versions[index] = version
+        self.selectors_w[index] = w_selector
+        self.methods_w[index] = w_method
+        return w_method
+
+    def clear_entry(self, index):
+        self.classes_s[index] = None
+        self.versions[index] = None
+        self.selectors_w[index] = None
+        self.methods_w[index] = None
+
+    def flush(self):
+        for i in range(METHOD_CACHE_SIZE):
+            self.clear_entry(i)
+
+    def flush_class(self, s_class):
+        for i in range(METHOD_CACHE_SIZE):
+            if self.classes_s[i] is s_class:
+                self.clear_entry(i)
+
+    def flush_selector(self, w_selector):
+        for i in range(METHOD_CACHE_SIZE):
+            if self.selectors_w[i] is w_selector:
+                self.clear_entry(i)
+
+    def flush_method(self, w_method):
+        for i in range(METHOD_CACHE_SIZE):
+            if self.methods_w[i] is w_method:
+                self.clear_entry(i)
+
+class SymbolTable(object):
+    """The Symbols of the image by their contents, so the VM can find the
+    Symbol for a string without scanning the heap or sending #asSymbol. It is
+    filled while loading the image and with the Symbols the VM interns later.
+    The entries are weak: a Symbol the image drops disappears from the table.
+    Primitives can still write into a Symbol, so lookup checks the contents
+    of the entry it finds.
+    """
+    _attrs_ = ["symbols_w", "w_Symbol"]
+
+    def __init__(self):
+        self.symbols_w = rweakref.RWeakValueDictionary(str, model.W_BytesObject)
+        self.w_Symbol = None
+
+    def is_symbol(self, space, w_object):
+        return (self.w_Symbol is not None and
+                isinstance(w_object, model.W_BytesObject) and
+                w_object.getclass(space).is_same_object(self.w_Symbol))
+
+    def add(self, space, w_symbol):
+        if self.is_symbol(space, w_symbol):
+            assert isinstance(w_symbol, model.W_BytesObject)
+            self.symbols_w.set(space.unwrap_string(w_symbol), w_symbol)
+
+    def lookup(self, space, string):
+        w_symbol = self.symbols_w.get(string)
+        if w_symbol is not None and space.unwrap_string(w_symbol) != string:
+            return None
+        return w_symbol
 
 class MethodDictionaryShadow(AbstractGenericShadow):
     _immutable_fields_ = ['s_class']
@@ -3,6 +3,7 @@ from spyvm import model, model_display, storage_contexts, constants, primitives,
 from spyvm.primitives import prim_table, PrimitiveFailedError
 from rpython.rlib.rfloat import isinf, isnan
 from rpython.rlib.rarithmetic import intmask, r_uint
+from rpython.rlib.rbigint import rbigint
 from rpython.rtyper.lltypesystem import lltype, rffi
 from .util import create_space, copy_to_module, cleanup_module, TestInterpreter, very_slow_test
 
@@ -127,7 +128,7 @@ def test_fileplugin_filewrite_words(monkeypatch):
     monkeypatch.setattr(os, "write", write)
 
     content = model.W_WordsObject(space, space.w_String, 1)
-    content.words = [rffi.r_uint(1633837924)]
+    content.setword(0, rffi.r_uint(1633837924))
     try:
         stack = [space.w(1), space.w(1), content, space.w(1), space.w(1)]
         w_c = external_call('FilePlugin', 'primitiveFileWrite', stack)
@@ -171,7 +172,7 @@ def test_fileplugin_filewrite_bitmap(monkeypatch):
     monkeypatch.setattr(os, "write", write)
 
     content = model_display.W_DisplayBitmap(space, space.w_Bitmap, 1, 32)
-    content._real_depth_buffer[0] = rffi.r_uint(1633837924)
+    content.setword(0, rffi.r_uint(1633837924))
     try:
         stack = [space.w(1), space.w(1), content, space.w(1), space.w(1)]
         w_c = external_call('FilePlugin', 'primitiveFileWrite', stack)
@@ -189,3 +190,105 @@ def test_fileplugin_dirdelete_raises(monkeypatch):
             w_c = external_call('FilePlugin', 'primitiveDirectoryDelete', stack)
     finally:
         monkeypatch.undo()
+
+def w_big(value):
+    return space.wrap_rbigint(rbigint.fromlong(value))
+
+def big(w_value):
+    return space.unwrap_rbigint(w_value).tolong()
+
+def test_largeintegers_compare():
+    w_a = w_big(2**70 + 3)
+    w_b = w_big(2**40)
+    assert external_call('LargeIntegers', 'primDigitCompare', [w_a, w_b]).value == 1
+    assert external_call('LargeIntegers', 'primDigitCompare', [w_b, w_a]).value == -1
+    w_c = external_call('LargeIntegers', 'primDigitCompareWith', [space.w_nil, w_a, w_big(2**70 + 3)])
+    assert w_c.value == 0
+
+def test_largeintegers_div_with_negative():
+    w_a = w_big(2**70 + 3)
+    w_b = w_big(2**40)
+    w_c = external_call('LargeIntegers', 'primDigitDivWithNegative',
+                        [space.w_nil, w_a, w_b, space.w_false])
+    assert big(w_c.at0(space, 0)) == 2**30
+    assert big(w_c.at0(space, 1)) == 3
+    with py.test.raises(PrimitiveFailedError):
+        external_call('LargeIntegers', 'primDigitDivNegative', [w_a, space.wrap_int(0), space.w_false])
+
+def test_largeintegers_any_bit():
+    w_a = w_big(2**70 + 3)
+    assert external_call('LargeIntegers', 'primAnyBitFromTo', [w_a, space.wrap_int(3), space.wrap_int(70)]) is space.w_false
+    assert external_call('LargeIntegers', 'primAnyBitFromTo', [w_a, space.wrap_int(3), space.wrap_int(71)]) is space.w_true
+
+def test_largeintegers_montgomery():
+    m = 2**89 - 1
+    inv = 1
+    for _ in range(5): # Newton iteration for 1/m mod 2**32
+        inv = inv * (2 - m * inv) % 2**32
+    m_inv = -inv % 2**32
+    a, b = 2**80 + 12345, 987654321
+    stack = [w_big(a), w_big(b), w_big(m), w_big(m_inv)]
+    result = big(external_call('LargeIntegers', 'primMontgomeryTimesModulo', stack))
+    assert 0 <= result < m
+    assert result * 2**96 % m == a * b % m
+    assert external_call('LargeIntegers', 'primMontgomeryDigitLength', [space.w_nil]).value == 32
+
+def test_array_copy_from_to():
+    w_array = space.wrap_list([space.wrap_int(i) for i in range(5)])
+    w_copy = external_call('ArrayPlugin', 'primitiveCopyFromTo',
+                           [w_array, space.wrap_int(2), space.wrap_int(4)])
+    assert [space.unwrap_int(w) for w in w_copy.fetch_all(space)] == [1, 2, 3]
+    assert w_copy.strategy is w_array.strategy
+    w_empty = external_call('ArrayPlugin', 'primitiveCopyFromTo',
+                            [w_array, space.wrap_int(3), space.wrap_int(2)])
+    assert w_empty.size() == 0
+    with py.test.raises(PrimitiveFailedError):
+        external_call('ArrayPlugin', 'primitiveCopyFromTo',
+                      [w_array, space.wrap_int(2), space.wrap_int(6)])
+
+def test_array_concat():
+    w_first = space.wrap_list([space.wrap_int(1)])
+    w_second = space.wrap_list([space.wrap_int(2), space.w_nil])
+    w_result = external_call('ArrayPlugin', 'primitiveConcat', [w_first, w_second])
+    assert space.unwrap_int(w_result.fetch(space, 1)) == 2
+    assert w_result.size() == 3
+    assert w_result.fetch(space, 2).is_nil(space)
+
+def timer_call(interp, method_name, stack):
+    w_description = model.W_PointersObject(space, space.classtable['w_Array'], 2)
+    w_description.atput0(space, 0, space.w('TimerPlugin'))
+    w_description.atput0(space, 1, space.w(method_name))
+    context = new_frame("<not called>", [w_description], stack[0], stack[1:])[0]
+    s_frame = context.as_context_get_shadow(space)
+    for w_object in stack:
+        s_frame.push(w_object)
+    prim_table[primitives.EXTERNAL_CALL](interp, s_frame, len(stack) - 1, s_frame.w_method())
+    return s_frame.pop()
+
+def test_timer_plugin():
+    interp = TestInterpreter(space)
+    sema = model.W_PointersObject(space, space.w_Semaphore, 3)
+    now = interp.time_now()
+    w_first = timer_call(interp, 'primitiveSignalAtMilliseconds',
+                         [space.w_nil, sema, space.wrap_int(now + 5000)])
+    w_second = timer_call(interp, 'primitiveSignalAfterMilliseconds',
+                          [space.w_nil, sema, space.wrap_int(1000)])
+    assert w_first.value != w_second.value
+    assert timer_call(interp, 'primitivePendingTimers', [space.w_nil]).value == 2
+    w_deadline = timer_call(interp, 'primitiveNextDeadline', [space.w_nil])
+    assert now + 1000 <= w_deadline.value < now + 5000
+    assert timer_call(interp, 'primitiveCancelTimer', [space.w_nil, w_second]) is space.w_true
+    assert timer_call(interp, 'primitiveCancelTimer', [space.w_nil, w_second]) is space.w_false
+    assert timer_call(interp, 'primitiveNextDeadline', [space.w_nil]).value == now + 5000
+    assert timer_call(interp, 'primitiveCancelTimer', [space.w_nil, w_first]) is space.w_true
+    assert timer_call(interp, 'primitiveNextDeadline', [space.w_nil]).is_nil(space)
+
+def test_timer_plugin_fails():
+    interp = TestInterpreter(space)
+    with py.test.raises(PrimitiveFailedError):
+        timer_call(interp, 'primitiveSignalAtMilliseconds',
+                   [space.w_nil, space.w_nil, space.wrap_int(0)])
+    sema = model.W_PointersObject(space, space.w_Semaphore, 3)
+    with py.test.raises(PrimitiveFailedError):
+        timer_call(interp, 'primitiveSignalAfterMilliseconds',
+                   [space.w_nil, sema, space.wrap_int(-1)])
@@ -27,8 +27,13 @@ def step_in_interp(ctxt): # due to missing resets in between tests
     interp._loop = False
     try:
         retval = interp.step(ctxt)
-        if retval is not None:
+        if isinstance(retval, storage_contexts.ContextPartShadow):
             return retval.w_self()
+        if retval is not None:
+            # A local return
+            new_context = ctxt.s_sender()
+            new_context.push(retval)
+            return new_context.w_self()
     except interpreter.Return, nlr:
         new_context = nlr.s_target_context
         if new_context is None:
@@ -454,6 +459,36 @@ def test_fibWithArgument():
     result = interp.interpret_toplevel(w_frame)
     assert space.unwrap_int(result) == 34
 
+def test_quicken():
+    from spyvm.interpreter_bytecodes import quicken, NO_SUPERINSTRUCTION, PUSH_PUSH_ARITHMETIC, PUSH_RETURN_TOP
+    bytes = (pushTemporaryVariableBytecode(0) + pushConstantOneBytecode + bytecodePrimAdd +
+             pushReceiverVariableBytecode(1) + returnTopFromMethodBytecode)
+    assert quicken(bytes) == [PUSH_PUSH_ARITHMETIC, NO_SUPERINSTRUCTION, NO_SUPERINSTRUCTION,
+                              PUSH_RETURN_TOP, NO_SUPERINSTRUCTION]
+
+def test_fibWithArgument_quickened():
+    from .util import TestInterpreter
+    from spyvm.interpreter_bytecodes import PUSH_PUSH_ARITHMETIC
+    quickening_interp = TestInterpreter(space, quicken=True)
+    bytecode = ''.join(map(chr, [ 16, 119, 178, 154, 118, 164, 11, 112, 16, 118, 177, 224, 112, 16, 119, 177, 224, 176, 124 ]))
+    shadow = bootstrap_class(0).as_class_get_shadow(space)
+    method = model.W_CompiledMethod(space, len(bytecode))
+    method.literalsize = 1
+    method.setbytes(bytecode)
+    method.argsize = 1
+    method._tempsize = 1
+    literals = fakeliterals(space, "fib:")
+    method.setliterals(literals)
+    shadow.installmethod(literals[0], method)
+    w_object = shadow.new()
+    w_frame, s_frame = new_frame(sendLiteralSelectorBytecode(16) + returnTopFromMethodBytecode)
+    s_frame.w_method().setliterals(literals)
+    s_frame.push(w_object)
+    s_frame.push(space.wrap_int(8))
+    result = quickening_interp.interpret_toplevel(w_frame)
+    assert space.unwrap_int(result) == 34
+    assert method.superinstructions()[0] == PUSH_PUSH_ARITHMETIC
+
 def test_send_to_primitive():
 
     def test():
@@ -472,6 +507,12 @@ def test_send_to_primitive():
           1, "-"]],
         test)
 
+def test_bytecode_dispatch_covers_all_bytecodes():
+    from spyvm.interpreter_bytecodes import BYTECODE_METHOD_NAMES, BYTECODE_TABLE
+    assert len(BYTECODE_METHOD_NAMES) == 256
+    for bytecode, methname in enumerate(BYTECODE_METHOD_NAMES):
+        assert getattr(storage_contexts.ContextPartShadow, methname) == BYTECODE_TABLE[bytecode]
+
 def test_makePoint():
     w_frame, s_frame = new_frame(pushConstantZeroBytecode +
                              pushConstantOneBytecode +
@@ -612,6 +653,20 @@ def test_bytecodePrimBool():
                                           space.w_true, space.w_false,
                                           space.w_false, space.w_true])
 
+def test_bytecodePrimFloat():
+    w_frame, s_frame = new_frame(bytecodePrimAdd + bytecodePrimLessThan + bytecodePrimDivide)
+    s_frame.push(space.wrap_float(1.5))
+    s_frame.push(space.wrap_float(2.0))
+    step_in_interp(s_frame)
+    assert s_frame.top().value == 3.5
+    s_frame.push(space.wrap_float(4.0))
+    step_in_interp(s_frame)
+    assert s_frame.pop() is space.w_true
+    s_frame.push(space.wrap_float(3.0))
+    s_frame.push(space.wrap_float(2.0))
+    step_in_interp(s_frame)
+    assert s_frame.top().value == 1.5
+
 def test_singleExtendedSendBytecode():
     w_class = bootstrap_class(0)
     w_object = w_class.as_class_get_shadow(space).new()
@@ -972,6 +1027,12 @@ def test_frame_not_dirty_if_inactive():
     assert s_frame.state is storage_contexts.ActiveContext
     assert s_other_frame.state is storage_contexts.InactiveContext
 
+def test_local_return_is_passed_as_value():
+    w_frame, s_frame = new_frame(pushConstantOneBytecode + returnTopFromMethodBytecode)
+    interp._loop = False
+    assert interp.step(s_frame) is None
+    assert interp.step(s_frame) is space.w_one
+
 def test_raise_NonVirtualReturn_on_dirty_frame():
     bytes = reduce(operator.add, map(chr, [0x84, 0xc0, 0x00])) + returnTopFromMethodBytecode
     w_frame, s_frame = new_frame(bytes)
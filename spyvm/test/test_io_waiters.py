@@ -0,0 +1,18 @@
+import os
+from spyvm.util.io_waiters import IOWaiters, READABLE
+
+def test_poll_pipe():
+    waiters = IOWaiters()
+    r, w = os.pipe()
+    try:
+        waiters.add(r, READABLE, "semaphore")
+        assert waiters.size() == 1
+        assert waiters.poll(0) == []
+        os.write(w, "x")
+        assert waiters.poll(1000) == [r]
+        assert waiters.remove(r) == "semaphore"
+        assert waiters.remove(r) is None
+        assert waiters.size() == 0
+    finally:
+        os.close(r)
+        os.close(w)
@@ -47,15 +47,23 @@ def test_read_all_header():
     assert next != 0 #expects object header, which must not be 0x00000000
 
 def _test_all_pointers_are_valid(reader):
-    for each in reader.chunks.itervalues():
+    for each in reader.chunklist:
         if each.format < 5:
-            for pointer in each.data:
+            for pointer in each.words():
                 if (pointer & 1) != 1:
-                    assert pointer in reader.chunks
+                    assert reader.has_chunk(pointer)
 
 def test_all_pointers_are_valid():
     _test_all_pointers_are_valid(reader)
 
+def test_chunk_table():
+    special = reader.chunk_at(reader.specialobjectspointer)
+    assert special.get_pointers() == reader.special_objects_w
+    assert not reader.has_chunk(reader.specialobjectspointer + 2)
+    assert not reader.has_chunk(reader.oldbaseaddress - 4)
+    assert not reader.has_chunk(reader.oldbaseaddress + reader.endofmemory)
+    py.test.raises(error.CorruptImageError, reader.chunk_at, reader.specialobjectspointer + 4)
+
 def test_there_are_31_compact_classes():
     assert len(reader.compactclasses) == 31
 
@@ -231,6 +239,28 @@ def test_create_new_symbol_new_with_arg0():
     assert isinstance(w_res, model.W_BytesObject)
     assert w_res.size() == 0
 
+def test_symbol_table():
+    # filled with the Symbols of the image while loading it
+    w_abs = space.symbol_table.lookup(space, "abs")
+    assert w_abs.unwrap_string(None) == "abs"
+    assert interp.intern_symbol("abs") is w_abs
+    assert perform(w("abs"), "asSymbol") is w_abs
+    assert image.find_symbol(space, "asSymbol") is image.w_asSymbol
+    assert image.find_symbol(space, "notASymbolInTheMiniImage") is space.w_nil
+
+    assert space.symbol_table.lookup(space, "aNewSymbolForTheTable") is None
+    w_symbol = interp.intern_symbol("aNewSymbolForTheTable")
+    assert w_symbol.unwrap_string(None) == "aNewSymbolForTheTable"
+    assert space.symbol_table.lookup(space, "aNewSymbolForTheTable") is w_symbol
+    assert perform(w("aNewSymbolForTheTable"), "asSymbol") is w_symbol
+    # Strings are not Symbols
+    space.symbol_table.add(space, w("notASymbolInTheMiniImage"))
+    assert space.symbol_table.lookup(space, "notASymbolInTheMiniImage") is None
+    # A Symbol whose contents were overwritten is not found under the old ones
+    w_symbol = interp.intern_symbol("aSymbolToOverwrite")
+    w_symbol.setchar(0, "b")
+    assert space.symbol_table.lookup(space, "aSymbolToOverwrite") is None
+
 def test_pi_as_w_float():
     w_result = perform(interp.space.w_Float, "pi")
     assert w_result is not None
@@ -309,6 +339,53 @@ def test_step_run_something():
     interp.step(s_ctx)
     assert s_ctx.top().value == 3
 
+def test_write_image(tmpdir):
+    from spyvm.squeakimage import ImageWriter
+    space, interp, image, reader = read_image('mini-running-something.image', cached=False)
+    w_symbol = interp.intern_symbol("aSymbolCreatedBeforeWriting")
+    symbol_hash = w_symbol.gethash()
+    filename = str(tmpdir.join("written.image"))
+    ImageWriter(space, image).write(filename)
+    space, interp, image, reader = read_image(filename, cached=False)
+    _test_all_pointers_are_valid(reader)
+    # New objects keep their identity hash, so the Symbol is found again.
+    w_symbol = interp.perform(space.wrap_string("aSymbolCreatedBeforeWriting"), "asSymbol")
+    assert w_symbol.gethash() == symbol_hash
+    assert interp.intern_symbol("aSymbolCreatedBeforeWriting") is w_symbol
+    assert len(reader.compactclasses) == 31
+    assert image.w_asSymbol.unwrap_string(None) == "asSymbol"
+    w_result = interp.perform(space.wrap_int(0), "runningADNU")
+    assert w_result.unwrap_string(None) == "foobarThis:doesNotExist:('pypy' 'heya' )"
+
+def test_snapshot_primitive(tmpdir):
+    from spyvm.constants import SYSTEM_ATTRIBUTE_IMAGE_NAME_INDEX
+    space, interp = runningSomethingImage(cached=False)
+    filename = str(tmpdir.join("snapshot.image"))
+    space.set_system_attribute(SYSTEM_ATTRIBUTE_IMAGE_NAME_INDEX, filename)
+    ap = wrapper.ProcessWrapper(space, wrapper.scheduler(space).active_process())
+    s_ctx = ap.suspended_context().as_context_get_shadow(space)
+    ap.store_suspended_context(space.w_nil)
+    s_ctx.pop()
+    s_ctx.push(space.w_nil)
+    depth = s_ctx.stackdepth()
+    primitives.prim_table[primitives.SNAPSHOT](interp, s_ctx, 0)
+    assert s_ctx.top() is space.w_false
+    assert s_ctx.stackdepth() == depth
+    assert ap.suspended_context().is_nil(space)
+
+    # The written image resumes after the snapshot, with true as its result.
+    space, interp, image, reader = read_image(filename, cached=False)
+    ap = wrapper.ProcessWrapper(space, wrapper.scheduler(space).active_process())
+    s_ctx = ap.suspended_context().as_context_get_shadow(space)
+    assert s_ctx.top().is_same_object(space.w_true)
+    interp.step(s_ctx)
+    interp.step(s_ctx)
+    assert s_ctx.top().value == 1
+    interp.step(s_ctx)
+    assert s_ctx.top().value == 2
+    interp.step(s_ctx)
+    assert s_ctx.top().value == 3
+
 def test_run_doesNotUnderstand():
     space, interp = runningSomethingImage()
     w_result = interp.perform(interp.space.wrap_int(0), "runningADNU")
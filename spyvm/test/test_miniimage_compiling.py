@@ -89,7 +89,7 @@ def test_compiling_large_positive_integer():
 
 def test_simulate_numericprim():
     sourcecode = """absentPrimitive: anInt with: anotherInt
-        <primitive: 97>
+        <primitive: 118>
         ^'numeric fallback for ', anInt asString, ' ', anotherInt asString"""
     perform(w(10).getclass(space), "compile:classified:notifying:", w(sourcecode), w('pypy'), w(None))
 
@@ -107,7 +107,7 @@ def test_simulate_numericprim():
 def test_simulate_numericprim_fallback():
     sourcecode = """absentPrimitive: anInt with: anotherInt
         |errorCode|
-        <primitive: 97> "error: errorCode> is not implemented in the mini.image yet"
+        <primitive: 118> "error: errorCode> is not implemented in the mini.image yet"
         ^'numeric fallback for ', anInt asString, ' ', anotherInt asString, ' because of ', errorCode asString"""
     perform(w(10).getclass(space), "compile:classified:notifying:", w(sourcecode), w('pypy'), w(None))
 
@@ -1,5 +1,5 @@
 import py, math, socket
-from spyvm import model, model_display, storage_classes, error, display
+from spyvm import model, model_display, storage_classes, error, display, wrapper
 from rpython.rlib.rarithmetic import intmask, r_uint
 from rpython.rtyper.lltypesystem import lltype, rffi
 from .util import create_space, copy_to_module, cleanup_module
@@ -67,6 +67,47 @@ def test_c_bytes_object():
     assert w_bytes.getchar(0) == "\x00"
     py.test.raises(IndexError, lambda: w_bytes.getchar(20))
 
+def test_bytes_object_bulk_operations():
+    w_class = bootstrap_class(0, format=storage_classes.BYTES)
+    w_bytes = w_class.as_class_get_shadow(space).new(8)
+    w_bytes.setslice(2, "abcd")
+    assert w_bytes.unwrap_string(space) == "\x00\x00abcd\x00\x00"
+    assert w_bytes.getslice(3, 5) == "bc"
+    w_bytes.copy_bytes_from(w_bytes, 3, 7, 2)
+    assert w_bytes.unwrap_string(space) == "\x00\x00aabcd\x00"
+    py.test.raises(IndexError, lambda: w_bytes.setslice(6, "abc"))
+    w_clone = w_bytes.clone(space)
+    w_clone.setchar(0, "x")
+    assert w_bytes.getchar(0) == "\x00"
+
+def test_c_bytes_object_shares_bytes():
+    w_class = bootstrap_class(0, format=storage_classes.BYTES)
+    w_bytes = w_class.as_class_get_shadow(space).new(4)
+    w_bytes.setslice(0, "abcd")
+    c_bytes = w_bytes.convert_to_c_layout()
+    assert c_bytes[1] == "b"
+    c_bytes[1] = "x"
+    assert w_bytes.getchar(1) == "x"
+
+def test_c_bytes_object_changed_after_plugin_call():
+    from spyvm.plugins.squeak_plugin_proxy import IProxy, firstIndexableField
+    from .util import TestInterpreter
+    w_class = bootstrap_class(0, format=storage_classes.BYTES)
+    w_bytes = w_class.as_class_get_shadow(space).new(4)
+    w_bytes.setslice(0, "abcd")
+    interp = TestInterpreter(space)
+    s_frame = space.make_frame("<not called>")[1]
+    IProxy.initialize_from_call(["Plugin", "primitive"], interp, s_frame, 0, None)
+    try:
+        c_bytes = rffi.cast(rffi.CCHARP, firstIndexableField(IProxy.object_to_oop(w_bytes)))
+        version = w_bytes.version
+        c_bytes[1] = "x"
+    finally:
+        IProxy.reset()
+    # the version of the bytes changes once the plugin returns
+    assert w_bytes.version is not version
+    assert w_bytes.unwrap_string(space) == "axcd"
+
 def test_word_object():
     w_class = bootstrap_class(0, format=storage_classes.WORDS)
     w_bytes = w_class.as_class_get_shadow(space).new(20)
@@ -155,6 +196,8 @@ def test_hashes():
     h2 = w_inst.gethash()
     assert h1 == h2
     assert h1 == w_inst.hash
+    # fits into the 12 hash bits of an object header
+    assert 0 <= h1 <= 0xfff
 
 def test_compiledmethod_at0():
     w_method = model.W_CompiledMethod(space, )
@@ -380,6 +423,31 @@ def test_WordsObject_short_atput():
     assert target.getword(0) == 0xffff0100
     assert target.getword(1) == 0x7fff8000
 
+def test_WordsObject_bulk_operations():
+    target = model.W_WordsObject(space, None, 4)
+    target.fill(r_uint(0x61626364))
+    assert target.unwrap_string(space) == "dcba" * 4
+    source = model.W_WordsObject(space, None, 2)
+    source.setword(0, r_uint(1))
+    source.setword(1, r_uint(2))
+    target.copy_words_from(source, 1, 3, 0)
+    assert target.getwords() == [0x61626364, 1, 2, 0x61626364]
+    target.copy_words_from(target, 0, 3, 1)
+    assert target.getwords() == [1, 2, 0x61626364, 0x61626364]
+    py.test.raises(IndexError, lambda: target.copy_words_from(source, 3, 5, 0))
+    w_clone = target.clone(space)
+    w_clone.setword(0, r_uint(7))
+    assert target.getword(0) == 1
+
+def test_display_bitmap_shares_words():
+    w_bits = model.W_WordsObject(space, space.w_Array, 4)
+    w_bits.setword(2, r_uint(42))
+    w_form = space.wrap_list([w_bits, space.wrap_int(4), space.wrap_int(1), space.wrap_int(32)])
+    w_bitmap = model_display.from_words_object(w_bits, wrapper.FormWrapper(space, w_form))
+    assert w_bitmap.getword(2) == 42
+    w_bitmap.setword(3, r_uint(43))
+    assert w_bits.getword(3) == 43
+
 def test_display_bitmap():
     size = 10
     space.display().set_video_mode(32, size, 1)
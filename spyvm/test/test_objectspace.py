@@ -1,6 +1,6 @@
 import py, sys
 from spyvm import objspace, model, error
-from rpython.rlib.rarithmetic import r_uint
+from rpython.rlib.rarithmetic import r_uint, r_ulonglong
 from .util import create_space, copy_to_module, cleanup_module
 
 def setup_module():
@@ -58,6 +58,15 @@ def test_ruint():
     # should not raise. see docstring.
 
 
+def test_wrap_positive_64bit_int():
+    for num in [0, 1, 2**31, 2**32 - 1, 2**32, 2**62 + 5]:
+        w_num = space.wrap_positive_64bit_int(r_ulonglong(num))
+        assert space.unwrap_longlong(w_num) == num
+    w_num = space.wrap_positive_64bit_int(r_ulonglong(2**40 + 1))
+    assert isinstance(w_num, model.W_BytesObject)
+    assert w_num.getclass(space) is space.w_LargePositiveInteger
+    assert w_num.size() == 6
+
 def test_wrap_int():
     for num in [-10, 1, 15, 0x3fffffff]:
         assert space.wrap_int(num).value == num
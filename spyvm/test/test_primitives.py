@@ -1,8 +1,9 @@
-import py, os, math, time
+import py, os, sys, math, time
 from spyvm import model, model_display, storage_contexts, constants, primitives, wrapper, display
 from spyvm.primitives import prim_table, PrimitiveFailedError
 from rpython.rlib.rfloat import isinf, isnan
 from rpython.rlib.rarithmetic import intmask, r_uint
+from rpython.rlib.rbigint import rbigint
 from rpython.rtyper.lltypesystem import lltype, rffi
 from .util import create_space, copy_to_module, cleanup_module, TestInterpreter
 
@@ -184,6 +185,62 @@ def test_small_int_bit_shift_fail():
     assert isinstance(w_result, model.W_LargePositiveInteger1Word)
     assert w_result.value == intmask(4 << 29)
 
+def w_big(value):
+    return space.wrap_rbigint(rbigint.fromlong(value))
+
+def big(w_value):
+    return space.unwrap_rbigint(w_value).tolong()
+
+def test_large_integer_bytes():
+    w_a = w_big(2**70 + 3)
+    assert isinstance(w_a, model.W_LargeInteger)
+    assert w_a.getclass(space) is space.w_LargePositiveInteger
+    assert w_a.size() == 9
+    assert w_a.at0(space, 0).value == 3
+    assert w_a.at0(space, 8).value == 0x40
+    w_a.atput0(space, 1, space.wrap_int(1))
+    assert big(w_a) == 2**70 + 2**8 + 3
+    assert big(space.wrap_long(2**40 + 1)) == 2**40 + 1
+
+def test_large_integer_byte_writes():
+    w_a = w_big(2**70 + 3)
+    for i in range(w_a.size()):
+        w_a.atput0(space, i, space.wrap_int(i + 1))
+    assert w_a.at0(space, 2).value == 3
+    assert big(w_a) == sum([(i + 1) << (8 * i) for i in range(9)])
+    w_a.atput0(space, 0, space.wrap_int(0))
+    assert big(w_a) == sum([(i + 1) << (8 * i) for i in range(1, 9)])
+
+def test_large_integer_replace_and_fill():
+    w_a = w_big(2**70 + 3)
+    w_str = space.wrap_string("\x01\x02")
+    assert prim(primitives.STRING_REPLACE, [w_a, 1, 2, w_str, 1]) is w_a
+    assert big(w_a) == 2**70 + 0x0201
+    prim(primitives.STRING_REPLACE, [w_str, 1, 2, w_big(2**70 + 0x0403), 1])
+    assert w_str.unwrap_string(space) == "\x03\x04"
+    prim(primitives.FILL, [w_a, 1])
+    assert big(w_a) == sum([1 << (8 * i) for i in range(9)])
+
+def test_large_integer_arithmetic():
+    w_a = w_big(2**70 + 3)
+    w_b = w_big(2**40)
+    assert big(prim(primitives.LARGE_ADD, [w_a, w_b])) == 2**70 + 2**40 + 3
+    assert big(prim(primitives.LARGE_SUBTRACT, [w_a, w_b])) == 2**70 - 2**40 + 3
+    # the bootstrapped space has no LargeNegativeInteger class
+    prim_fails(primitives.LARGE_SUBTRACT, [w_b, w_a])
+    assert big(prim(primitives.LARGE_MULTIPLY, [w_a, w_b])) == (2**70 + 3) * 2**40
+    assert prim(primitives.LARGE_DIV, [w_a, w_b]).value == 2**30
+    assert prim(primitives.LARGE_MOD, [w_a, w_b]).value == 3
+    assert prim(primitives.LARGE_BIT_SHIFT, [w_b, -40]).value == 1
+    assert big(prim(primitives.LARGE_BIT_SHIFT, [w_b, 40])) == 2**80
+    assert prim(primitives.LARGE_BIT_SHIFT, [w_b, -sys.maxint - 1]).value == 0
+    prim_fails(primitives.LARGE_BIT_SHIFT, [w_b, sys.maxint])
+    assert prim(primitives.LARGE_LESSTHAN, [w_b, w_a]) is space.w_true
+    assert prim(primitives.LARGE_EQUAL, [w_a, w_big(2**70 + 3)]) is space.w_true
+    assert big(prim(primitives.LARGE_BIT_AND, [w_a, w_big(2**70 + 2)])) == 2**70 + 2
+    prim_fails(primitives.LARGE_DIVIDE, [w_a, w_b])
+    prim_fails(primitives.LARGE_DIV, [w_a, 0])
+
 def test_smallint_as_float():
     assert prim(primitives.SMALLINT_AS_FLOAT, [12]).value == 12.0
 
@@ -285,6 +342,56 @@ def test_string_at_put():
     for i in range(1,len(exp)+1):
         assert prim(primitives.STRING_AT, [test_str, i]) == wrap(exp[i-1])
 
+def test_string_replace():
+    w_str = wrap("foobar")
+    assert prim(primitives.STRING_REPLACE, [w_str, 2, 4, wrap("xyzw"), 2]) is w_str
+    assert w_str.unwrap_string(space) == "fyzwar"
+    # overlapping ranges in both directions
+    prim(primitives.STRING_REPLACE, [w_str, 2, 6, w_str, 1])
+    assert w_str.unwrap_string(space) == "ffyzwa"
+    prim(primitives.STRING_REPLACE, [w_str, 1, 5, w_str, 2])
+    assert w_str.unwrap_string(space) == "fyzwaa"
+    # empty range
+    prim(primitives.STRING_REPLACE, [w_str, 3, 2, wrap("xy"), 1])
+    assert w_str.unwrap_string(space) == "fyzwaa"
+    prim_fails(primitives.STRING_REPLACE, [w_str, 5, 7, wrap("xyz"), 1])
+    prim_fails(primitives.STRING_REPLACE, [w_str, 1, 3, wrap("xy"), 1])
+    prim_fails(primitives.STRING_REPLACE, [w_str, 1, 1, wrap([wrap(1)]), 1])
+
+def test_string_replace_words():
+    w_words = model.W_WordsObject(space, space.w_Array, 3)
+    w_source = model.W_WordsObject(space, space.w_Array, 2)
+    w_source.setword(0, r_uint(7))
+    w_source.setword(1, r_uint(0xffffffff))
+    prim(primitives.STRING_REPLACE, [w_words, 2, 3, w_source, 1])
+    assert w_words.getwords() == [0, 7, 0xffffffff]
+
+def test_string_replace_keeps_storage_strategy():
+    from spyvm.storage import SmallIntegerOrNilStrategy
+    w_array = wrap([wrap(i) for i in [1, 2, 3, 4]])
+    w_source = wrap([wrap(5), wrap(6)])
+    assert isinstance(w_array.strategy, SmallIntegerOrNilStrategy)
+    assert isinstance(w_source.strategy, SmallIntegerOrNilStrategy)
+    prim(primitives.STRING_REPLACE, [w_array, 2, 3, w_source, 1])
+    assert isinstance(w_array.strategy, SmallIntegerOrNilStrategy)
+    assert [space.unwrap_int(w) for w in w_array.fetch_all(space)] == [1, 5, 6, 4]
+    prim(primitives.STRING_REPLACE, [w_array, 1, 1, wrap([space.w_true]), 1])
+    assert w_array.fetch(space, 0) is space.w_true
+    assert space.unwrap_int(w_array.fetch(space, 1)) == 5
+
+def test_fill():
+    from spyvm.storage import SmallIntegerOrNilStrategy
+    w_bytes = wrap("abc")
+    prim(primitives.FILL, [w_bytes, ord("x")])
+    assert w_bytes.unwrap_string(space) == "xxx"
+    prim_fails(primitives.FILL, [w_bytes, 256])
+    w_array = wrap([wrap(1), space.w_nil, wrap(3)])
+    prim(primitives.FILL, [w_array, 7])
+    assert isinstance(w_array.strategy, SmallIntegerOrNilStrategy)
+    assert [space.unwrap_int(w) for w in w_array.fetch_all(space)] == [7, 7, 7]
+    prim(primitives.FILL, [w_array, space.w_nil])
+    assert w_array.fetch(space, 1).is_nil(space)
+
 def test_new():
     w_Object = space.classtable['w_Object']
     w_res = prim(primitives.NEW, [w_Object])
@@ -432,12 +539,80 @@ def test_primitive_milliseconds_clock():
     stop = prim(primitives.MILLISECOND_CLOCK, [0]).value
     assert start + 250 <= stop
 
+def test_microsecond_clocks():
+    now = (int(time.time()) + (69 * 365 + 17) * 24 * 3600) * 1000000
+    w_utc = prim(primitives.UTC_MICROSECOND_CLOCK, [0])
+    assert abs(space.unwrap_longlong(w_utc) - now) < 5 * 1000000
+    w_local = prim(primitives.LOCAL_MICROSECOND_CLOCK, [0])
+    assert abs(space.unwrap_longlong(w_local) - now) < 15 * 3600 * 1000000
+
 def test_signal_at_milliseconds():
     future = prim(primitives.MILLISECOND_CLOCK, [0]).value + 400
     sema = space.w_Semaphore.as_class_get_shadow(space).new()
     prim(primitives.SIGNAL_AT_MILLISECONDS, [space.w_nil, sema, future])
     assert space.objtable["w_timerSemaphore"] is sema
 
+def test_signal_at_milliseconds_replaces_timer():
+    sema = space.w_Semaphore.as_class_get_shadow(space).new()
+    interp, w_frame, argument_count = mock(space, [space.w_nil, sema, 1000])
+    s_frame = w_frame.as_context_get_shadow(space)
+    interp.signal_at(sema, 500)
+    prim_table[primitives.SIGNAL_AT_MILLISECONDS](interp, s_frame, 2)
+    assert interp.timers.size() == 2
+    s_frame.push_all([space.w_nil, sema, space.wrap_int(2000)])
+    prim_table[primitives.SIGNAL_AT_MILLISECONDS](interp, s_frame, 2)
+    assert interp.timers.size() == 2
+    s_frame.push_all([space.w_nil, space.w_nil, space.wrap_int(0)])
+    prim_table[primitives.SIGNAL_AT_MILLISECONDS](interp, s_frame, 2)
+    assert interp.timers.size() == 1
+    assert interp.timers.next_deadline() == 500
+
+def test_vm_parameter_interrupt_checks_every_ms():
+    interp, w_frame, argument_count = mock(space, [0, 26])
+    s_frame = w_frame.as_context_get_shadow(space)
+    prim_table[primitives.VM_PARAMETERS](interp, s_frame, 1)
+    assert s_frame.pop().value == constants.INTERRUPT_CHECKS_EVERY_MS
+
+    interp, w_frame, argument_count = mock(space, [0, 26, 20])
+    s_frame = w_frame.as_context_get_shadow(space)
+    prim_table[primitives.VM_PARAMETERS](interp, s_frame, 2)
+    assert s_frame.pop().value == constants.INTERRUPT_CHECKS_EVERY_MS
+    assert interp.interrupt_checks_every_ms == 20
+
+def test_adapt_interrupt_counter_size():
+    interp = TestInterpreter(space)
+    interp.interrupt_counter_size = 1000
+    interp.interrupt_checks_every_ms = 10
+    interp.last_interrupt_check = 100
+    interp.adapt_interrupt_counter_size(102) # too early
+    assert interp.interrupt_counter_size > 1000
+    interp.interrupt_counter_size = 1000
+    interp.adapt_interrupt_counter_size(150) # too late
+    assert interp.interrupt_counter_size < 1000
+    interp.interrupt_counter_size = 1000
+    interp.interrupt_checks_every_ms = 0 # disabled
+    interp.adapt_interrupt_counter_size(102)
+    assert interp.interrupt_counter_size == 1000
+
+def test_idle_wakes_up_on_io():
+    from spyvm.util.io_waiters import READABLE
+    # the bootstrapped Semaphore class has no instance variables
+    sema = model.W_PointersObject(space, space.w_Semaphore, 3)
+    wrapper.SemaphoreWrapper(space, sema).store_excess_signals(0)
+    interp, w_frame, argument_count = mock(space, [space.w_nil, 10 * 1000000])
+    r, w = os.pipe()
+    try:
+        interp.io_waiters.add(r, READABLE, sema)
+        os.write(w, "x")
+        start = time.time()
+        prim_table[primitives.IDLE_FOR_MICROSECONDS](interp, w_frame.as_context_get_shadow(space), 1)
+        assert time.time() - start < 5
+        assert wrapper.SemaphoreWrapper(space, sema).excess_signals() == 1
+        assert interp.io_waiters.size() == 0
+    finally:
+        os.close(r)
+        os.close(w)
+
 def test_inc_gc():
     # Should not fail :-)
     prim(primitives.INC_GC, [42]) # Dummy arg
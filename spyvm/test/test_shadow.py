@@ -271,6 +271,49 @@ def test_updating_class_changes_subclasses():
     assert s_class.version is not version
     assert s_class.version is w_parent.as_class_get_shadow(space).version
 
+def test_inline_cache_invalidated_by_superclass_change():
+    foo = model.W_CompiledMethod(space, 0)
+    w_parent = build_smalltalk_class("Demo", 0x90, methods={'foo': foo})
+    w_class = build_smalltalk_class("Demo", 0x90, w_superclass=w_parent)
+    s_parent = w_parent.as_class_get_shadow(space)
+    s_class = w_class.as_class_get_shadow(space)
+    s_parent.s_methoddict().sync_method_cache()
+    key = s_parent.s_methoddict().methoddict.keys()[0]
+
+    w_caller = model.W_CompiledMethod(space, 1)
+    cache = w_caller.inline_cache_at(1, key)
+    assert w_caller.inline_cache_at(1, key) is cache
+    assert cache.lookup(key, s_class, space.method_cache) is foo
+    assert cache.lookup(key, s_class, space.method_cache) is foo
+    assert cache.lookup(key, s_parent, space.method_cache) is foo
+    assert (cache.hits, cache.misses) == (1, 2)
+
+    new_foo = model.W_CompiledMethod(space, 0)
+    s_parent.installmethod(key, new_foo)
+    assert cache.lookup(key, s_class, space.method_cache) is new_foo
+    assert cache.lookup(key, s_parent, space.method_cache) is new_foo
+    assert (cache.hits, cache.misses) == (1, 4)
+
+def test_method_cache():
+    foo = model.W_CompiledMethod(space, 0)
+    w_class = build_smalltalk_class("Demo", 0x90, methods={'foo': foo})
+    s_class = w_class.as_class_get_shadow(space)
+    s_class.s_methoddict().sync_method_cache()
+    key = s_class.s_methoddict().methoddict.keys()[0]
+    method_cache = storage_classes.MethodCache()
+    assert method_cache.lookup(s_class, key) is foo
+    assert method_cache.lookup(s_class, key) is foo
+    assert (method_cache.hits, method_cache.misses) == (1, 1)
+    method_cache.flush_selector(key)
+    assert method_cache.lookup(s_class, key) is foo
+    assert method_cache.misses == 2
+    method_cache.flush_method(foo)
+    assert method_cache.lookup(s_class, key) is foo
+    assert method_cache.misses == 3
+    s_class.changed()
+    assert method_cache.lookup(s_class, key) is foo
+    assert (method_cache.hits, method_cache.misses) == (1, 4)
+
 def test_returned_contexts_pc():
     w_context = methodcontext()
     s_context = w_context.as_context_get_shadow(space)
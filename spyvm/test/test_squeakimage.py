@@ -89,6 +89,45 @@ def test_stream_count():
     assert stream.count == 8
     
    
+def test_stream_mapped_file(tmpdir, monkeypatch):
+    from spyvm.util import stream as stream_module
+    monkeypatch.setattr(stream_module, "we_are_translated", lambda: True)
+    f = tmpdir.join("test.image")
+    f.write(SIMPLE_VERSION_HEADER + '\x66\x19\x00\x00', mode="wb")
+    stream = squeakimage.Stream(filename=str(f))
+    assert stream.mmap is not None
+    assert stream.length() == 8
+    assert stream.next() == 6502
+    stream.big_endian = False
+    assert stream.peek() == 6502
+    assert stream.getslice(4, 6) == '\x66\x19'
+    stream.close()
+    assert stream.mmap is None
+
+def test_reader_close(tmpdir, monkeypatch):
+    from spyvm.util import stream as stream_module
+    monkeypatch.setattr(stream_module, "we_are_translated", lambda: True)
+    f = tmpdir.join("test.image")
+    header = ints2str(joinbits([3, 2, 2, 2, 0], [2, 6, 4, 5, 12]))
+    f.write(SIMPLE_VERSION_HEADER + header + SIMPLE_VERSION_HEADER, mode="wb")
+    r = squeakimage.ImageReader(space, squeakimage.Stream(filename=str(f)))
+    r.read_version()
+    chunk, _ = r.read_object()
+    r.chunklist.append(chunk)
+    assert chunk.words() == [6502]
+    r.close()
+    assert chunk.reader is None
+    assert r.stream.mmap is None
+
+def test_stream_empty_file(tmpdir, monkeypatch):
+    from spyvm.util import stream as stream_module
+    monkeypatch.setattr(stream_module, "we_are_translated", lambda: True)
+    f = tmpdir.join("empty.image")
+    f.write("", mode="wb")
+    stream = squeakimage.Stream(filename=str(f))
+    assert stream.mmap is None
+    assert stream.length() == 0
+
 def test_simple_joinbits():
     assert 0x01010101 == joinbits(([1] * 4), [8,8,8,8])
     assert 0xFfFfFfFf == joinbits([255] * 4, [8,8,8,8])
@@ -145,9 +184,9 @@ def test_read3wordheaderobject():
     l = len(SIMPLE_VERSION_HEADER)
     chunk, pos = r.read_object()
     chunk0 = squeakimage.ImageChunk(space, size, 2, 4200, 4)
-    chunk0.data = [6502] * (size - 1)
     assert pos == 8 + l
     assert chunk0 == chunk
+    assert chunk.words() == [6502] * (size - 1)
     
 def test_simple_image():
     word_size = 4
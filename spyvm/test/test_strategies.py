@@ -3,7 +3,7 @@ from spyvm import model, storage
 from .util import create_space_interp, copy_to_module, cleanup_module
 
 def setup_module():
-    space, interp = create_space_interp()
+    space, interp = create_space_interp(bootstrap = True)
     class_Array = space.classtable["w_Array"]
     w_nil = space.w_nil
     copy_to_module(locals(), __name__)
@@ -47,13 +47,17 @@ def check_arr(arr, expected):
 
 def test_ordered_strategies():
     strategies = space.strategy_factory.strategies
-    assert len(strategies) == 5
+    assert len(strategies) == 7
     index_nil = strategies.index(storage.AllNilStrategy)
     index_float = strategies.index(storage.FloatOrNilStrategy)
     index_int = strategies.index(storage.SmallIntegerOrNilStrategy)
+    index_char = strategies.index(storage.CharacterOrNilStrategy)
+    index_bool = strategies.index(storage.BooleanOrNilStrategy)
     index_list = strategies.index(storage.ListStrategy)
     assert index_nil < index_float < index_list
     assert index_nil < index_int < index_list
+    assert index_nil < index_char < index_list
+    assert index_nil < index_bool < index_list
 
 def test_optimized_strategy_switch(monkeypatch):
     a = arr(5)
@@ -198,3 +202,200 @@ def test_Float_store_SmallInt_to_List():
     a.store(space, 1, space.wrap_int(2))
     assert isinstance(a.strategy, storage.ListStrategy)
     check_arr(a, [1.2, 2, w_nil, w_nil, w_nil])
+
+# ====== CharacterOrNil Strategy
+
+def test_AllNil_to_Character():
+    a = arr(5)
+    a.store(space, 1, space.wrap_char("a"))
+    assert isinstance(a.strategy, storage.CharacterOrNilStrategy)
+    a.store(space, 2, space.wrap_char("\xff"))
+    assert a.fetch(space, 1) is space.wrap_char("a")
+    assert a.fetch(space, 2) is space.wrap_char("\xff")
+    assert a.fetch(space, 0).is_nil(space)
+
+def test_Character_not_from_table_to_List():
+    a = arr(5)
+    a.store(space, 1, space.wrap_char("a"))
+    w_char = model.W_PointersObject(space, space.w_Character, 1)
+    w_char.store(space, 0, space.wrap_int(ord("a")))
+    a.store(space, 2, w_char)
+    assert isinstance(a.strategy, storage.ListStrategy)
+    assert a.fetch(space, 1) is space.wrap_char("a")
+    assert a.fetch(space, 2) is w_char
+
+def test_character_table_is_not_specialized():
+    assert not isinstance(space.w_charactertable.strategy, storage.CharacterOrNilStrategy)
+
+# ====== BooleanOrNil Strategy
+
+def test_AllNil_to_Boolean():
+    a = arr(9)
+    a.store(space, 0, space.w_true)
+    assert isinstance(a.strategy, storage.BooleanOrNilStrategy)
+    a.store(space, 5, space.w_false)
+    a.store(space, 8, space.w_true)
+    a.store(space, 0, w_nil)
+    for i in range(9):
+        expected = {5: space.w_false, 8: space.w_true}.get(i, w_nil)
+        assert a.fetch(space, i) is expected
+    assert a.size() == 9
+
+def test_Boolean_to_List():
+    a = arr(5)
+    a.store(space, 3, space.w_false)
+    a.store(space, 1, space.wrap_int(1))
+    assert isinstance(a.strategy, storage.ListStrategy)
+    assert a.fetch(space, 3) is space.w_false
+    assert space.unwrap_int(a.fetch(space, 1)) == 1
+
+# ====== FieldShape Strategy
+
+def point_class():
+    return space.bootstrap_class(2, name="PointLike")
+
+def test_fixed_size_instances_share_shape():
+    w_class = point_class()
+    a = w_class.as_class_get_shadow(space).new()
+    b = w_class.as_class_get_shadow(space).new()
+    assert isinstance(a.strategy, storage.FieldShapeStrategy)
+    assert a.strategy is b.strategy
+    assert a.size() == 2
+    assert a.fetch(space, 0).is_nil(space)
+
+def test_variable_instances_have_no_shape():
+    w_class = space.bootstrap_class(2, name="VarLike", varsized=True)
+    a = w_class.as_class_get_shadow(space).new(3)
+    assert isinstance(a.strategy, storage.AllNilStrategy)
+
+def test_shape_unboxes_slots():
+    w_class = point_class()
+    a = w_class.as_class_get_shadow(space).new()
+    a.store(space, 0, space.wrap_int(3))
+    a.store(space, 1, space.wrap_float(4.5))
+    shape = a.strategy
+    assert shape.kinds == [storage.FIELD_INT, storage.FIELD_FLOAT]
+    assert a.strategy.get_storage(a).ints == [3]
+    check_arr(a, [3, 4.5])
+    b = w_class.as_class_get_shadow(space).new()
+    assert b.strategy is shape
+    b.store(space, 0, space.wrap_int(7))
+    b.store(space, 0, w_nil)
+    assert b.strategy is shape
+    check_arr(b, [w_nil, w_nil])
+
+def test_shape_generalizes_and_migrates():
+    w_class = point_class()
+    s_class = w_class.as_class_get_shadow(space)
+    a = s_class.new()
+    b = s_class.new()
+    a.store(space, 0, space.wrap_int(3))
+    b.store(space, 0, space.wrap_int(5))
+    old_shape = a.strategy
+    w_obj = arr(1)
+    a.store(space, 0, w_obj)
+    assert a.strategy is not old_shape
+    assert a.strategy.kinds[0] == storage.FIELD_OBJECT
+    assert old_shape.successor is a.strategy
+    assert s_class.new().strategy is a.strategy
+    assert a.fetch(space, 0) is w_obj
+    # b still has the old shape until its next access
+    assert b.strategy is old_shape
+    check_arr(b, [5, w_nil])
+    assert b.strategy is a.strategy
+
+def test_shape_to_shadow():
+    w_class = point_class()
+    a = w_class.as_class_get_shadow(space).new()
+    a.store(space, 0, space.wrap_int(3))
+    a.store(space, 1, space.wrap_int(4))
+    space.strategy_factory.switch_strategy(a, storage.ListStrategy)
+    check_arr(a, [3, 4])
+
+def test_deprecated_shape_to_other_strategy():
+    w_class = point_class()
+    s_class = w_class.as_class_get_shadow(space)
+    for strategy_type in [storage.ListStrategy, storage.WeakListStrategy]:
+        a = s_class.new()
+        b = s_class.new()
+        a.store(space, 0, space.wrap_int(3))
+        b.store(space, 0, space.wrap_int(5))
+        b.store(space, 1, space.wrap_float(1.5))
+        old_shape = b.strategy
+        a.store(space, 0, arr(1))
+        assert old_shape.successor is not None
+        assert b.strategy is old_shape
+        space.strategy_factory.switch_strategy(b, strategy_type)
+        assert isinstance(b.strategy, strategy_type)
+        check_arr(b, [5, 1.5])
+
+# ====== Strategy profiler
+
+def test_profiler_records_switches():
+    import json
+    from spyvm.util.strategy_profiler import StrategyProfiler
+    factory = space.strategy_factory
+    profiler = factory.profiler
+    factory.profiler = StrategyProfiler()
+    factory.profiler.activate("unused")
+    try:
+        w_frame, s_frame = space.make_frame("\x70\x7c")
+        a = arr(5)
+        factory.profiler.record_allocation(a, s_frame)
+        a.store(space, 0, space.wrap_int(1))
+        a.store(space, 1, arr(1))
+        arr(3).store(space, 0, space.wrap_int(2))
+        profile = json.loads(factory.profiler.to_json())
+    finally:
+        factory.profiler = profiler
+    transitions = profile["transitions"]
+    assert transitions[0]["count"] == 2
+    assert transitions[0]["from"] == "AllNilStrategy"
+    assert transitions[0]["to"] == "SmallIntegerOrNilStrategy"
+    assert transitions[0]["element"] == "SmallInteger"
+    assert transitions[0]["elements_copied"] == 8
+    assert len(transitions[0]["sites"]) == 2
+    assert transitions[1]["to"] == "ListStrategy"
+    assert transitions[1]["sites"].keys()[0].endswith("@ pc %d" % s_frame.pc())
+
+# ====== Bulk operations
+
+def test_copy_slice_keeps_strategy():
+    a = int_arr(5)
+    a.store(space, 3, space.wrap_int(4))
+    b = a.copy_slice(space, 1, 4)
+    assert isinstance(b.strategy, storage.SmallIntegerOrNilStrategy)
+    assert b.getclass(space) is class_Array
+    check_arr(b, [w_nil, w_nil, 4])
+    b.store(space, 0, space.wrap_int(7))
+    check_arr(a, [12, w_nil, w_nil, 4, w_nil])
+
+def test_clone_keeps_strategy():
+    a = float_arr(3)
+    b = a.clone(space)
+    assert isinstance(b.strategy, storage.FloatOrNilStrategy)
+    check_arr(b, [1.2, w_nil, w_nil])
+
+def test_fill_keeps_strategy():
+    a = int_arr(5)
+    a.fill(space, 1, 4, space.wrap_int(3))
+    assert isinstance(a.strategy, storage.SmallIntegerOrNilStrategy)
+    check_arr(a, [12, 3, 3, 3, w_nil])
+
+def test_fill_generalizes():
+    a = arr(4)
+    a.fill(space, 0, 4, space.wrap_float(2.5))
+    assert isinstance(a.strategy, storage.FloatOrNilStrategy)
+    a.fill(space, 2, 4, space.wrap_int(1))
+    assert isinstance(a.strategy, storage.ListStrategy)
+    check_arr(a, [2.5, 2.5, 1, 1])
+
+def test_concat():
+    a = int_arr(2)
+    b = int_arr(3)
+    c = a.concat(space, b)
+    assert isinstance(c.strategy, storage.SmallIntegerOrNilStrategy)
+    check_arr(c, [12, w_nil, 12, w_nil, w_nil])
+    d = a.concat(space, float_arr(1))
+    assert isinstance(d.strategy, storage.ListStrategy)
+    check_arr(d, [12, w_nil, 1.2])
@@ -0,0 +1,40 @@
+import random
+from spyvm.util.timer_heap import TimerHeap
+
+def test_pop_in_deadline_order():
+    heap = TimerHeap()
+    deadlines = range(100)
+    random.shuffle(deadlines)
+    for deadline in deadlines:
+        heap.add(deadline, "item%d" % deadline)
+    assert heap.size() == 100
+    assert not heap.has_expired(-1)
+    for i in range(100):
+        assert heap.next_deadline() == i
+        assert heap.has_expired(i)
+        assert heap.pop() == "item%d" % i
+    assert heap.size() == 0
+    assert not heap.has_expired(1000)
+
+def test_cancel():
+    heap = TimerHeap()
+    ids = [heap.add(deadline, deadline) for deadline in [5, 3, 8, 1, 9]]
+    assert len(set(ids)) == 5
+    assert heap.cancel(ids[3])
+    assert not heap.cancel(ids[3])
+    assert heap.cancel(ids[2])
+    assert [heap.pop() for _ in range(heap.size())] == [3, 5, 9]
+
+def test_cancel_many():
+    heap = TimerHeap()
+    deadlines = range(1000)
+    random.shuffle(deadlines)
+    ids = {}
+    for deadline in deadlines:
+        ids[deadline] = heap.add(deadline, deadline)
+    for deadline in range(1000):
+        if deadline % 3 != 0:
+            assert heap.cancel(ids[deadline])
+    assert heap.size() == 334
+    assert [heap.pop() for _ in range(heap.size())] == range(0, 1000, 3)
+    assert not heap.cancel(ids[0])
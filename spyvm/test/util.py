@@ -318,7 +318,7 @@ class BootstrappedObjSpace(objspace.ObjSpace):
         import struct
         bytes = struct.pack('L', any)
         w_b = model.W_BytesObject(self, self.w_LargePositiveInteger, len(bytes))
-        w_b.bytes = [c for c in bytes]
+        w_b.setslice(0, bytes)
         return w_b
 
     def initialize_class(self, w_class, interp):
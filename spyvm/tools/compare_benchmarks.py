@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""Compares rsqueak executables on a suite of microbenchmarks.
+
+Usage: python compare_benchmarks.py <suite> <image> <executable> [<executable> ...]
+
+Suites:
+  dispatch    - bytecode dispatch and sends in the plain interpreter loop
+                (the parts of tinyBenchmarks, run with the JIT turned off)
+  arithmetic  - SmallInteger and Float loops of the arithmetic bytecodes
+  largeint    - LargeInteger primitives and the LargeIntegers plugin
+
+Every benchmark runs headless with timer interrupts disabled (-i), the best
+of RUNS runs is reported. Extra arguments for the executables (e.g.
+"-j off") can be given in RSQUEAK_ARGS. Pass the build before a change
+first, the speedup of the other executables is relative to it.
+"""
+import os
+import re
+import subprocess
+import sys
+
+RUNS = 3
+
+SUITES = {
+    "dispatch": (["-j", "off"], [
+        ("bytecodes", "20 timesRepeat: [500 benchmark]"),
+        ("sends", "27 benchFib"),
+    ]),
+    "arithmetic": ([], [
+        ("int_add", "| sum | sum := 0. 1 to: 3000000 do: [:i | sum := sum + i - 7]. sum"),
+        ("int_compare", "| n | n := 0. 1 to: 3000000 do: [:i | (i < 1500000) ifTrue: [n := n + 1]]. n"),
+        ("int_mul_mod", "| x | x := 1. 1 to: 3000000 do: [:i | x := (x * 31 + i) \\\\ 65521]. x"),
+        ("int_bits", "| x | x := 0. 1 to: 3000000 do: [:i | x := (x bitOr: i) bitAnd: 16rFFFF]. x"),
+        ("float_add_mul", "| f | f := 0.0. 1 to: 3000000 do: [:i | f := f * 0.5 + 1.5]. f"),
+        ("float_div_compare", "| f n | f := 1.0e10. n := 0. [f > 1.0] whileTrue: [f := f / 1.0001. n := n + 1]. n"),
+    ]),
+    "largeint": ([], [
+        ("factorial", "20 timesRepeat: [1000 factorial]"),
+        ("raised_to", "1 to: 200 do: [:i | 2 raisedTo: 1000 + i]"),
+        ("big_mul_div", "| x | x := 7 raisedTo: 300. 1 to: 20000 do: [:i | x * x // (x - i)]"),
+        ("mod_exp", "| m | m := (2 raisedTo: 521) - 1. 1 to: 20 do: [:i | (3 + i) raisedTo: m - 2 modulo: m]"),
+        ("gcd", "| a b | a := 30 factorial * 1234567. b := 29 factorial * 7654321. 1 to: 20000 do: [:i | a gcd: b + i]"),
+    ]),
+}
+
+RESULT = re.compile(r"^(\d+)$", re.MULTILINE)
+
+
+def run_once(executable, image, args, code):
+    args = [executable, image, "-i"] + args + os.environ.get("RSQUEAK_ARGS", "").split()
+    args += ["-r", "Time millisecondsToRun: [%s]" % code]
+    pipe = subprocess.Popen(args, stdout=subprocess.PIPE)
+    out, _ = pipe.communicate()
+    match = RESULT.search(out)
+    if not match:
+        raise Exception("Unexpected output from %s:\n%s" % (executable, out))
+    return int(match.group(1))
+
+
+def run(executable, image, args, benchmarks):
+    results = {}
+    for name, code in benchmarks:
+        results[name] = min([run_once(executable, image, args, code) for _ in range(RUNS)])
+    return results
+
+
+def print_table(executables, benchmarks, all_results):
+    print "%-20s" % "benchmark" + "".join(["%18s" % os.path.basename(e) for e in executables])
+    for name, _ in benchmarks:
+        line = "%-20s" % name
+        baseline = all_results[0][name]
+        for results in all_results:
+            line += "%9d ms" % results[name]
+            if results is not all_results[0] and results[name]:
+                line += " %.2fx" % (float(baseline) / results[name])
+            else:
+                line += "      "
+        print line
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 4 or sys.argv[1] not in SUITES:
+        print __doc__
+        sys.exit(1)
+    args, benchmarks = SUITES[sys.argv[1]]
+    image = sys.argv[2]
+    executables = sys.argv[3:]
+    all_results = [run(executable, image, args, benchmarks) for executable in executables]
+    print_table(executables, benchmarks, all_results)
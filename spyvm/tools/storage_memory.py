@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""Estimate the memory used by the storage strategies of a loaded image.
+
+Usage: python storage_memory.py <storage log>
+
+The log is the output of running an image with -L (aggregated storage log),
+e.g. rsqueak -L Squeak.image -r "0" > storage.log. Only the objects filled
+in while loading the image are counted, and the estimate only covers the
+storage of their slots, compared to storing every slot as a pointer.
+"""
+import re
+import sys
+from collections import defaultdict
+
+BYTES_PER_POINTER = 8
+
+# Approximate bytes per slot in a translated 64-bit VM
+BYTES_PER_SLOT = {
+    "ListStrategy": BYTES_PER_POINTER,
+    "WeakListStrategy": 2 * BYTES_PER_POINTER,
+    "SmallIntegerOrNilStrategy": 8,
+    "FloatOrNilStrategy": 8,
+    "CharacterOrNilStrategy": 4,
+    "BooleanOrNilStrategy": 0.25,
+    "AllNilStrategy": 0,
+}
+
+LINE = re.compile(r"^Filledin \((?:\w+ -> )?(\w+)\)(?: of \S+)? size (\d+) objects (\d+)")
+
+
+def parse(lines):
+    slots = defaultdict(int)
+    objects = defaultdict(int)
+    for line in lines:
+        match = LINE.match(line)
+        if match:
+            strategy = match.group(1)
+            slots[strategy] += int(match.group(2))
+            objects[strategy] += int(match.group(3))
+    return slots, objects
+
+
+def report(slots, objects):
+    print "%-28s%12s%12s%14s%14s" % ("strategy", "objects", "slots", "bytes", "saved")
+    total_saved = 0
+    for strategy in sorted(slots, key=lambda s: -slots[s]):
+        per_slot = BYTES_PER_SLOT.get(strategy, BYTES_PER_POINTER)
+        used = int(slots[strategy] * per_slot)
+        saved = slots[strategy] * BYTES_PER_POINTER - used
+        total_saved += saved
+        print "%-28s%12d%12d%14d%14d" % (strategy, objects[strategy], slots[strategy], used, saved)
+    print "Saved compared to pointers only: %.1f KB" % (total_saved / 1024.0)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print __doc__
+        sys.exit(1)
+    with open(sys.argv[1]) as f:
+        report(*parse(f))
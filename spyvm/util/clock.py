@@ -0,0 +1,87 @@
+"""Clock sources of the VM.
+
+The millisecond clock used for Delays and interrupt checks is monotonic, so
+adjusting the system time (e.g. by NTP) does not make Delays fire early or
+hang. The microsecond clocks answer the wall-clock time since the Squeak
+epoch (1 January 1901).
+"""
+import time
+
+from rpython.rlib import rtime
+from rpython.rlib.rarithmetic import r_longlong
+from rpython.rtyper.lltypesystem import lltype, rffi
+from rpython.translator.tool.cbuild import ExternalCompilationInfo
+
+MICROSECONDS_BETWEEN_1901_AND_1970 = r_longlong((69 * 365 + 17) * 24 * 3600) * 1000000
+
+if rtime.HAS_CLOCK_GETTIME:
+    MONOTONIC = rtime.CLOCK_MONOTONIC
+    if rtime.CLOCK_MONOTONIC_COARSE is not None:
+        # Only a few ns to read, but just as precise as the kernel tick
+        MONOTONIC_COARSE = rtime.CLOCK_MONOTONIC_COARSE
+    else:
+        MONOTONIC_COARSE = rtime.CLOCK_MONOTONIC
+    REALTIME = rtime.CLOCK_REALTIME
+
+    def _microseconds(clock_id):
+        with lltype.scoped_alloc(rtime.TIMESPEC) as ts:
+            rtime.c_clock_gettime(clock_id, ts)
+            return (r_longlong(rffi.getintfield(ts, 'c_tv_sec')) * 1000000 +
+                    r_longlong(rffi.getintfield(ts, 'c_tv_nsec')) / 1000)
+else:
+    # No clock_gettime (Windows, OS X), fall back to the wall clock.
+    MONOTONIC = MONOTONIC_COARSE = REALTIME = 0
+
+    def _microseconds(clock_id):
+        return r_longlong(time.time() * 1000000)
+
+eci = ExternalCompilationInfo(
+    includes=['time.h'],
+    post_include_bits=['RPY_EXTERN long RSqueakUTCOffset(long);'],
+    separate_module_sources=["""
+    #include <time.h>
+    RPY_EXTERN long RSqueakUTCOffset(long seconds)
+    {
+    #ifdef _WIN32
+        long offset;
+        _get_timezone(&offset);
+        return -offset;
+    #else
+        time_t t = (time_t)seconds;
+        struct tm local;
+        localtime_r(&t, &local);
+        return local.tm_gmtoff;
+    #endif
+    }
+    """]
+)
+_utc_offset = rffi.llexternal('RSqueakUTCOffset', [rffi.LONG], rffi.LONG,
+                              compilation_info=eci, releasegil=False)
+
+
+def monotonic_microseconds():
+    return _microseconds(MONOTONIC)
+
+def monotonic_milliseconds():
+    """Cheap monotonic clock with the resolution of the kernel tick."""
+    return _microseconds(MONOTONIC_COARSE) / 1000
+
+class _ProcessStartup(object):
+    milliseconds = r_longlong(-1)
+_process_startup = _ProcessStartup()
+
+def startup_milliseconds():
+    """The monotonic clock when it was first read by this process. Origin of
+    the millisecond clock of interpreters that were not started on an image."""
+    if _process_startup.milliseconds < 0:
+        _process_startup.milliseconds = monotonic_milliseconds()
+    return _process_startup.milliseconds
+
+def utc_microseconds():
+    return _microseconds(REALTIME) + MICROSECONDS_BETWEEN_1901_AND_1970
+
+def local_microseconds():
+    utc = utc_microseconds()
+    seconds_since_1970 = (utc - MICROSECONDS_BETWEEN_1901_AND_1970) / 1000000
+    offset = _utc_offset(rffi.cast(rffi.LONG, seconds_since_1970))
+    return utc + r_longlong(rffi.cast(lltype.Signed, offset)) * 1000000
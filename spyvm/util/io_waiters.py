@@ -0,0 +1,48 @@
+import time
+
+from rpython.rlib import rpoll
+
+HAS_POLL = hasattr(rpoll, 'poll')
+if HAS_POLL:
+    READABLE = rpoll.POLLIN
+    WRITABLE = rpoll.POLLOUT
+else:
+    READABLE = 1
+    WRITABLE = 4
+
+
+class IOWaiters(object):
+    """Semaphores waiting for file descriptors to become ready. Each file
+    descriptor has at most one semaphore, which is signaled once and then
+    forgotten."""
+
+    def __init__(self):
+        self.events = {}
+        self.semaphores_w = {}
+
+    def size(self):
+        return len(self.events)
+
+    def add(self, fd, events, w_semaphore):
+        self.events[fd] = events
+        self.semaphores_w[fd] = w_semaphore
+
+    def remove(self, fd):
+        if fd not in self.events:
+            return None
+        del self.events[fd]
+        return self.semaphores_w.pop(fd)
+
+    def poll(self, timeout):
+        """Answer the file descriptors that are ready, blocking for at most
+        timeout milliseconds (0 does not block)."""
+        assert timeout >= 0
+        if not HAS_POLL:
+            if timeout > 0:
+                time.sleep(timeout / 1000.0)
+            return []
+        try:
+            ready = rpoll.poll(self.events, timeout)
+        except rpoll.PollError:
+            return [] # e.g. interrupted by a signal
+        return [fd for fd, _ in ready]
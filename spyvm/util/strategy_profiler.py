@@ -0,0 +1,114 @@
+"""
+Profile of the storage strategy switches of a run, enabled with
+--strategy-profile. Switches are counted per (class, old strategy, new
+strategy, class of the stored element), together with the number of elements
+copied and the allocation sites of the switching objects. The profile is
+written as JSON when the VM exits.
+"""
+import os
+
+from rpython.rlib.listsort import make_timsort_class
+from rpython.rlib.rweakref import RWeakKeyDictionary
+
+from spyvm import model
+
+class AllocationSite(object):
+    _attrs_ = ['w_method', 'pc']
+    _immutable_fields_ = ['w_method', 'pc']
+
+    def __init__(self, w_method, pc):
+        self.w_method = w_method
+        self.pc = pc
+
+    def describe(self):
+        return "%s @ pc %d" % (self.w_method.get_identifier_string(), self.pc)
+
+class Transition(object):
+    _attrs_ = ['classname', 'old_strategy', 'new_strategy', 'element_classname',
+               'count', 'elements', 'sites']
+
+    def __init__(self, classname, old_strategy, new_strategy, element_classname):
+        self.classname = classname
+        self.old_strategy = old_strategy
+        self.new_strategy = new_strategy
+        self.element_classname = element_classname
+        self.count = 0
+        self.elements = 0
+        self.sites = {}
+
+    def add(self, size, site):
+        self.count += 1
+        self.elements += size
+        self.sites[site] = self.sites.get(site, 0) + 1
+
+TransitionSort = make_timsort_class(lt=lambda a, b: a.count > b.count)
+
+def json_string(s):
+    result = ['"']
+    for c in s:
+        if c == '"' or c == '\\':
+            result.append('\\' + c)
+        elif ord(c) < 0x20 or ord(c) > 0x7e:
+            result.append('\\u%04x' % ord(c))
+        else:
+            result.append(c)
+    result.append('"')
+    return "".join(result)
+
+class StrategyProfiler(object):
+    _attrs_ = ['active', 'path', 'transitions', 'sites']
+    _immutable_fields_ = ['active?', 'path?']
+
+    def __init__(self):
+        self.active = False
+        self.path = ""
+        self.transitions = {}
+        self.sites = RWeakKeyDictionary(model.W_Object, AllocationSite)
+
+    def activate(self, path):
+        self.active = True
+        self.path = path
+
+    def record_allocation(self, w_object, s_frame):
+        self.sites.set(w_object, AllocationSite(s_frame.w_method(), s_frame.pc()))
+
+    def record_switch(self, w_self, old_strategy, new_strategy, element_classname, size):
+        classname = w_self.guess_classname()
+        key = (classname, old_strategy, new_strategy, element_classname)
+        transition = self.transitions.get(key, None)
+        if transition is None:
+            transition = Transition(classname, old_strategy, new_strategy, element_classname)
+            self.transitions[key] = transition
+        site = self.sites.get(w_self)
+        transition.add(size, site.describe() if site is not None else "?")
+
+    def sorted_transitions(self):
+        transitions = self.transitions.values()
+        TransitionSort(transitions).sort()
+        return transitions
+
+    def to_json(self):
+        entries = []
+        for transition in self.sorted_transitions():
+            sites = ["%s: %d" % (json_string(site), count)
+                     for site, count in transition.sites.items()]
+            entries.append('{"class": %s, "from": %s, "to": %s, "element": %s, '
+                           '"count": %d, "elements_copied": %d, "sites": {%s}}' % (
+                json_string(transition.classname),
+                json_string(transition.old_strategy),
+                json_string(transition.new_strategy),
+                json_string(transition.element_classname),
+                transition.count, transition.elements, ", ".join(sites)))
+        return '{"transitions": [\n%s\n]}\n' % ",\n".join(entries)
+
+    def dump(self):
+        if not self.active:
+            return
+        try:
+            fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0644)
+            try:
+                os.write(fd, self.to_json())
+            finally:
+                os.close(fd)
+        except OSError:
+            os.write(2, "Could not write the strategy profile to %s\n" % self.path)
@@ -1,4 +1,9 @@
-from rpython.rlib import streamio
+import os
+
+from rpython.rlib import rmmap, streamio
+from rpython.rlib.objectmodel import we_are_translated
+
+O_BINARY = getattr(os, "O_BINARY", 0)
 
 def chrs2int(b):
     assert len(b) == 4
@@ -32,16 +37,25 @@ def swapped_chrs2long(b):
 
 class Stream(object):
     """ Simple input stream.
-    Data is completely read into memory.
+    Files are mapped into memory read-only, words and bytes are decoded
+    lazily from the mapping. If the file cannot be mapped, or the stream is
+    created from an open file or a string, the data is read into memory.
     Constructor can raise OSError. """
     
     def __init__(self, filename=None, inputfile=None, data=None):
+        self.mmap = None
+        self.data = ""
         if filename:
-            f = streamio.open_file_as_stream(filename, mode="rb", buffering=0)
-            try:
-                self.data = f.readall()
-            finally:
-                f.close()
+            if we_are_translated():
+                # Untranslated, every access to the mapping goes through
+                # ll2ctypes, which is much slower than reading the file.
+                self.mmap = map_file(filename)
+            if self.mmap is None:
+                f = streamio.open_file_as_stream(filename, mode="rb", buffering=0)
+                try:
+                    self.data = f.readall()
+                finally:
+                    f.close()
         elif inputfile:
             try:
                 self.data = inputfile.read()
@@ -53,21 +67,34 @@ class Stream(object):
             raise RuntimeError("need to supply either inputfile or data")
         
         self.reset()
-    
-    def peek(self):
-        if self.pos >= len(self.data):
+
+    def getslice(self, start, stop):
+        assert 0 <= start <= stop <= self.length()
+        if self.mmap is not None:
+            return self.mmap.getslice(start, stop - start)
+        return self.data[start:stop]
+
+    def word_at(self, pos):
+        """ Decode the word starting at byte position pos, without moving
+        the stream. """
+        if pos + self.word_size > self.length():
             raise IndexError
-        data_peek = self.data[self.pos:self.pos + self.word_size]
+        data = self.getslice(pos, pos + self.word_size)
         if self.use_long_read:
             if self.big_endian:
-                return chrs2long(data_peek)
+                return chrs2long(data)
             else:
-                return swapped_chrs2long(data_peek)
+                return swapped_chrs2long(data)
         else:
             if self.big_endian:
-                return chrs2int(data_peek)
+                return chrs2int(data)
             else:
-                return swapped_chrs2int(data_peek)
+                return swapped_chrs2int(data)
+
+    def peek(self):
+        if self.pos >= self.length():
+            raise IndexError
+        return self.word_at(self.pos)
 
     def next(self):
         integer = self.peek()
@@ -85,22 +112,23 @@ class Stream(object):
         self.count = 0
 
     def skipbytes(self, jump):
-        assert jump > 0
-        assert (self.pos + jump) <= len(self.data)
+        assert jump >= 0
+        assert (self.pos + jump) <= self.length()
         self.pos += jump
         self.count += jump
 
     def skipwords(self, jump):
         self.skipbytes(jump * self.word_size)
-        assert (self.pos + jump) <= len(self.data)
-        self.pos += jump
-        self.count += jump
 
     def length(self):
+        if self.mmap is not None:
+            return self.mmap.len()
         return len(self.data)
 
     def close(self):
-        pass # already closed
+        if self.mmap is not None:
+            self.mmap.close()
+            self.mmap = None
 
     def be_64bit(self):
         self.word_size = 8
@@ -109,3 +137,18 @@ class Stream(object):
     def be_32bit(self):
         self.word_size = 4
         self.use_long_read = False
+
+def map_file(filename):
+    """ Map the file read-only, or return None if it cannot be mapped
+    (e.g. it is empty or not a regular file). """
+    try:
+        fd = os.open(filename, os.O_RDONLY | O_BINARY, 0)
+    except OSError:
+        return None
+    try:
+        try:
+            return rmmap.mmap(fd, 0, access=rmmap.ACCESS_READ)
+        except (rmmap.RMMapError, OSError):
+            return None
+    finally:
+        os.close(fd)
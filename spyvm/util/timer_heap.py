@@ -0,0 +1,84 @@
+class TimerHeap(object):
+    """Binary min-heap of timers, ordered by their deadline (a millisecond
+    tick as answered by Interpreter.time_now). Every timer has an id, which
+    can be used to cancel it before it expires."""
+
+    def __init__(self):
+        self.deadlines = []
+        self.ids = []
+        self.items_w = []
+        self.indices = {} # timer id -> its index in the heap
+        self.next_id = 1
+
+    def size(self):
+        return len(self.deadlines)
+
+    def add(self, deadline, w_item):
+        timer_id = self.next_id
+        self.next_id += 1
+        self.deadlines.append(deadline)
+        self.ids.append(timer_id)
+        self.items_w.append(w_item)
+        self.indices[timer_id] = self.size() - 1
+        self._sift_up(self.size() - 1)
+        return timer_id
+
+    def cancel(self, timer_id):
+        i = self.indices.get(timer_id, -1)
+        if i < 0:
+            return False
+        self._remove_at(i)
+        return True
+
+    def next_deadline(self):
+        assert self.size() > 0
+        return self.deadlines[0]
+
+    def has_expired(self, now):
+        return self.size() > 0 and self.deadlines[0] <= now
+
+    def pop(self):
+        w_item = self.items_w[0]
+        self._remove_at(0)
+        return w_item
+
+    def _remove_at(self, i):
+        last = self.size() - 1
+        if i != last:
+            self._swap(i, last)
+        self.deadlines.pop()
+        del self.indices[self.ids.pop()]
+        self.items_w.pop()
+        if i < last:
+            self._sift_down(i)
+            self._sift_up(i)
+
+    def _swap(self, i, j):
+        self.deadlines[i], self.deadlines[j] = self.deadlines[j], self.deadlines[i]
+        self.ids[i], self.ids[j] = self.ids[j], self.ids[i]
+        self.items_w[i], self.items_w[j] = self.items_w[j], self.items_w[i]
+        self.indices[self.ids[i]] = i
+        self.indices[self.ids[j]] = j
+
+    def _sift_up(self, i):
+        while i > 0:
+            parent = (i - 1) >> 1
+            if self.deadlines[parent] <= self.deadlines[i]:
+                break
+            self._swap(i, parent)
+            i = parent
+
+    def _sift_down(self, i):
+        size = self.size()
+        while True:
+            smallest = i
+            left = 2 * i + 1
+            right = left + 1
+            if left < size and self.deadlines[left] < self.deadlines[smallest]:
+                smallest = left
+            if right < size and self.deadlines[right] < self.deadlines[smallest]:
+                smallest = right
+            if smallest == i:
+                break
+            self._swap(i, smallest)
+            i = smallest
@@ -0,0 +1,86 @@
+import sys
+
+from rpython.rlib import rgc
+from rpython.rlib.rarithmetic import r_uint
+from rpython.rtyper.lltypesystem import lltype, rffi
+
+UINTARRAY = rffi.CArray(rffi.UINT)
+IS_LITTLE_ENDIAN = sys.byteorder == 'little'
+
+
+class WordBuffer(object):
+    """Raw, non-moving array of 32-bit words. Used as the storage of words
+    objects and display bitmaps, so the words can be handed to C code (and
+    shared between objects) without copying."""
+    _immutable_fields_ = ['ptr', 'size']
+
+    def __init__(self, size):
+        assert size >= 0
+        self.size = size
+        self.ptr = lltype.malloc(UINTARRAY, size, flavor='raw', zero=True,
+                                 add_memory_pressure=True)
+
+    @staticmethod
+    def from_list(words):
+        buf = WordBuffer(len(words))
+        for i in range(len(words)):
+            buf.ptr[i] = rffi.cast(rffi.UINT, words[i])
+        return buf
+
+    def get(self, n0):
+        return r_uint(self.ptr[n0])
+
+    def set(self, n0, word):
+        self.ptr[n0] = rffi.cast(rffi.UINT, word)
+
+    def to_list(self):
+        return [self.get(i) for i in range(self.size)]
+
+    def copy(self):
+        buf = WordBuffer(self.size)
+        buf.copy_from(self, 0, self.size, 0)
+        return buf
+
+    def fill(self, start, stop, word):
+        assert 0 <= start <= stop <= self.size
+        if word == 0:
+            rffi.c_memset(rffi.cast(rffi.VOIDP, rffi.ptradd(self.ptr, start)),
+                          0, (stop - start) * 4)
+        else:
+            value = rffi.cast(rffi.UINT, word)
+            for i in range(start, stop):
+                self.ptr[i] = value
+
+    def copy_from(self, source, start, stop, src_start):
+        """Copy the words from src_start on of source into start..stop
+        (exclusive). Overlapping ranges within one buffer are fine."""
+        count = stop - start
+        assert 0 <= start <= stop <= self.size
+        assert 0 <= src_start and src_start + count <= source.size
+        if source is not self:
+            rffi.c_memcpy(rffi.cast(rffi.VOIDP, rffi.ptradd(self.ptr, start)),
+                          rffi.cast(rffi.VOIDP, rffi.ptradd(source.ptr, src_start)),
+                          count * 4)
+        elif start < src_start:
+            for i in range(count):
+                self.ptr[start + i] = self.ptr[src_start + i]
+        elif start > src_start:
+            for i in range(count - 1, -1, -1):
+                self.ptr[start + i] = self.ptr[src_start + i]
+
+    def as_string(self):
+        """The words as little-endian bytes."""
+        if IS_LITTLE_ENDIAN:
+            return rffi.charpsize2str(rffi.cast(rffi.CCHARP, self.ptr), self.size * 4)
+        res = []
+        for i in range(self.size):
+            word = self.get(i)
+            res.append(chr(word & r_uint(0x000000ff)))
+            res.append(chr((word & r_uint(0x0000ff00)) >> 8))
+            res.append(chr((word & r_uint(0x00ff0000)) >> 16))
+            res.append(chr((word & r_uint(0xff000000)) >> 24))
+        return "".join(res)
+
+    @rgc.must_be_light_finalizer
+    def __del__(self):
+        lltype.free(self.ptr, flavor='raw')
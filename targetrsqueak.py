@@ -10,7 +10,7 @@ sys.setrecursionlimit(15000)
 
 def _usage(argv):
     print """
-    Usage: %s <path> [-r|-m|-h] [-naPu] [-jpiS] [-tTslL]
+    Usage: %s <path> [-r|-m|-h] [-naPu] [-jpiSQ] [-tTslL]
             <path> - image path (default: Squeak.image)
 
           Execution mode:
@@ -52,6 +52,8 @@ def _usage(argv):
                                  Disables non-cooperative scheduling.
             -S                 - Disable specialized storage strategies.
                                  always use generic ListStrategy.
+            -Q|--quicken       - Execute common bytecode sequences as fused
+                                 superinstructions when not jitted.
             --hacks            - Enable Spy hacks. Set display color depth to 8
             --use-plugins      - Directs named primitives to go to the native
                                  Squeak plugins, which must be in the dynamic
@@ -67,6 +69,10 @@ def _usage(argv):
             -l|--storage-log - Output a log of storage operations.
             -L               - Output an aggregated storage log at the end of
                                execution.
+            --strategy-profile <file>
+                             - Write a JSON profile of the storage strategy
+                               switches, with their allocation sites, to
+                               file at the end of execution.
     """ % argv[0]
 
 def get_parameter(argv, idx, arg):
@@ -103,6 +109,7 @@ def safe_entry_point(argv):
         return -1
     finally:
         prebuilt_space.strategy_factory.logger.print_aggregated_log()
+        prebuilt_space.strategy_factory.profiler.dump()
 
 def entry_point(argv):
     jit.set_param(None, "trace_limit", 1000000)
@@ -117,6 +124,7 @@ def entry_point(argv):
     # == Other parameters
     poll = False
     interrupts = True
+    quicken = False
     trace = False
     trace_important = False
 
@@ -159,6 +167,8 @@ def entry_point(argv):
                 space.use_plugins.activate()
             elif arg in ["-S"]:
                 space.strategy_factory.no_specialized_storage.activate()
+            elif arg in ["-Q", "--quicken"]:
+                quicken = True
             elif arg in ["-u"]:
                 from spyvm.plugins.vmdebugging import stop_ui_process
                 stop_ui_process()
@@ -166,6 +176,9 @@ def entry_point(argv):
                 space.strategy_factory.logger.activate()
             elif arg in ["-L"]:
                 space.strategy_factory.logger.activate(aggregate=True)
+            elif arg in ["--strategy-profile"]:
+                profile_path, idx = get_parameter(argv, idx, arg)
+                space.strategy_factory.profiler.activate(profile_path)
             elif path is None:
                 path = arg
             else:
@@ -203,10 +216,12 @@ def entry_point(argv):
         return 1
 
     # Load & prepare image and environment
-    image = squeakimage.ImageReader(space, stream).create_image()
+    reader = squeakimage.ImageReader(space, stream)
+    image = reader.create_image()
+    reader.close()
     interp = interpreter.Interpreter(space, image,
                 trace=trace, trace_important=trace_important,
-                evented=not poll, interrupts=interrupts)
+                evented=not poll, interrupts=interrupts, quicken=quicken)
     space.runtime_setup(argv, path)
 
     interp.populate_remaining_special_objects()